@@ -1,11 +1,38 @@
 # AutoMarker by acrilique.
 # This script is a Qt version of the original automarker.py script by acrilique.
-from PySide6.QtCore import QThread, Signal, Qt, QRect, QLineF, QPointF, QSize, QTimer
+import time
+
+class StartupTimer(object):
+    """Measures how long each startup phase takes. Created first thing so imports are accounted for."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.phases = []
+
+    def mark(self, name):
+        """Close the current phase, naming it."""
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def record(self, name, seconds):
+        """Record work that ran outside of the startup sequence (deferred probes)."""
+        self.phases.append((name, seconds))
+
+    def total(self):
+        return self.last - self.start
+
+    def report(self):
+        lines = [f"{name:<28}{seconds * 1000:9.1f} ms" for name, seconds in self.phases]
+        lines.append(f"{'window shown after':<28}{self.total() * 1000:9.1f} ms")
+        return "\n".join(lines)
+
+startup_timer = StartupTimer()
+
+from PySide6.QtCore import QThread, QThreadPool, QRunnable, QObject, Signal, Qt, QRect, QRectF, QLineF, QPointF, QSize, QTimer
 from PySide6.QtWidgets import QApplication, QMainWindow, QFileDialog, QDialog, QSlider, QComboBox, QPushButton, QLabel, QTextEdit, QSpinBox, QScrollBar, QHBoxLayout, QVBoxLayout, QSizePolicy, QGroupBox, QWidget, QFrame
-from PySide6.QtGui import QIcon, QPainter, QColor, QLinearGradient, QGradient, QFontDatabase, QFont, QBrush, QPalette
-import librosa
-import sounddevice as sd
-import requests
+from PySide6.QtGui import QIcon, QPainter, QPixmap, QColor, QLinearGradient, QGradient, QFontDatabase, QFont, QBrush, QPalette
 import numpy as np
 import os
 import sys
@@ -13,9 +40,15 @@ import re
 import json
 import subprocess
 import platform
-import time
 import tempfile
+import threading
+import multiprocessing
+import select
+import uuid
 from packaging.version import parse
+from automarker_core import AnalysisCache, PeakStore, PeakPyramid, OnsetAccumulator, read_only_view, times_to_frames, MarkerTracker, BeatGrid, TempoMap, SpanTimer, ChunkedBeatTracker, beat_tracker_for, load_audio, decode_in_worker, is_compressed, stream_info, stream_audio_blocks, resample_mono, compute_onset_envelope, analysis_params, get_beat_engine, BEAT_ENGINES, DEFAULT_BEAT_ENGINE, DEFAULT_ANALYSIS_SAMPLE_RATE, RESAMPLER_PRESETS, DEFAULT_RESAMPLER
+
+startup_timer.mark("imports")
 
 ###############################
 ###############################
@@ -24,10 +57,11 @@ from packaging.version import parse
 #  - Check what system are we in (Windows or macOS)
 #  - Set the environment variables
 #  - Set the basedir variable to the directory where the script is located
-#  - Install premiere and blender extensions if needed
 #  - Set the custom font
 #  - Set the constants
 #  Note: basedir isn't a constant because its location is decided at runtime
+#  Note: installing the extensions and probing the audio device are deferred until the window is shown,
+#  see install_extension_if_needed and get_sample_rate.
 ###############################
 
 if platform.system().lower() == "windows":
@@ -42,6 +76,8 @@ else:
     RESOLVE_SCRIPT_API = "/Library/Application Support/Blackmagic Design/DaVinci Resolve/Developer/Scripting"
     RESOLVE_SCRIPT_LIB = "/Applications/DaVinci Resolve/DaVinci Resolve.app/Contents/Libraries/Fusion/fusionscript.so"
     PYTHONPATH = "$PYTHONPATH:$RESOLVE_SCRIPT_API/Modules/"
+# Linux has no host apps, but /proc lets the process checks skip spawning pgrep.
+LINUX_SYSTEM = platform.system().lower() == "linux"
 
 # Set the environment variables
 os.environ["RESOLVE_SCRIPT_API"] = RESOLVE_SCRIPT_API
@@ -61,34 +97,61 @@ try:
 except ImportError:
     pass
 
-try:
-    flag_path = os.path.join(os.path.expanduser("~"), 'AutoMarker', 'flag.txt')
-    with open(flag_path, 'r') as flag_file:
-        flag_content = flag_file.read().strip()
-except FileNotFoundError:
-    # If the file is not found, treat it as not installed
-    flag_content = "not_installed"
-
-if flag_content == "not_installed":
-    # Execute the batch script
-    if WINDOWS_SYSTEM:
-        subprocess.run([os.path.join(basedir, 'extension_installer_win.bat')])
-    else:
-        script_path = os.path.join(basedir, 'extension_installer_mac.sh')
-        subprocess.run(['chmod', '+x', script_path])
-        subprocess.run([script_path])
-    os.makedirs(os.path.dirname(flag_path), exist_ok=True)
-    # Update the flag.txt file to indicate that the script has been executed, erasing old text
-    with open(flag_path, 'w') as flag_file:
-        flag_file.write("installed")
-        flag_file.close()
+def install_extension_if_needed():
+    """Install the Premiere extension the first time AutoMarker runs. Blocks while the installer runs."""
+    try:
+        flag_path = os.path.join(os.path.expanduser("~"), 'AutoMarker', 'flag.txt')
+        with open(flag_path, 'r') as flag_file:
+            flag_content = flag_file.read().strip()
+    except FileNotFoundError:
+        # If the file is not found, treat it as not installed
+        flag_content = "not_installed"
+
+    if flag_content == "not_installed":
+        # Execute the batch script
+        if WINDOWS_SYSTEM:
+            subprocess.run([os.path.join(basedir, 'extension_installer_win.bat')])
+        else:
+            script_path = os.path.join(basedir, 'extension_installer_mac.sh')
+            subprocess.run(['chmod', '+x', script_path])
+            subprocess.run([script_path])
+        os.makedirs(os.path.dirname(flag_path), exist_ok=True)
+        # Update the flag.txt file to indicate that the script has been executed, erasing old text
+        with open(flag_path, 'w') as flag_file:
+            flag_file.write("installed")
+            flag_file.close()
 
 def get_default_device_sample_rate():
+    import sounddevice as sd
     default_device = sd.default.device
     default_samplerate = sd.query_devices(default_device, 'output')['default_samplerate']
     return int(default_samplerate)
- 
-SAMPLE_RATE = get_default_device_sample_rate()
+
+# Timing spans of the session, see Help > Timing report. main() opens the JSON log if asked to.
+timing = SpanTimer()
+
+FALLBACK_SAMPLE_RATE = 44100
+_sample_rate = None
+_sample_rate_lock = threading.Lock()
+
+def get_sample_rate():
+    """
+    Sample rate of the default output device. Probed on first use, since initializing PortAudio is slow.
+
+    :return: (int) sample rate
+    """
+    global _sample_rate
+    with _sample_rate_lock:
+        if _sample_rate is None:
+            start = time.perf_counter()
+            try:
+                _sample_rate = get_default_device_sample_rate()
+            except Exception as e:
+                print(e)
+                _sample_rate = FALLBACK_SAMPLE_RATE
+            startup_timer.record("audio device probe", time.perf_counter() - start)
+        return _sample_rate
+
 CREATE_NO_WINDOW = 0x08000000
 PREMIERE_PROCESS_NAME = "adobe premiere pro.exe" if WINDOWS_SYSTEM else "Adobe Premiere Pro"
 AFTERFX_PROCESS_NAME = "AfterFX.exe" if WINDOWS_SYSTEM else "After Effects"
@@ -156,6 +219,8 @@ def _get_pids_from_name(process_name):
     :param process_name: (str) process name (ex : 'pycharm64.exe' for windows or 'Safari' for mac)
     :return: (list of int) pids
     """
+    if LINUX_SYSTEM:
+        return ProcessSnapshot().pids(process_name)
     if WINDOWS_SYSTEM:
         # use tasklist windows command with filter by name
         call = 'TASKLIST', '/FI', 'imagename eq {}'.format(process_name)
@@ -181,6 +246,107 @@ def _get_pids_from_name(process_name):
 
         return list(map(int, lines))
 
+class ProcessSnapshot(object):
+    """
+    One read of the process table, so several hosts can be looked up without listing processes again.
+    Matching follows _get_pids_from_name: image name prefix on Windows, anywhere in the command line elsewhere (like pgrep -f).
+    """
+
+    def __init__(self):
+        start = time.perf_counter()
+        self.processes = self._list_processes()
+        self.seconds = time.perf_counter() - start
+
+    def _list_processes(self):
+        """
+        :return: (list of (int, str)) pid and image name (lowercase, Windows) or command line of every process
+        """
+        processes = []
+        if LINUX_SYSTEM:
+            # Reading /proc directly, no process spawned.
+            for entry in os.listdir('/proc'):
+                if not entry.isdigit():
+                    continue
+                try:
+                    with open(f'/proc/{entry}/cmdline', 'rb') as f:
+                        command = f.read().replace(b'\0', b' ').strip()
+                except OSError:  # exited while we were listing
+                    continue
+                processes.append((int(entry), command.decode(errors='replace')))
+        elif WINDOWS_SYSTEM:
+            output = subprocess.check_output(('TASKLIST', '/FO', 'CSV', '/NH'), creationflags=CREATE_NO_WINDOW)
+            for line in output.decode(encoding="437").splitlines():
+                fields = line.strip().strip('"').split('","')
+                if len(fields) > 1 and fields[1].isdigit():
+                    processes.append((int(fields[1]), fields[0].lower()))
+        else:
+            output = subprocess.check_output(["ps", "-axo", "pid=,command="])
+            for line in output.decode(errors='replace').splitlines():
+                pid, _, command = line.strip().partition(' ')
+                if pid.isdigit():
+                    processes.append((int(pid), command))
+        return processes
+
+    def pids(self, process_name):
+        if WINDOWS_SYSTEM:
+            name = process_name.lower()
+            return [pid for pid, image in self.processes if image.startswith(name)]
+        return [pid for pid, command in self.processes if process_name in command]
+
+    def host_status(self):
+        """
+        :return: (str) "1" Premiere, "2" After Effects, "3" Resolve, "0" none, same priority as the host checks above
+        """
+        for status, process_name in (("1", PREMIERE_PROCESS_NAME), ("2", AFTERFX_PROCESS_NAME), ("3", RESOLVE_PROCESS_NAME)):
+            if self.pids(process_name):
+                return status
+        return "0"
+
+class ProcessDiscovery(object):
+    """
+    Polls the host status from one process snapshot per tick.
+    The poll interval grows while nothing changes and drops back to min_interval on a transition.
+    """
+
+    def __init__(self, min_interval=1.0, max_interval=8.0, backoff=1.5):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self.status = None
+        self.snapshots = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.last_seconds = 0.0
+
+    def poll(self):
+        """
+        Take a snapshot and update the interval
+
+        :return: (str) new host status, None if it didn't change
+        """
+        snapshot = ProcessSnapshot()
+        self.snapshots += 1
+        self.last_seconds = snapshot.seconds
+        self.total_seconds += snapshot.seconds
+        self.max_seconds = max(self.max_seconds, snapshot.seconds)
+        status = snapshot.host_status()
+        if status == self.status:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+            return None
+        self.status = status
+        self.interval = self.min_interval
+        return status
+
+    def stats(self):
+        return {
+            "snapshots": self.snapshots,
+            "last_ms": self.last_seconds * 1000,
+            "mean_ms": self.total_seconds / self.snapshots * 1000 if self.snapshots else 0.0,
+            "max_ms": self.max_seconds * 1000,
+            "interval": self.interval,
+        }
+
 def _get_last_exe_mac(app_name):
     """
     MACOS ONLY
@@ -258,9 +424,74 @@ def _get_installed_softwares_info(name_filter, names=["DisplayVersion", "Install
 # INTERFACES TO HANDLE THE COMMUNICATION WITH THE APPS
 ###########################################
 # AE interface
+# Seconds readReturn waits for After Effects before giving up.
+AE_RETURN_TIMEOUT = 30.0
+# Seconds a queued operation waits for others to join its batch before the queue runs it by itself.
+AE_FLUSH_DEADLINE = 0.05
+
+class ReturnFileWaiter(object):
+    """
+    Sleeps until a file in a folder is written. Uses inotify on Linux, short sleeps between checks elsewhere.
+    """
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+
+    def __init__(self, folder, poll_interval=0.05):
+        self.poll_interval = poll_interval
+        self._fd = None
+        if LINUX_SYSTEM:
+            try:
+                self._fd = self._inotify_watch(folder)
+            except OSError as e:
+                print(e)
+
+    def _inotify_watch(self, folder):
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(fd, os.fsencode(folder), self.IN_CLOSE_WRITE | self.IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, f"Could not watch {folder}")
+        return fd
+
+    def wait(self, ready, timeout):
+        """
+        Wait until ready() is true
+
+        :param ready: (callable) checks the file, called after every change
+        :param timeout: (float) seconds
+        :return: (bool) False if the timeout expired first
+        """
+        deadline = time.perf_counter() + timeout
+        while not ready():
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return False
+            if self._fd is not None:
+                if select.select([self._fd], [], [], remaining)[0]:
+                    try:
+                        os.read(self._fd, 4096)  # drain the events, ready() looks at the file itself
+                    except BlockingIOError:
+                        pass
+            else:
+                time.sleep(min(self.poll_interval, remaining))
+        return True
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
 class AE_JSWrapper(object):
-    def __init__(self, aeVersion = "", returnFolder = ""):
+    def __init__(self, aeVersion = "", returnFolder = "", runner = None):
         self.aeVersion = aeVersion
+        # Starts the processes that hand scripts to AE. Takes the command line, returns something with wait()
+        # and kill(), so it can be replaced by a stub.
+        self.runner = runner if runner is not None else subprocess.Popen
 
         # Try to find last AE version if value is not specified. Currently 24.0 is the last version.
         if not len(self.aeVersion):
@@ -310,9 +541,17 @@ class AE_JSWrapper(object):
         with open(self.returnFile, 'w') as f:
                 f.close()  
             
-        # Establish the last time the temp file was modified. We use this to listen for changes. 
-        self.lastModTime = os.path.getmtime(self.returnFile)         
-        
+        # Watch the folder before any command runs, so a fast return can't be missed.
+        self.returnWaiter = ReturnFileWaiter(returnFolder)
+        self.returnTimeout = AE_RETURN_TIMEOUT
+        # Every command group gets an id, written back with its result, so an old result is never read as a new one.
+        self.commandId = uuid.uuid4().hex
+        self.commandStart = None
+        # Whether the last launcher is a helper process that can be killed, see jsExecuteCommand.
+        self.launcherOwned = True
+        # (command id, seconds from execution to result) of the commands that returned something.
+        self.latencies = []
+
         # Temp file to store the .jsx commands. 
         self.tempJsxFile = os.path.join(returnFolder, "ae_temp_com.jsx")
         
@@ -322,27 +561,41 @@ class AE_JSWrapper(object):
     def openAE(self):
         """Pass the commands to the subprocess module."""    
         target = [self.aeApp]
-        ret = subprocess.Popen(target)
+        ret = self.runner(target)
     
     # This group of helper functions are used to build and execute a jsx file.
     def jsNewCommandGroup(self):
         """clean the commands list. Called before making a new list of commands"""
         self.commands = []
+        self.commandId = uuid.uuid4().hex
+
+    def jsWriteCommands(self):
+        """Write the commands list to the temp .jsx file."""
+        with open(self.tempJsxFile, 'w') as f:
+            f.write("\n".join(self.commands))
 
     def jsExecuteCommand(self):
+        """
+        Run the temp .jsx file in AE
+
+        :return: launcher process, waiting on it tells when AE has taken the script. launcherOwned tells
+                 whether it is a helper of ours, or AfterFX.exe itself, which may stay running as After Effects.
+        """
+        self.commandStart = time.perf_counter()
         if WINDOWS_SYSTEM:
             target = [self.aeApp, "-ro", self.tempJsxFile]
+            self.launcherOwned = False
         else:
             # Get the absolute path to the JSX file
             jsx_file_path = os.path.abspath(self.tempJsxFile)
             
             # Activate After Effects
-            subprocess.Popen(['osascript', '-e', f'tell application "Adobe After Effects {self.aeVersion}" to activate'])
-            time.sleep(0.1)  # Wait for After Effects to activate
+            self.runner(['osascript', '-e', f'tell application "Adobe After Effects {self.aeVersion}" to activate']).wait()
             
             # Run the JSX script
             target = ['osascript', '-e', f'tell application "Adobe After Effects {self.aeVersion}" to DoScriptFile "{jsx_file_path}"']
-        ret = subprocess.Popen(target)
+            self.launcherOwned = True
+        return self.runner(target)
 
     def jsWriteDataOut(self, returnRequest):
         """ An example of getting a return value"""
@@ -350,12 +603,13 @@ class AE_JSWrapper(object):
             """
             var retVal = %s; // Ask for some kind of info about something. 
             
-            // Write to temp file. 
+            // Write to temp file, after the id of this command group.
             var datFile = new File("[DATAFILEPATH]"); 
             datFile.open("w"); 
+            datFile.writeln("#%s");
             datFile.writeln(String(retVal)); // return the data cast as a string.  
             datFile.close();
-            """ % (returnRequest)
+            """ % (returnRequest, self.commandId)
         )
 
         returnFileClean = "/" + self.returnFile.replace("\\", "/").replace(":", "").lower()
@@ -363,118 +617,333 @@ class AE_JSWrapper(object):
 
         self.commands.append(com)        
         
-    def readReturn(self):
-        """Helper function to wait for AE to write some output for us."""
-        # Give time for AE to close the file...
-        time.sleep(0.1)        
-        
-        self._updated = False
-        while not self._updated:
-            self.thisModTime = os.path.getmtime(self.returnFile)
-            if str(self.thisModTime) != str(self.lastModTime):
-                self.lastModTime = self.thisModTime
-                self._updated = True
-        
-        f = open(self.returnFile, "r+")
-        content = f.readlines()
-        f.close()
-
-        res = []
-        for item in content:
-            res.append(str(item.rstrip()))
-        return res
+    def _readReturnFile(self):
+        """
+        :return: (list of str) lines of the return file after the id line, None if it isn't the current command's result yet
+        """
+        try:
+            with open(self.returnFile, "r") as f:
+                content = f.read()
+        except OSError:
+            return None
+        # writeln ends every line, a file without the final newline is still being written.
+        if not content.endswith("\n"):
+            return None
+        lines = content.splitlines()
+        if not lines or lines[0] != "#" + self.commandId:
+            return None
+        return lines[1:]
+
+    def readReturn(self, timeout=None):
+        """
+        Wait for AE to write the result of the current command group
+
+        :param timeout: (float) seconds, returnTimeout if None
+        :return: (list of str) returned lines
+        """
+        result = []
+        def ready():
+            lines = self._readReturnFile()
+            if lines is None:
+                return False
+            result.extend(lines)
+            return True
+
+        if not self.returnWaiter.wait(ready, self.returnTimeout if timeout is None else timeout):
+            raise TimeoutError(f"After Effects didn't answer command {self.commandId} in time")
+        if self.commandStart is not None:
+            self.latencies.append((self.commandId, time.perf_counter() - self.commandStart))
+        return [str(item.rstrip()) for item in result]
+class AE_CommandQueue(object):
+    """
+    Collects AE operations and runs them together as a single script, so a batch costs one process launch.
+    A batch runs when flush() is called, or deadline seconds after its first operation was queued.
+    An error of a batch run by the deadline is raised by the next add() or flush().
+    """
+
+    def __init__(self, aeCom, deadline=AE_FLUSH_DEADLINE, launchTimeout=AE_RETURN_TIMEOUT):
+        self.aeCom = aeCom
+        self.deadline = deadline
+        self.launchTimeout = launchTimeout
+        self.operations = []
+        self.returnRequest = None
+        self.lock = threading.RLock()
+        self.timer = None
+        # What a deadline flush raised, nobody was there to catch it.
+        self.error = None
+        # One dict per batch: operations, write, launch and return seconds.
+        self.timings = []
+
+    def _raiseDeadlineError(self):
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def _deadlineFlush(self):
+        try:
+            self.flush()
+        except Exception as e:
+            print(e)
+            with self.lock:
+                self.error = e
+
+    def add(self, jsx):
+        """Queue one operation. Each runs in its own function scope, so their variables don't collide."""
+        with self.lock:
+            self._raiseDeadlineError()
+            self.operations.append(f"(function () {{\n{jsx}\n}})();")
+            if self.timer is None and self.deadline is not None:
+                self.timer = threading.Timer(self.deadline, self._deadlineFlush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self, returnRequest=None):
+        """
+        Run everything queued as one script
+
+        :param returnRequest: (str) ExtendScript expression evaluated after the operations, sent back to us
+        :return: (list of str) returned lines if returnRequest was given
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self._raiseDeadlineError()
+            if not self.operations and returnRequest is None:
+                return None
+            operations = self.operations
+            self.operations = []
+            timing = {"operations": len(operations)}
+
+            start = time.perf_counter()
+            self.aeCom.jsNewCommandGroup()
+            self.aeCom.commands.extend(operations)
+            if returnRequest is not None:
+                self.aeCom.jsWriteDataOut(returnRequest)
+            self.aeCom.jsWriteCommands()
+            timing["write"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            # Wait for the launcher instead of a fixed sleep, the script file mustn't be rewritten before AE has read it.
+            launcher = self.aeCom.jsExecuteCommand()
+            try:
+                launcher.wait(self.launchTimeout)
+            except subprocess.TimeoutExpired:
+                # Only a helper of ours is killed. On Windows the launcher is AfterFX.exe, which becomes
+                # After Effects when it wasn't running yet, so it's left alone.
+                if self.aeCom.launcherOwned:
+                    launcher.kill()
+                raise TimeoutError(f"After Effects didn't take command {self.aeCom.commandId} in time")
+            timing["launch"] = time.perf_counter() - start
+
+            result = None
+            if returnRequest is not None:
+                start = time.perf_counter()
+                result = self.aeCom.readReturn()
+                timing["return"] = time.perf_counter() - start
+            self.timings.append(timing)
+            return result
+
 class AE_JSInterface(object):
     
-    def __init__(self, aeVersion = "", returnFolder = ""):
+    def __init__(self, aeVersion = "", returnFolder = "", runner = None):
         self.aeWindowName = "Adobe After Effects"
-        self.aeCom = AE_JSWrapper(aeVersion, returnFolder) # Create wrapper to handle JSX
+        self.aeCom = AE_JSWrapper(aeVersion, returnFolder, runner) # Create wrapper to handle JSX
+        self.queue = AE_CommandQueue(self.aeCom)
 
     def openAE(self):
         self.aeCom.openAE()
 
-    def addMarkers(self, list):
-        jsxTodo = f"""
-
-        var item = app.project.activeItem;
-        var beats = {list};
-        if (app.project.activeItem instanceof CompItem) {{
-
+    def _compScript(self, comp):
+        """ExtendScript setting 'comp': the comp with that name, or the active comp (first item otherwise) if None."""
+        if comp is not None:
+            return f"""
+        var comp = null;
+        for (var i = 1; i <= app.project.numItems; i++) {{
+            if (app.project.item(i) instanceof CompItem && app.project.item(i).name == {json.dumps(comp)}) {{
+                comp = app.project.item(i);
+                break;
+            }}
+        }}
+        if (comp == null) return;
+        """
+        return """
+        if (app.project.activeItem instanceof CompItem) {
             var comp = app.project.activeItem;
-        }} else if (app.project.item(1) instanceof CompItem) {{
+        } else if (app.project.item(1) instanceof CompItem) {
             var comp = app.project.item(1);
-        }}
+        }
+        """
 
+    def queueMarkers(self, list, comp=None):
+        self.queue.add(f"""{self._compScript(comp)}
+        var beats = {list};
         for (var i = 0; i < beats.length;  i++) {{
             var compMarker = new MarkerValue(String(i));
             comp.markerProperty.setValueAtTime(beats[i], compMarker);
-        }}             
-
-        """
-        with open(self.aeCom.tempJsxFile, 'w') as f:
-            f.write(jsxTodo)
-            f.close()
-
-        self.aeCom.jsExecuteCommand()
-        time.sleep(0.1)
-    
-    def clearAllMarkers(self):
-        jsxTodo = f"""
-
-        var item = app.project.activeItem;
-
-        if (app.project.activeItem instanceof CompItem) {{
-            var comp = app.project.activeItem;
-        }} else if (app.project.item(1) instanceof CompItem) {{
-            var comp = app.project.item(1);
         }}
-        $
+        """)
+
+    def queueClearMarkers(self, comp=None):
+        self.queue.add(f"""{self._compScript(comp)}
         for (var i = comp.markerProperty.numKeys; i > 0; i = i - 1) {{
             comp.markerProperty.removeKey(1);
         }}
+        """)
+
+    def queueRemoveMarkers(self, times, comp=None):
+        """Queue deleting the markers found at the given times, to the millisecond."""
+        times_literal = ",".join(f"{round(t * 1000)}:1" for t in times)
+        self.queue.add(f"""{self._compScript(comp)}
+        var r = {{{times_literal}}};
+        for (var i = comp.markerProperty.numKeys; i > 0; i = i - 1) {{
+            if (r[Math.round(comp.markerProperty.keyTime(i) * 1000)]) {{
+                comp.markerProperty.removeKey(i);
+            }}
+        }}
+        """)
+
+    activeComp = "(app.project.activeItem instanceof CompItem ? app.project.activeItem : app.project.item(1))"
+
+    def markerCount(self):
         """
-        with open(self.aeCom.tempJsxFile, 'w') as f:
-            f.write(jsxTodo)
-            f.close()
+        Run the queued operations, then read back the number of markers of the active comp
 
-        self.aeCom.jsExecuteCommand()
-        time.sleep(0.1)
+        :return: (int) marker count
+        """
+        return int(self.queue.flush(self.activeComp + ".markerProperty.numKeys")[0])
+
+    usesMarkerColors = False
+    placesMarkersByFrame = False
+
+    def timelineKey(self):
+        """:return: (str) id of the comp markers go to"""
+        return self.queue.flush(self.activeComp + ".id")[0]
+
+    def syncMarkers(self, removed, added, colors):
+        """Delete the markers at the removed times and add the new ones, in one script run."""
+        if len(removed):
+            self.queueRemoveMarkers(removed)
+        if len(added):
+            self.queueMarkers(added)
+        self.queue.flush()
+
+    def addMarkers(self, list):
+        self.queueMarkers(list)
+        self.queue.flush()
+    
+    def clearAllMarkers(self):
+        self.queueClearMarkers()
+        self.queue.flush()
 ###########################################
 ###########################################
 # Premiere interface
+PREMIERE_SERVER_URL = "http://127.0.0.1:3000"
+# Markers sent per request, so a huge marker set doesn't become one huge ExtendScript evaluation.
+PREMIERE_MARKER_CHUNK = 2000
+
 class PR_JSWrapper(object):
-    def __init__(self, prVersion = "", returnFolder = ""):
+    def __init__(self, prVersion = "", returnFolder = "", url = PREMIERE_SERVER_URL):
         self.jsxTodo = ""
-    
+        self.session = None
+        # Where the CEP panel server listens.
+        self.url = url
+
     def jsExecuteCommand(self):
+        """
+        Send jsxTodo to the CEP panel server. The connection is kept alive between commands.
+
+        :return: (str) what ExtendScript sent back
+        """
+        if self.session is None:
+            import requests
+            self.session = requests.Session()
         json_data = json.dumps({"to_eval": self.jsxTodo})
-        response = requests.post("http://127.0.0.1:3000", data=json_data)
+        response = self.session.post(self.url, data=json_data)
+        return response.text
 # Actual interface
 class PR_JSInterface(object):
 
-    def __init__(self, prVersion = "", returnFolder = ""):
-
-        self.prCom = PR_JSWrapper(prVersion, returnFolder) # Create wrapper to handle JSX
+    def __init__(self, prVersion = "", returnFolder = "", url = PREMIERE_SERVER_URL):
 
-    def addMarkers(self, list):
-        self.prCom.jsxTodo = f"""
+        self.prCom = PR_JSWrapper(prVersion, returnFolder, url) # Create wrapper to handle JSX
 
-        for (var i = 0; i < {list}.length;  i++) {{
-            var compas = {compas};
-            $.writeln("list[i]: " + {list}[i]);
-            $.writeln("end: " + app.project.activeSequence.end);
-            if ({list}[i] < app.project.activeSequence.end)
-            marker = app.project.activeSequence.markers.createMarker({list}[i]);
-            if i % compas == 0 {{
-                marker.setColorByIndex({first_beat_color});
-            }} else {{
-                marker.setColorByIndex({other_beat_color});
-            }}
-        }}             
+    def markersScript(self, times, colors):
+        """
+        ExtendScript adding one chunk of markers. Times and colors are literals written once and read in the loop.
 
+        :param times: (list of float) marker times in seconds
+        :param colors: (str) one color index digit per marker
+        :return: (str) ExtendScript code
+        """
+        times_literal = ",".join(str(round(t, 6)) for t in times)
+        return f"""var t = [{times_literal}];
+var c = "{colors}";
+var seq = app.project.activeSequence;
+var markers = seq.markers;
+var end = seq.end;
+for (var i = 0; i < t.length; i++) {{
+    if (t[i] < end) {{
+        markers.createMarker(t[i]).setColorByIndex(c.charCodeAt(i) - 48);
+    }}
+}}
+t.length;"""
+
+    def removeMarkersScript(self, times):
+        """ExtendScript deleting the markers of the active sequence found at the given times, to the millisecond."""
+        times_literal = ",".join(f"{round(t * 1000)}:1" for t in times)
+        return f"""var r = {{{times_literal}}};
+var markers = app.project.activeSequence.markers;
+var m = markers.getFirstMarker();
+var removed = 0;
+while (m) {{
+    var next = markers.getNextMarker(m);
+    if (r[Math.round(m.start.seconds * 1000)]) {{
+        markers.deleteMarker(m);
+        removed++;
+    }}
+    m = next;
+}}
+removed;"""
+
+    def _sendChunks(self, scriptFor, times, *columns):
+        """Send one script per PREMIERE_MARKER_CHUNK markers. :return: (int) requests sent"""
+        requests_sent = 0
+        for chunk_start in range(0, len(times), PREMIERE_MARKER_CHUNK):
+            chunk_end = chunk_start + PREMIERE_MARKER_CHUNK
+            self.prCom.jsxTodo = scriptFor(times[chunk_start:chunk_end], *(c[chunk_start:chunk_end] for c in columns))
+            self.prCom.jsExecuteCommand()
+            requests_sent += 1
+        return requests_sent
+
+    def addMarkers(self, list, colors):
         """
+        Add markers to the active sequence, in chunks of PREMIERE_MARKER_CHUNK
 
-        self.prCom.jsExecuteCommand()
-        time.sleep(0.1)
+        :param list: (list of float) marker times in seconds
+        :param colors: (list of int) color index of each marker, see BeatGrid.marker_colors
+        :return: (dict) markers, requests, seconds and markers_per_second
+        """
+        start = time.perf_counter()
+        requests_sent = self._sendChunks(self.markersScript, list, "".join(str(c) for c in colors))
+        seconds = time.perf_counter() - start
+        return {"markers": len(list), "requests": requests_sent, "seconds": seconds,
+                "markers_per_second": len(list) / seconds if seconds > 0 else 0.0}
+
+    # Colors are part of what Premiere markers look like, so a color change is sent as a change.
+    usesMarkerColors = True
+    placesMarkersByFrame = False
+
+    def timelineKey(self):
+        """:return: (str) id of the active sequence, empty if there is none"""
+        self.prCom.jsxTodo = "app.project.activeSequence ? app.project.activeSequence.sequenceID : ''"
+        return self.prCom.jsExecuteCommand()
+
+    def syncMarkers(self, removed, added, colors):
+        """Delete the markers at the removed times, then add the new ones. Used with a MarkerTracker."""
+        self._sendChunks(self.removeMarkersScript, removed)
+        self._sendChunks(self.markersScript, added, "".join(str(c) for c in colors))
 
     def clearAllMarkers(self):
         self.prCom.jsxTodo = f"""
@@ -489,14 +958,20 @@ class PR_JSInterface(object):
 
         """
         self.prCom.jsExecuteCommand()
-        time.sleep(0.1)
 ###########################################
 ###########################################
 # Resolve interface
 class Resolve_Interface(object):
 
-    def __init__(self):
-        self.resolve = Resolve_Interface.GetResolve()
+    def __init__(self, resolve=None):
+        # resolve can be any object with the scriptapp interface, for testing.
+        self.resolve = resolve if resolve is not None else Resolve_Interface.GetResolve()
+        # Handles kept between calls, every fusionscript call is a round trip to Resolve.
+        self.projectManager = None
+        self.project = None
+        self.timeline = None
+        self.timelineId = None
+        self.timelineInfo = None
 
     def GetResolve():
         try:
@@ -525,37 +1000,64 @@ class Resolve_Interface(object):
 
         return bmd.scriptapp("Resolve")
     
+    def invalidate(self):
+        """Forget the cached project and timeline, they are fetched again on next use."""
+        self.project = None
+        self.timeline = None
+        self.timelineId = None
+        self.timelineInfo = None
+
+    def currentTimeline(self):
+        """
+        Current timeline, from cache while it stays the same one
+
+        :return: timeline handle, None if there is no current timeline
+        """
+        if self.projectManager is None:
+            self.projectManager = self.resolve.GetProjectManager()
+        for attempt in range(2):
+            if self.project is None:
+                self.project = self.projectManager.GetCurrentProject()
+            timeline = self.project.GetCurrentTimeline() if self.project else None
+            if timeline:
+                break
+            # The project may have been closed or switched, retry once with a fresh one.
+            self.invalidate()
+        if not timeline:
+            return None
+        timelineId = timeline.GetUniqueId()
+        if timelineId != self.timelineId:
+            # Another timeline: read its settings once, and open the edit page once.
+            self.resolve.OpenPage("edit")
+            startFrame = int(timeline.GetStartFrame())
+            endFrame = int(timeline.GetEndFrame())
+            self.timelineInfo = {
+                "numFrames": endFrame - startFrame,
+                "framerate": float(timeline.GetSetting("timelineFrameRate")),
+            }
+            self.timelineId = timelineId
+        self.timeline = timeline
+        return timeline
+
     def addMarkers(self, list, color = "Blue"):
         resolve = self.resolve
         if not resolve:
             print("Error: Failed to get resolve object!")
             return
 
-        # Get supporting objects
-        projectManager = resolve.GetProjectManager()
-        project = projectManager.GetCurrentProject()
-        timeline = project.GetCurrentTimeline()  # current timeline
-
+        timeline = self.currentTimeline()
         if not timeline:
             print("Error: No current timeline exist, add a timeline (recommended duration >= 80 frames) and try again!")
             return
 
-        # Open Edit page
-        resolve.OpenPage("edit")
-
-        # Get timeline frames
-        startFrame = int(timeline.GetStartFrame())
-        endFrame = int(timeline.GetEndFrame())
-        numFrames = endFrame - startFrame
-        framerate = timeline.GetSetting("timelineFrameRate")
-
-        # Add Markers
-        for beat in list:
-            frame = int(beat * framerate)
-            if numFrames >= 1:
-                try: timeline.DeleteMarkerAtFrame(frame)
-                except: pass
-                isSuccess = timeline.AddMarker(frame, "Blue", "AutoMarker", "beat-related", 1)
+        # Only frames inside the timeline, once each.
+        frames = times_to_frames(list, self.timelineInfo["framerate"], self.timelineInfo["numFrames"])
+        # One call to know which frames already hold a marker, instead of a delete per beat.
+        existing = timeline.GetMarkers() or {}
+        for frame in frames.tolist():
+            if frame in existing:
+                timeline.DeleteMarkerAtFrame(frame)
+            isSuccess = timeline.AddMarker(frame, color, "AutoMarker", "beat-related", 1)
 
     def clearAllMarkers(self):
         resolve = self.resolve
@@ -563,18 +1065,110 @@ class Resolve_Interface(object):
             print("Error: Failed to get resolve object!")
             return
 
-        # Get supporting objects
-        projectManager = resolve.GetProjectManager()
-        project = projectManager.GetCurrentProject()
-        timeline = project.GetCurrentTimeline()  # current timeline
-
+        timeline = self.currentTimeline()
         if not timeline:
             print("Error: No current timeline exist, add a timeline (recommended duration >= 80 frames) and try again!")
             return
 
-        # Open Edit page
-        resolve.OpenPage("edit")
         timeline.DeleteMarkersByColor("Blue")
+
+    usesMarkerColors = False
+    # Markers are stored by frame, two beats in one frame are one marker.
+    placesMarkersByFrame = True
+
+    def timelineKey(self):
+        """:return: (str) unique id of the current timeline, None if there is none"""
+        if not self.currentTimeline():
+            return None
+        return self.timelineId
+
+    def frameTimes(self, times):
+        """
+        One marker time per timeline frame, in the middle of the frame so it maps back to it exactly.
+        Expects timelineKey to have just been called.
+        """
+        framerate = self.timelineInfo["framerate"]
+        return (times_to_frames(times, framerate, self.timelineInfo["numFrames"]) + 0.5) / framerate
+
+    def syncMarkers(self, removed, added, colors, color = "Blue"):
+        """Delete the markers at the removed times, then add the new ones. Expects timelineKey to have just been called."""
+        timeline = self.timeline
+        numFrames = self.timelineInfo["numFrames"]
+        framerate = self.timelineInfo["framerate"]
+        for frame in times_to_frames(removed, framerate, numFrames).tolist():
+            timeline.DeleteMarkerAtFrame(frame)
+        frames = times_to_frames(added, framerate, numFrames)
+        if len(frames):
+            existing = timeline.GetMarkers() or {}
+            for frame in frames.tolist():
+                if frame in existing:
+                    timeline.DeleteMarkerAtFrame(frame)
+                timeline.AddMarker(frame, color, "AutoMarker", "beat-related", 1)
+###############################
+###############################
+###############################
+# PLAYBACK
+#  - The decoded audio is kept interleaved, (frames, channels), which is the layout sounddevice wants,
+#    so the callback is a single contiguous copy into outdata and an integer cursor update.
+#  - Nothing is allocated in the callback besides the slice views, and nothing touches Qt from the
+#    audio thread: the UI polls position and finished from its timer.
+###############################
+class PlaybackEngine(object):
+
+    def __init__(self, buffer, samplerate):
+        # buffer: (frames, channels) float32, C-contiguous. Shared with the Analyzer, never copied.
+        self.buffer = buffer
+        self.samplerate = samplerate
+        self.length = buffer.shape[0]
+        self.channels = buffer.shape[1]
+        self.position = 0
+        self.finished = False
+        self.stream = None
+        # Counted from the status flags sounddevice passes to the callback.
+        self.xruns = 0
+        self.underflows = 0
+        self._sd = None
+
+    def seek(self, frame):
+        """Move the read cursor to an exact sample frame. Safe to call while playing."""
+        self.position = min(max(0, int(frame)), self.length)
+        self.finished = self.position >= self.length
+
+    def start(self):
+        import sounddevice as sd
+        self._sd = sd
+        if self.position >= self.length:
+            self.seek(0)
+        self.finished = False
+        self.stream = sd.OutputStream(dtype='float32',
+                                      channels=self.channels,
+                                      samplerate=self.samplerate,
+                                      callback=self.callback)
+        self.stream.start()
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+    def is_active(self):
+        return self.stream is not None and self.stream.active
+
+    def callback(self, outdata, frames, time, status):
+        if status:
+            self.xruns += 1
+            if status.output_underflow:
+                self.underflows += 1
+        position = self.position
+        available = min(frames, self.length - position)
+        outdata[:available] = self.buffer[position:position + available]
+        if available < frames:
+            outdata[available:].fill(0)
+            self.position = self.length
+            self.finished = True
+            raise self._sd.CallbackStop()
+        self.position = position + available
 ###############################
 ###############################
 ###############################
@@ -705,25 +1299,72 @@ class Layout(QWidget):
 """
         )
     
-    def add_beats(self, beats):
-        self.beats = self.beats = [int(beat * SAMPLE_RATE) for beat in beats]
-        self.waveform_display.set_beats(self.beats[::4])
+    def add_beats(self, grid):
+        """Show a BeatGrid. The display reads it on every paint, so later changes to it need only an update()."""
+        self.beats = grid
+        self.waveform_display.set_beats(grid)
         self.update()
 
-    def add_preview(self, analyzer_data, sample_rate):
+    def add_tempo_map(self, tempo_map):
+        """Show where the tempo changes, None to hide it."""
+        self.waveform_display.set_tempo_map(tempo_map)
+
+    def add_preview(self, analyzer_data, sample_rate, peaks=None):
+        with timing.span("preview build"):
+            self._add_preview(analyzer_data, sample_rate, peaks)
+
+    def _add_preview(self, analyzer_data, sample_rate, peaks=None):
+        # analyzer_data is shared with the Analyzer, (channels, samples) or mono. Nothing here copies it.
         self.sample_rate = sample_rate
-        self.data = analyzer_data.tolist()
-        self.waveform_display.set_samples(self.data, channels=1, samplerate=self.sample_rate)
-        self.position_slider.add_data(self.data)
+        channels = analyzer_data.shape[0] if analyzer_data.ndim > 1 else 1
+        self.waveform_display.set_samples(analyzer_data, channels=channels, samplerate=self.sample_rate, peaks=peaks)
+        self.position_slider.add_data(analyzer_data, peaks)
 
         if self.scroll_bar == None: self.scroll_bar = QScrollBar(Qt.Horizontal)
-        self.scroll_bar.setRange(0, len(self.data))
+        self.scroll_bar.setRange(0, analyzer_data.shape[-1])
         self.scroll_bar.setValue(0)
         self.scroll_bar.setSingleStep(sample_rate / 10)
         self.right_v_layout.addWidget(self.scroll_bar)
 
         self.update()
 
+def peak_lines(peaks, start, end, width, zero_y):
+    """
+    Vertical lines, one per pixel column, spanning the positive and negative peaks of that column
+
+    :param peaks: (PeakPyramid) peaks of the samples to draw
+    :param start: (int) first visible sample
+    :param end: (int) sample after the last visible one
+    :param width: (int) widget width in pixels
+    :param zero_y: (float) y coordinate of the zero line, also the amplitude scale
+    :return: (list of QLineF) lines ready for QPainter.drawLines
+    """
+    mins, maxs = peaks.query(start, end, width)
+    tops = zero_y - zero_y * np.maximum(maxs, 0)
+    bottoms = zero_y - zero_y * np.minimum(mins, 0)
+    columns = np.flatnonzero((maxs > 0) | (mins < 0))
+    return [QLineF(x, top, x, bottom) for x, top, bottom in zip(columns.tolist(), tops[columns].tolist(), bottoms[columns].tolist())]
+
+def marker_lines(frames, start, end, width, height):
+    """
+    Vertical lines for the markers inside the visible range, at most one per pixel column
+
+    :param frames: (np.ndarray of int) sorted marker positions in samples
+    :param start: (int) first visible sample
+    :param end: (int) sample after the last visible one
+    :param width: (int) widget width in pixels
+    :param height: (int) widget height in pixels
+    :return: (list of QLineF) lines ready for QPainter.drawLines
+    """
+    first, last = np.searchsorted(frames, (start, end))
+    xs = (frames[first:last] - start) * (width / max(end - start, 1))
+    if last - first > width:
+        # More markers than columns: the lines would overlap anyway.
+        columns = np.zeros(width + 1, dtype=bool)
+        columns[xs.astype(np.int64)] = True
+        xs = np.flatnonzero(columns)
+    return [QLineF(x, 0, x, height) for x in xs.tolist()]
+
 class WaveformSlider(QSlider):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -746,29 +1387,54 @@ class WaveformSlider(QSlider):
             }                           
 
 """)
-        self.data = None
-    
-    def add_data(self, data):
-        self.data = data[::8]
-        self.setRange(0, len(data))
+        self.peaks = None
+        # The overview only changes with the file or the widget size, so it's rendered once into
+        # a pixmap and playback repaints just blit it under the handle.
+        self._overview = None
+
+    def add_data(self, data, peaks=None):
+        self.peaks = peaks if peaks is not None else PeakPyramid(read_only_view(data))
+        self._overview = None
+        self.setRange(0, data.shape[-1])
         self.update()
-    
+
+    def resizeEvent(self, event):
+        self._overview = None
+        super().resizeEvent(event)
+
+    def refresh(self):
+        """Redraw the overview, the samples changed (streaming decode)."""
+        self._overview = None
+        self.update()
+
     def paintEvent(self, event):
-        if self.data is not None:
-            painter = QPainter()
-            painter.begin(self)
-            self.draw_waveform(painter)
-            painter.end()
-        super().paintEvent(event)        
-    
+        with timing.span("paint overview"):
+            if self.peaks is not None:
+                ratio = self.devicePixelRatioF()
+                if self._overview is None or self._overview.size() != self.size() * ratio:
+                    with timing.span("render overview"):
+                        self._overview = self.render_overview(ratio)
+                painter = QPainter()
+                painter.begin(self)
+                painter.drawPixmap(0, 0, self._overview)
+                painter.end()
+            super().paintEvent(event)
+
+    def render_overview(self, ratio=1.0):
+        pixmap = QPixmap(self.size() * ratio)
+        pixmap.setDevicePixelRatio(ratio)
+        painter = QPainter()
+        painter.begin(pixmap)
+        self.draw_waveform(painter)
+        painter.end()
+        return pixmap
+
     def draw_waveform(self, painter):
         pen = painter.pen()
-        pen.setColor("#BEC1D2")  
-        height = painter.device().height()
+        pen.setColor("#BEC1D2")
+        height = self.height()
         zero_y = float(height) / 2
-        width = painter.device().width()
-        num_frames = len(self.data)
-        samples_per_pixel = num_frames / float(width)
+        width = self.width()
 
         # draw background
         brush = QBrush()
@@ -778,32 +1444,22 @@ class WaveformSlider(QSlider):
         painter.fillRect(rect, brush)
 
         # draw waveform
-        if self.data is not None:
+        if self.peaks is not None:
             painter.setPen(pen)
-            for pixel in range(width):
-                offset = round(pixel * samples_per_pixel)
-
-                if 0 <= offset < num_frames:
-                    start = offset
-                    end = max(start + 1, start + int(samples_per_pixel))
-                    values = self.data[start:end]
-                    max_value = max(values)
-                    min_value = min(values)
-
-                    if max_value > 0:
-                        y = zero_y - zero_y * max_value
-                        painter.drawLine(QPointF(pixel, zero_y), QPointF(pixel, y))
-                    if min_value < 0:
-                        y = zero_y - zero_y * min_value
-                        painter.drawLine(QPointF(pixel, zero_y), QPointF(pixel, y))
+            painter.drawLines(peak_lines(self.peaks, 0, len(self.peaks), width, zero_y))
 class WaveformDisplay(QWidget):
     """Custom widget for waveform representation of a digital audio signal."""
     zoom_signal = Signal(int, int)
     scroll_signal = Signal(int)
-    def __init__(self, frames=None, channels=1, samplerate=SAMPLE_RATE, beats=None, *args, **kwargs):
+    def __init__(self, frames=None, channels=1, samplerate=None, beats=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._sampleframes = frames
-        self._beatsamples = beats
+        self._peaks = PeakPyramid(frames) if frames is not None else None
+        self._beats = beats
+        # Marker positions in samples, rebuilt when the grid's version changes.
+        self._beat_frames = None
+        self._beat_frames_version = None
+        self._tempo_map = None
         self._channels = channels
         self._samplerate = samplerate
         self.waveform_color = QColor('#5EA48E') 
@@ -814,20 +1470,24 @@ class WaveformDisplay(QWidget):
         self.background_gradient.setColorAt(1, QColor('#C3D4D6'))
         self.background_gradient.setSpread(QGradient.Spread.ReflectSpread)
         self.foreground_color = QColor('#F4F2F3')
+        self.tempo_change_color = QColor(196, 94, 206, 60)
         self._startframe = 0
-        self._endframe = self._samplerate*10
+        # The initial 10 seconds view is set up when the first samples arrive.
+        self._endframe = self._samplerate*10 if self._samplerate is not None else None
         self.track_line_position = 0
 
     def sizeHint(self) -> QSize:
         return QSize(400, 200)
 
     def wheelEvent(self, event):
+        if self._endframe is None:
+            return
         deltay = event.angleDelta().y()
         deltax = event.angleDelta().x()
-        if (self._endframe - self._startframe) < SAMPLE_RATE / 8:
-            self._endframe = self._startframe + SAMPLE_RATE / 8
-        elif (self._endframe - self._startframe) > SAMPLE_RATE * 60:
-            self._endframe = self._startframe + SAMPLE_RATE * 60
+        if (self._endframe - self._startframe) < self._samplerate / 8:
+            self._endframe = self._startframe + self._samplerate / 8
+        elif (self._endframe - self._startframe) > self._samplerate * 60:
+            self._endframe = self._startframe + self._samplerate * 60
         if deltay != 0:
             pos = int(event.position().x() / self.width() * ((self._endframe - self._startframe) + self._startframe))
             self.zoom_signal.emit(deltay, pos)
@@ -835,17 +1495,19 @@ class WaveformDisplay(QWidget):
             self.scroll_signal.emit(deltax)
 
     def paintEvent(self, event):
-        painter = QPainter()
-        painter.begin(self)
-        if self._sampleframes is not None and len(self._sampleframes) > 0:
-            self.draw_waveform(painter)
-            if self._beatsamples is not None: self.draw_markers(painter)
-            if is_playing == True: self.draw_track_line(painter) 
-        else:
-            self.draw_background(painter)
-            self.draw_text(painter)
-        self.draw_border(painter)
-        painter.end()
+        with timing.span("paint waveform"):
+            painter = QPainter()
+            painter.begin(self)
+            if self._peaks is not None and len(self._peaks) > 0:
+                self.draw_waveform(painter)
+                if self._tempo_map is not None: self.draw_tempo_map(painter)
+                if self._beats is not None: self.draw_markers(painter)
+                if is_playing == True: self.draw_track_line(painter) 
+            else:
+                self.draw_background(painter)
+                self.draw_text(painter)
+            self.draw_border(painter)
+            painter.end()
         
     def draw_background(self, painter):
         painter.fillRect(self.rect(), self.background_color)
@@ -884,15 +1546,37 @@ class WaveformDisplay(QWidget):
         pen.setStyle(Qt.PenStyle.SolidLine)
         painter.setPen(pen)
 
-        width = painter.device().width()
-        visible_samples = self._endframe - self._startframe
-        visible_samples = visible_samples if visible_samples > 0 else 1
+        painter.drawLines(marker_lines(self.beat_frames(), self._startframe, self._endframe,
+                                       painter.device().width(), painter.device().height()))
 
-        for beat in self._beatsamples:
-            # Subtract the start frame index from the beat sample index
-            beat -= self._startframe
-            x = beat * width / visible_samples
-            painter.drawLine(QPointF(x, 0), QPointF(x, painter.device().height()))
+    def draw_tempo_map(self, painter):
+        # Nothing to show for a steady track.
+        if len(self._tempo_map.segments) < 2:
+            return
+        width = painter.device().width()
+        height = painter.device().height()
+        scale = width / (self._endframe - self._startframe)
+        for start, end in self._tempo_map.change_regions():
+            left = (start * self._samplerate - self._startframe) * scale
+            right = (end * self._samplerate - self._startframe) * scale
+            if right < 0 or left > width:
+                continue
+            painter.fillRect(QRectF(left, 0, max(right - left, 2.0), height), self.tempo_change_color)
+        painter.setPen(self.foreground_color)
+        for start, end, bpm, steady in self._tempo_map.segments:
+            left = (start * self._samplerate - self._startframe) * scale
+            right = (end * self._samplerate - self._startframe) * scale
+            if not steady or right < 0 or left > width:
+                continue
+            # Labelled at the segment's start, or at the left edge while its start is scrolled out.
+            painter.drawText(QPointF(max(left, 0) + 4, 14), f"{bpm:.1f} BPM")
+
+    def beat_frames(self):
+        """:return: (np.ndarray of int64) marker positions in samples, from the beat grid"""
+        if self._beat_frames is None or self._beat_frames_version != (self._beats.version, self._samplerate):
+            self._beat_frames = self._beats.marker_samples(self._samplerate)
+            self._beat_frames_version = (self._beats.version, self._samplerate)
+        return self._beat_frames
 
     def draw_waveform(self, painter):
         pen = painter.pen()
@@ -900,8 +1584,6 @@ class WaveformDisplay(QWidget):
         height = painter.device().height()
         zero_y = float(height) / 2
         width = painter.device().width()
-        num_frames = len(self._sampleframes[self._startframe:self._endframe])
-        samples_per_pixel = num_frames / float(width)
 
         # draw background
         # ~ brush = QtGui.QBrush()
@@ -912,28 +1594,12 @@ class WaveformDisplay(QWidget):
         
         rect = QRect(0, 0, width, height)
         painter.fillRect(rect, self.background_color)
-        startframe = self._startframe
 
         # draw waveform
-        if self._sampleframes is not None:
+        if self._peaks is not None:
             pen.setColor(self.waveform_color)
             painter.setPen(pen)
-            for pixel in range(width):
-                offset = round(pixel * samples_per_pixel)
-
-                if 0 <= offset < num_frames:
-                    start = startframe + offset
-                    end = max(start + 1, start + int(samples_per_pixel))
-                    values = self._sampleframes[start:end]
-                    max_value = max(values)
-                    min_value = min(values)
-
-                    if max_value > 0:
-                        y = zero_y - zero_y * max_value
-                        painter.drawLine(QLineF(pixel, zero_y, pixel, y))
-                    if min_value < 0:
-                        y = zero_y - zero_y * min_value
-                        painter.drawLine(QLineF(pixel, zero_y, pixel, y))
+            painter.drawLines(peak_lines(self._peaks, self._startframe, self._endframe, width, zero_y))
 
         # draw zero line
         pen.setColor(self.foreground_color)
@@ -941,69 +1607,572 @@ class WaveformDisplay(QWidget):
         painter.setPen(pen)
         painter.drawLine(QLineF(0.0, zero_y, float(width), zero_y))
 
-    def set_samples(self, frames, channels=1, samplerate=SAMPLE_RATE):
-        self._sampleframes = frames if frames is not None else []
+    def set_samples(self, frames, channels=1, samplerate=None, peaks=None):
+        self._sampleframes = read_only_view(frames) if frames is not None else np.zeros(0, dtype=np.float32)
+        # The peak pyramid is built once per file, usually by the Analyzer thread.
+        self._peaks = peaks if peaks is not None else PeakPyramid(self._sampleframes)
         self._channels = channels
-        self._samplerate = samplerate
+        self._samplerate = samplerate if samplerate is not None else get_sample_rate()
+        if self._endframe is None:
+            self._endframe = self._samplerate*10
         self.update()
     
-    def set_beats(self, beats):
-        self._beatsamples = beats if beats is not None else []
+    def set_beats(self, grid):
+        self._beats = grid
+        self._beat_frames = None
+        self.update()
+
+    def set_tempo_map(self, tempo_map):
+        self._tempo_map = tempo_map
         self.update()
 class StatusChecker(QThread):
     statusChanged = Signal(str)
 
+    def __init__(self):
+        super().__init__()
+        self.discovery = ProcessDiscovery()
+        self._stop = threading.Event()
+
     def run(self):
-        while True:
-            if is_premiere_running()[0]:
-                self.statusChanged.emit("1")
-            elif is_afterfx_running()[0]:
-                self.statusChanged.emit("2")
-            elif is_resolve_running()[0]:
-                self.statusChanged.emit("3")
-            else:
-                self.statusChanged.emit("0")
-            time.sleep(1)
+        start = time.perf_counter()
+        first = True
+        while not self._stop.is_set():
+            try:
+                status = self.discovery.poll()
+            except Exception as e:
+                print(e)
+                status = None
+            if status is not None:
+                self.statusChanged.emit(status)
+            if first:
+                startup_timer.record("first host probe", time.perf_counter() - start)
+                first = False
+            self._stop.wait(self.discovery.interval)
+
+    def stop(self):
+        self._stop.set()
+        self.wait()
+class ExtensionInstallerThread(QThread):
+
+    def run(self):
+        start = time.perf_counter()
+        install_extension_if_needed()
+        startup_timer.record("extension check", time.perf_counter() - start)
 class AddMarkersThread(QThread):
 
     finished = Signal()
 
-    def __init__(self, app, beatsamples, every=1, offset=0):
+    def __init__(self, app, grid, engine=None, onset_envelope=None, sr=None, tracker=None, analyzer=None):
         super().__init__()
         self.app = app
-        self.beatsamples = beatsamples
-        self.every = every
-        self.offset = offset
+        # With a tracker, only the markers that changed since the last time are sent to the host.
+        self.tracker = tracker
+        # The analysis and grid this was started from, retracked beats only go back to them.
+        self.analyzer = analyzer
+        self.source_grid = grid
+        # A copy, the user can keep editing the window's grid while this runs.
+        self.grid = grid.copy()
+        # Final pass: when an engine is given, beats are tracked again from the onset envelope
+        # before placing the markers, keeping the grid's decimation and global offset.
+        self.engine = engine
+        self.onset_envelope = onset_envelope
+        self.sr = sr
+        self.retracked = False
+        # Set by hosts that time the transfer (Premiere).
+        self.add_stats = None
+        # Set when the host didn't answer, the markers may not all be there.
+        self.error = None
 
     def run(self):
+        if self.engine is not None and self.onset_envelope is not None:
+            self.tempo, beatsamples = beat_tracker_for(self.engine, self.onset_envelope, self.sr).track(self.onset_envelope, self.sr)
+            self.grid.set_times(beatsamples)
+            self.retracked = True
         if self.app is not None:
-            markers = self.beatsamples.tolist()[self.offset::self.every]
-            self.app.addMarkers(markers)
+            markers = self.grid.marker_times()
+            try:
+                if self.tracker is None or not self.sync_markers(markers):
+                    with timing.span(f"{type(self.app).__name__}.addMarkers", markers=len(markers)):
+                        if self.app.usesMarkerColors:
+                            colors = self.grid.marker_colors(first_beat_color, other_beat_color)
+                            self.add_stats = self.app.addMarkers(markers.tolist(), colors.tolist())
+                        else:
+                            self.add_stats = self.app.addMarkers(markers.tolist())
+            except TimeoutError as e:
+                print(e)
+                self.error = str(e)
+
+    def sync_markers(self, markers):
+        """
+        Send only the difference with the markers already placed on the host timeline
+
+        :return: (bool) False if the timeline couldn't be identified, nothing was sent then
+        """
+        start = time.perf_counter()
+        try:
+            with timing.span(f"{type(self.app).__name__}.timelineKey"):
+                key = self.app.timelineKey()
+        except Exception as e:
+            print(e)
+            return False
+        if not key:
+            return False
+        timeline = (type(self.app).__name__, key)
+        if self.app.placesMarkersByFrame:
+            # Diffed by frame, or a removed beat sharing a frame with a kept one would delete the kept marker.
+            markers = self.app.frameTimes(markers)
+        colors = self.grid.marker_colors(first_beat_color, other_beat_color) if self.app.usesMarkerColors else None
+        removed, added = self.tracker.diff(timeline, markers, colors)
+        removed_times, _ = self.tracker.decode(removed)
+        added_times, added_colors = self.tracker.decode(added)
+        # Until the host is done, what's on the timeline is unknown.
+        self.tracker.forget(timeline)
+        with timing.span(f"{type(self.app).__name__}.syncMarkers", removed=len(removed), added=len(added)):
+            self.app.syncMarkers(removed_times.tolist(), added_times.tolist(), added_colors.tolist())
+        self.tracker.commit(timeline, markers, colors)
+        seconds = time.perf_counter() - start
+        self.add_stats = {"markers": len(added), "removed": len(removed), "seconds": seconds,
+                          "markers_per_second": (len(added) + len(removed)) / seconds if seconds > 0 else 0.0}
+        return True
 class RemoveMarkersThread(QThread):
 
     finished = Signal()
 
-    def __init__(self, app):
+    def __init__(self, app, tracker=None):
         super().__init__()
         self.app = app
+        self.tracker = tracker
+        # Set when the host didn't answer.
+        self.error = None
 
     def run(self):
         if self.app is not None:
-            self.app.clearAllMarkers()
-class Analyzer(QThread):
+            if self.tracker is not None:
+                try:
+                    with timing.span(f"{type(self.app).__name__}.timelineKey"):
+                        self.tracker.forget((type(self.app).__name__, self.app.timelineKey()))
+                except Exception as e:
+                    print(e)
+            try:
+                with timing.span(f"{type(self.app).__name__}.clearAllMarkers"):
+                    self.app.clearAllMarkers()
+            except TimeoutError as e:
+                print(e)
+                self.error = str(e)
+# Analysis jobs run at the same time. Two let a file left for another finish while the next one already decodes.
+ANALYSIS_WORKERS = 2
+# Pool priorities, the file on screen goes before anything analyzed in the background.
+PRIORITY_ON_SCREEN = 10
+PRIORITY_BACKGROUND = 0
+# Files left for another keep being analyzed in the background, filling the caches, up to this many.
+ANALYSIS_BACKGROUND_JOBS = 2
+
+class AnalysisCancelled(Exception):
+    """Raised inside a cancelled job at its next check, unwinds it without emitting anything."""
+
+class Analyzer(QObject):
 
     finished = Signal()
+    failed = Signal(str)
     data_loaded = Signal()
+    # Streaming mode only: samples decoded so far and total samples, a few times per second.
+    progress = Signal(int, int)
 
-    def __init__(self, path, parent=None):
+    def __init__(self, path, parent=None, cache=None, streaming=True, analysis_rate=DEFAULT_ANALYSIS_SAMPLE_RATE, engine=None,
+                 display_resampler=DEFAULT_RESAMPLER, analysis_resampler=DEFAULT_RESAMPLER, peak_store=None):
         super().__init__(parent)
         self.path = path
+        self._cancelled = threading.Event()
+        self.engine = engine if engine is not None else get_beat_engine()
+        # Beats are tracked at analysis_rate (None: the playback rate), the audio is decoded at the
+        # playback rate for the display and the playback.
+        self.analysis_rate = analysis_rate
+        # Resampler presets of the decoded audio (display and playback) and of the signal beats are tracked on.
+        self.display_resampler = display_resampler
+        self.analysis_resampler = analysis_resampler
+        # Seconds of audio decoded per second, see record_decode.
+        self.decode_throughput = None
+        self.cache = cache
+        self.cache_hit = False
+        # Peak files of the files opened before, a hit draws the waveform before the decode starts.
+        self.peak_store = peak_store
+        self.peaks_hit = False
+        self.streaming = streaming
+        self.onset_envelope = None
+        # Local tempo, from the same onset envelope as the beats.
+        self.tempo_map = None
+
+    def cancel(self):
+        """Ask the job to stop, it does at its next check. Nothing is emitted after that."""
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def check_cancelled(self):
+        if self._cancelled.is_set():
+            raise AnalysisCancelled()
 
     def run(self):
-        self.data, self.samplerate = librosa.load(path=self.path, sr=SAMPLE_RATE, mono=False)
-        self.mono_data = np.mean(self.data, axis=0)
+        try:
+            self.analyze()
+        except AnalysisCancelled:
+            return
+        except Exception as e:
+            print(e)
+            if not self.is_cancelled():
+                self.failed.emit(str(e))
+            return
+        if not self.is_cancelled():
+            self.finished.emit()
+
+    def analyze(self):
+        # Look the analysis up before decoding, a hit saves the whole beat tracking pass.
+        cached = None
+        if self.analysis_rate is None:
+            self.analysis_rate = get_sample_rate()
+        if self.cache is not None:
+            try:
+                with timing.span("cache lookup"):
+                    self.cache_key = self.cache.make_key(self.path, analysis_params(self.analysis_rate, self.engine, self.analysis_resampler))
+                    cached = self.cache.get(self.cache_key)
+            except OSError as e:
+                print(e)
+                self.cache_key = None
+        self.check_cancelled()
+        self.load_peaks()
+        # The waveform preview and the playback still need the decoded audio.
+        if not (self.streaming and self.decode_streaming(onsets=cached is None)):
+            start = time.perf_counter()
+            worker = is_compressed(self.path)
+            if worker:
+                # Decoded in another process, the decoder's buffers never grow this one.
+                interleaved, self.samplerate = decode_in_worker(self.path, get_sample_rate(), self.display_resampler)
+            else:
+                data, self.samplerate, _ = load_audio(self.path, get_sample_rate(), self.display_resampler)
+                interleaved = np.ascontiguousarray(data.T)
+                del data
+            if self.peaks_hit:
+                # The display already points to the buffer allocated from the peak file.
+                frames = min(len(interleaved), len(self.interleaved))
+                self.interleaved[:frames] = interleaved[:frames]
+                del interleaved
+            else:
+                self.interleaved = interleaved
+                self.data = self.interleaved.T
+            self.mono_data = self.data[0] if self.data.shape[0] == 1 else np.mean(self.data, axis=0)
+            self.record_decode(time.perf_counter() - start, streaming=False, worker=worker)
+            if self.peaks_hit:
+                self.peaks.attach(self.data)
+            else:
+                with timing.span("peaks"):
+                    self.peaks = PeakPyramid(self.data)
+                self.data_loaded.emit()
+        self.save_peaks()
+        # From here on the decoded audio is only read, by the display and the playback.
+        self.interleaved.flags.writeable = False
+        self.data.flags.writeable = False
+        if cached is not None:
+            self.cache_hit = True
+            self.mono_data = None
+            self.tempo = cached["tempo"]
+            self.beatsamples = cached["beat_times"]
+            self.onset_envelope = cached["onset_envelope"]
+            self.build_tempo_map()
+            return
+        self.check_cancelled()
+        if self.onset_envelope is None:
+            with timing.span("resample"):
+                analysis_data = resample_mono(self.mono_data, self.samplerate, self.analysis_rate, self.analysis_resampler)
+            with timing.span("onset envelope"):
+                self.onset_envelope = compute_onset_envelope(analysis_data, self.analysis_rate)
+            del analysis_data
+        # The mono mix was only needed for the onset envelope, the peaks mix the channels down themselves.
+        self.mono_data = None
+        self.check_cancelled()
+        # Long files are tracked in windows on every core, a cancel abandons the windows still running.
+        tracker = beat_tracker_for(self.engine, self.onset_envelope, self.analysis_rate, should_stop=self.is_cancelled)
+        with timing.span("beat tracking", engine=self.engine.name, chunked=isinstance(tracker, ChunkedBeatTracker)):
+            self.tempo, self.beatsamples = tracker.track(self.onset_envelope, self.analysis_rate)
+        self.check_cancelled()
+        self.build_tempo_map()
+        if self.cache is not None and self.cache_key is not None:
+            try:
+                with timing.span("cache write"):
+                    self.cache.put(self.cache_key, self.tempo, self.beatsamples, self.onset_envelope, source=self.path)
+            except OSError as e:
+                print(e)
+
+    def load_peaks(self):
+        """
+        Look the file up in the peak store. On a hit the peaks come from the peak file, the decoded
+        audio goes to a buffer of the same length and data_loaded is emitted right away.
+        """
+        if self.peak_store is None:
+            return
+        with timing.span("peak file lookup"):
+            found = self.peak_store.load(self.path, get_sample_rate())
+        if found is None:
+            return
+        self.peaks, channels = found
+        self.peaks_hit = True
+        self.samplerate = get_sample_rate()
+        self.interleaved = np.zeros((len(self.peaks), channels), dtype=np.float32)
+        self.data = self.interleaved.T
+        self.mono_data = None
         self.data_loaded.emit()
-        self.tempo, self.beatsamples = librosa.beat.beat_track(y=self.mono_data, units="time", sr=SAMPLE_RATE)
+
+    def save_peaks(self):
+        if self.peak_store is None or self.peaks_hit:
+            return
+        try:
+            with timing.span("peak file write"):
+                self.peak_store.save(self.path, self.samplerate, self.peaks, self.data.shape[0])
+        except OSError as e:
+            print(e)
+
+    def build_tempo_map(self):
+        with timing.span("tempo map"):
+            self.tempo_map = TempoMap.from_onset_envelope(self.onset_envelope, self.analysis_rate)
+
+    def decode_streaming(self, onsets=True):
+        """
+        Decode block by block into buffers the display already points to, computing the onset
+        envelope on the way. data_loaded is emitted before the first block, unless the buffers and
+        the peaks already came from a peak file.
+
+        :param onsets: (bool) also compute the onset envelope, not needed on a cache hit
+        :return: (bool) False if the file can't be streamed and has to be loaded in one go
+        """
+        sr = get_sample_rate()
+        try:
+            channels, length, native_sr = stream_info(self.path, sr)
+        except RuntimeError as e:
+            print(e)
+            return False
+        if self.peaks_hit:
+            length = len(self.interleaved)
+        else:
+            self.samplerate = sr
+            # Interleaved for the playback, data is the (channels, samples) view the rest of the app uses.
+            self.interleaved = np.zeros((length, channels), dtype=np.float32)
+            self.data = self.interleaved.T
+            self.mono_data = None
+            self.peaks = PeakPyramid(self.data)
+            self.data_loaded.emit()
+
+        # Onsets are computed from the blocks as decoded, so the analysis signal is resampled once, from the
+        # file's own rate, and the display's resampler preset doesn't change the beats.
+        accumulator = OnsetAccumulator(self.analysis_rate, input_sr=native_sr, resampler=self.analysis_resampler) if onsets else None
+        position = 0
+        start = time.perf_counter()
+        last_progress = start
+        # Decoding, peaks and onsets are interleaved block by block, their times are summed and recorded as one span each.
+        peaks_seconds = 0.0
+        onsets_seconds = 0.0
+        for block, native_block in stream_audio_blocks(self.path, sr, resampler=self.display_resampler, native=True):
+            self.check_cancelled()
+            # The length is estimated from the header, drop whatever the resampler adds past it.
+            frames = min(block.shape[1], length - position)
+            if frames > 0:
+                self.interleaved[position:position + frames] = block[:, :frames].T
+                if not self.peaks_hit:
+                    step = time.perf_counter()
+                    self.peaks.update(position, position + frames)
+                    peaks_seconds += time.perf_counter() - step
+                position += frames
+            if accumulator is not None:
+                step = time.perf_counter()
+                accumulator.feed(native_block[0] if len(native_block) == 1 else np.mean(native_block, axis=0))
+                onsets_seconds += time.perf_counter() - step
+            if time.perf_counter() - last_progress > 0.2:
+                last_progress = time.perf_counter()
+                self.progress.emit(position, length)
+        self.progress.emit(length, length)
+        if accumulator is not None:
+            step = time.perf_counter()
+            self.onset_envelope = accumulator.finish()
+            onsets_seconds += time.perf_counter() - step
+        self.record_decode(time.perf_counter() - start - peaks_seconds - onsets_seconds, streaming=True)
+        if self.peaks_hit:
+            self.peaks.attach(self.data)
+        else:
+            timing.record("peaks", peaks_seconds)
+        if accumulator is not None:
+            timing.record("onset envelope", onsets_seconds)
+        return True
+
+    def record_decode(self, seconds, **info):
+        """Record the decode time and throughput, in seconds of audio per second."""
+        audio_seconds = self.data.shape[1] / self.samplerate
+        self.decode_throughput = audio_seconds / max(seconds, 1e-9)
+        timing.record("decode", seconds, file=self.path, audio_seconds=audio_seconds, throughput=self.decode_throughput,
+                      resampler=self.display_resampler, **info)
+
+    def memory_report(self):
+        """
+        Bytes held for the current track
+
+        :return: (list of (str, int)) buffer name and size in bytes
+        """
+        report = [("decoded audio", self.data.nbytes if getattr(self, "data", None) is not None else 0)]
+        if getattr(self, "mono_data", None) is not None and self.mono_data.base is None:
+            report.append(("mono mix", self.mono_data.nbytes))
+        if getattr(self, "peaks", None) is not None:
+            report.append(("peak pyramid", self.peaks.nbytes()))
+        if self.onset_envelope is not None:
+            report.append(("onset envelope", self.onset_envelope.nbytes))
+        if getattr(self, "beatsamples", None) is not None:
+            report.append(("beats", self.beatsamples.nbytes))
+        if self.tempo_map is not None:
+            report.append(("tempo map", self.tempo_map.nbytes()))
+        return report
+
+class _JobRunnable(QRunnable):
+    # The pool only sees this wrapper. It's kept alive by the scheduler, not deleted by the pool,
+    # so a queued job can still be taken back out.
+    def __init__(self, scheduler, job):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.scheduler = scheduler
+        self.job = job
+
+    def run(self):
+        self.scheduler._run(self.job)
+
+class AnalysisScheduler(object):
+    """
+    Runs analysis jobs on a bounded pool of threads, higher priority first. A job submitted under a key
+    supersedes the previous job with that key: it's dropped if it hasn't started yet, cancelled if it has.
+    move_to_background lowers a job's priority instead, keeping a few of them.
+    Wait and run times are recorded as the "analysis job wait" and "analysis job" timing spans.
+    """
+    def __init__(self, max_workers=ANALYSIS_WORKERS):
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(max_workers)
+        self.lock = threading.Lock()
+        self.keys = {}
+        # Job -> runnable, from submit until the job ends or is dropped.
+        self.runnables = {}
+        # Jobs moved to the background, oldest first.
+        self.background = []
+        self.running = 0
+        self.max_queued = 0
+        self.submitted = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.dropped = 0
+
+    def submit(self, job, key=None, priority=PRIORITY_BACKGROUND):
+        """
+        Queue a job, anything with a run, cancel and is_cancelled method
+
+        :param key: (hashable) the previous job submitted with the same key is cancelled
+        :param priority: (int) higher runs first, see PRIORITY_ON_SCREEN
+        """
+        with self.lock:
+            previous = self.keys.get(key) if key is not None else None
+        if previous is not None:
+            self.cancel(previous)
+        runnable = _JobRunnable(self, job)
+        with self.lock:
+            if key is not None:
+                self.keys[key] = job
+            self.runnables[job] = runnable
+            job.submitted_at = time.perf_counter()
+            self.submitted += 1
+            self.max_queued = max(self.max_queued, len(self.runnables) - self.running)
+        self.pool.start(runnable, priority)
+
+    def set_priority(self, job, priority):
+        """A job still queued is queued again at the new priority, a running one keeps its thread."""
+        with self.lock:
+            runnable = self.runnables.get(job)
+        if runnable is not None and self.pool.tryTake(runnable):
+            self.pool.start(runnable, priority)
+
+    def move_to_background(self, job, limit=ANALYSIS_BACKGROUND_JOBS):
+        """
+        Let a job finish after everything on screen, cancelling the oldest background jobs past limit
+
+        :param job: (Analyzer) a job submitted before, nothing happens if it's over already
+        """
+        with self.lock:
+            if job not in self.runnables:
+                return
+            self.background = [j for j in self.background if j in self.runnables] + [job]
+            excess = self.background[:-limit] if limit > 0 else list(self.background)
+            self.background = self.background[len(excess):]
+        self.set_priority(job, PRIORITY_BACKGROUND)
+        for old in excess:
+            self.cancel(old)
+
+    def cancel(self, job):
+        job.cancel()
+        with self.lock:
+            runnable = self.runnables.get(job)
+        # A job that hasn't started is taken back out of the pool, a running one stops at its next check.
+        if runnable is not None and self.pool.tryTake(runnable):
+            with self.lock:
+                self._forget(job)
+                self.dropped += 1
+
+    def _forget(self, job):
+        self.runnables.pop(job, None)
+        if job in self.background:
+            self.background.remove(job)
+        for key, value in list(self.keys.items()):
+            if value is job:
+                del self.keys[key]
+
+    def _run(self, job):
+        started = time.perf_counter()
+        with self.lock:
+            self.running += 1
+        timing.record("analysis job wait", started - job.submitted_at)
+        try:
+            if not job.is_cancelled():
+                job.run()
+        finally:
+            with self.lock:
+                self.running -= 1
+                self._forget(job)
+                if job.is_cancelled():
+                    self.cancelled += 1
+                else:
+                    self.completed += 1
+            timing.record("analysis job", time.perf_counter() - started, file=getattr(job, "path", None), cancelled=job.is_cancelled())
+
+    def queue_depth(self):
+        with self.lock:
+            return len(self.runnables) - self.running
+
+    def stats(self):
+        with self.lock:
+            return {
+                "workers": self.pool.maxThreadCount(),
+                "queued": len(self.runnables) - self.running,
+                "running": self.running,
+                "background": len(self.background),
+                "max_queued": self.max_queued,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "cancelled": self.cancelled,
+                "dropped": self.dropped,
+            }
+
+    def shutdown(self, timeout=2.0):
+        """
+        Cancel every job and wait for the running ones to unwind
+
+        :return: (bool) False if some job was still running after timeout seconds
+        """
+        with self.lock:
+            jobs = list(self.runnables)
+        for job in jobs:
+            self.cancel(job)
+        return self.pool.waitForDone(int(timeout * 1000))
+
 class ColorDialog(QDialog):
 
     color_dict = {
@@ -1132,24 +2301,56 @@ class MainWindow(QMainWindow):
         markers_color_action = file_menu.addAction("Markers color")
         markers_color_action.triggered.connect(self.select_markers_color)
 
+        analysis_rate_action = file_menu.addAction("Analysis sample rate...")
+        analysis_rate_action.triggered.connect(self.select_analysis_rate)
+
+        resampler_action = file_menu.addAction("Resampler quality...")
+        resampler_action.triggered.connect(self.select_resamplers)
+
+        beat_engine_action = file_menu.addAction("Beat detection engine...")
+        beat_engine_action.triggered.connect(self.select_beat_engines)
+
+        analysis_cache_action = file_menu.addAction("Analysis cache...")
+        analysis_cache_action.triggered.connect(self.show_analysis_cache)
+
         readme_action = help_menu.addAction("Readme")
         readme_action.triggered.connect(lambda: os.startfile(os.path.join(basedir, 'README.md')))
+
+        memory_report_action = help_menu.addAction("Memory report")
+        memory_report_action.triggered.connect(self.show_memory_report)
+
+        timing_report_action = help_menu.addAction("Timing report")
+        timing_report_action.triggered.connect(self.show_timing_report)
+
+        host_detection_action = help_menu.addAction("Host detection stats")
+        host_detection_action.triggered.connect(self.show_host_detection_stats)
+
+        analysis_jobs_action = help_menu.addAction("Analysis jobs")
+        analysis_jobs_action.triggered.connect(self.show_analysis_job_stats)
         
         status_bar = self.statusBar()
         status_bar.showMessage("Ready")
         self.app_status_label = QLabel("App isn't running...")
         status_bar.addPermanentWidget(self.app_status_label)
 
+        # Started by start_deferred_services once the window is on screen.
         self.status_checker = StatusChecker()
         self.status_checker.statusChanged.connect(self.update_app_status)
-        self.status_checker.start()
+        self.extension_installer = ExtensionInstallerThread()
 
         self.widget_layout = Layout()
         self.widget_layout.layout()
         self.setCentralWidget(self.widget_layout)
 
         self.current_app = None
+        # Markers placed on each host timeline during this session.
+        self.marker_tracker = MarkerTracker()
         self.analyzer = None
+        # The job reading the file that's about to be on screen, self.analyzer becomes it once its audio arrives.
+        self.analysis_job = None
+        self.analysis_scheduler = AnalysisScheduler()
+        # Beats of the loaded file, as the user decimated and shifted them. Shared with the waveform and the hosts.
+        self.beat_grid = None
         self.add_markers_thread = None
         self.remove_markers_thread = None
 
@@ -1160,7 +2361,7 @@ class MainWindow(QMainWindow):
         self.widget_layout.offset_text.textChanged.connect(self.offset_text_handler)
         self.widget_layout.every_slider.valueChanged.connect(self.every_slider_handler)
         self.widget_layout.offset_slider.valueChanged.connect(self.offset_slider_handler)
-        self.data = None
+        self.playback = None
 
     def select_markers_color(self):
         global first_beat_color, other_beat_color, compas
@@ -1169,13 +2370,193 @@ class MainWindow(QMainWindow):
             first_beat_color = dialog.first_beat_color
             other_beat_color = dialog.other_beat_color
             compas = dialog.compas
+            if self.beat_grid is not None:
+                self.beat_grid.beats_per_bar = compas
+
+    def start_deferred_services(self):
+        """Work that used to run before the window appeared: extension install check and host probing."""
+        self.extension_installer.start()
+        self.status_checker.start()
+
+    def select_analysis_rate(self):
+        global analysis_sample_rate
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Analysis sample rate")
+        dialog_layout = QVBoxLayout(dialog)
+
+        label = QLabel("Sample rate used to detect beats. Lower is faster, playback is not affected:")
+        label.setStyleSheet("QLabel { color: black }")
+        dialog_layout.addWidget(label)
+
+        rates = [11025, 22050, 44100, None]
+        combo_box = QComboBox()
+        for rate in rates:
+            combo_box.addItem(f"{rate} Hz" if rate is not None else "Same as playback device")
+        combo_box.setCurrentIndex(rates.index(analysis_sample_rate) if analysis_sample_rate in rates else 1)
+        dialog_layout.addWidget(combo_box)
+
+        button = QPushButton("OK")
+        button.clicked.connect(dialog.accept)
+        dialog_layout.addWidget(button)
+
+        if dialog.exec() == 1:
+            analysis_sample_rate = rates[combo_box.currentIndex()]
+
+    def select_resamplers(self):
+        global display_resampler, analysis_resampler
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Resampler quality")
+        dialog_layout = QVBoxLayout(dialog)
+        presets = list(RESAMPLER_PRESETS)
+        labels = {"preview": "Fast (preview)", "final": "High quality (final)"}
+
+        display_label = QLabel("Waveform and playback, when the file isn't at the device's rate:")
+        display_label.setStyleSheet("QLabel { color: black }")
+        dialog_layout.addWidget(display_label)
+        display_combo_box = QComboBox()
+        for preset in presets:
+            display_combo_box.addItem(labels.get(preset, preset))
+        display_combo_box.setCurrentIndex(presets.index(display_resampler))
+        dialog_layout.addWidget(display_combo_box)
+
+        analysis_label = QLabel("Beat detection, when the file isn't at the analysis rate:")
+        analysis_label.setStyleSheet("QLabel { color: black }")
+        dialog_layout.addWidget(analysis_label)
+        analysis_combo_box = QComboBox()
+        for preset in presets:
+            analysis_combo_box.addItem(labels.get(preset, preset))
+        analysis_combo_box.setCurrentIndex(presets.index(analysis_resampler))
+        dialog_layout.addWidget(analysis_combo_box)
+
+        button = QPushButton("OK")
+        button.clicked.connect(dialog.accept)
+        dialog_layout.addWidget(button)
+
+        if dialog.exec() == 1:
+            display_resampler = presets[display_combo_box.currentIndex()]
+            analysis_resampler = presets[analysis_combo_box.currentIndex()]
+
+    def select_beat_engines(self):
+        global preview_beat_engine, final_beat_engine
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Beat detection engine")
+        dialog_layout = QVBoxLayout(dialog)
+        names = list(BEAT_ENGINES)
+
+        preview_label = QLabel("Preview (when a file is opened):")
+        preview_label.setStyleSheet("QLabel { color: black }")
+        dialog_layout.addWidget(preview_label)
+        preview_combo_box = QComboBox()
+        for name in names:
+            preview_combo_box.addItem(BEAT_ENGINES[name].label)
+        preview_combo_box.setCurrentIndex(names.index(preview_beat_engine))
+        dialog_layout.addWidget(preview_combo_box)
+
+        final_label = QLabel("Markers (final pass when creating markers):")
+        final_label.setStyleSheet("QLabel { color: black }")
+        dialog_layout.addWidget(final_label)
+        final_combo_box = QComboBox()
+        final_combo_box.addItem("Same as preview")
+        for name in names:
+            final_combo_box.addItem(BEAT_ENGINES[name].label)
+        final_combo_box.setCurrentIndex(0 if final_beat_engine is None else names.index(final_beat_engine) + 1)
+        dialog_layout.addWidget(final_combo_box)
+
+        button = QPushButton("OK")
+        button.clicked.connect(dialog.accept)
+        dialog_layout.addWidget(button)
+
+        if dialog.exec() == 1:
+            preview_beat_engine = names[preview_combo_box.currentIndex()]
+            final_beat_engine = None if final_combo_box.currentIndex() == 0 else names[final_combo_box.currentIndex() - 1]
+
+    def show_analysis_cache(self):
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Analysis cache")
+        dialog_layout = QVBoxLayout(dialog)
+
+        def describe():
+            stats = analysis_cache.stats()
+            peak_stats = peak_store.stats()
+            return (f"{stats['entries']} analyzed files, {stats['bytes'] / 1e6:.1f} MB of {stats['max_bytes'] / 1e6:.0f} MB\n"
+                    f"Hits: {stats['hits']}, misses: {stats['misses']}\n{stats['dir']}\n"
+                    f"{peak_stats['entries']} peak files, {peak_stats['bytes'] / 1e6:.1f} MB of {peak_stats['max_bytes'] / 1e6:.0f} MB\n"
+                    f"Hits: {peak_stats['hits']}, misses: {peak_stats['misses']}\n{peak_stats['dir']}")
+
+        label = QLabel(describe())
+        label.setStyleSheet("QLabel { color: black }")
+        dialog_layout.addWidget(label)
+
+        entries_text = QTextEdit()
+        entries_text.setReadOnly(True)
+        entries_text.setPlainText("\n".join(
+            f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(e['last_used']))}  {e['bytes'] / 1e3:.0f} kB  {analysis_cache.source_of(e['key'])}"
+            for e in analysis_cache.entries()))
+        dialog_layout.addWidget(entries_text)
+
+        def purge():
+            analysis_cache.purge()
+            peak_store.purge()
+            label.setText(describe())
+            entries_text.clear()
+
+        purge_button = QPushButton("Purge")
+        purge_button.clicked.connect(purge)
+        dialog_layout.addWidget(purge_button)
+
+        button = QPushButton("OK")
+        button.clicked.connect(dialog.accept)
+        dialog_layout.addWidget(button)
+
+        dialog.exec()
+
+    def show_memory_report(self):
+        if self.analyzer is None:
+            self.statusBar().showMessage("No file loaded.")
+            return
+        report = self.analyzer.memory_report()
+        lines = [f"{name}: {size / 1e6:.1f} MB" for name, size in report]
+        lines.append(f"total: {sum(size for _, size in report) / 1e6:.1f} MB")
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Memory report")
+        dialog_layout = QVBoxLayout(dialog)
+        label = QLabel(os.path.basename(self.path) + "\n\n" + "\n".join(lines))
+        label.setStyleSheet("QLabel { color: black }")
+        dialog_layout.addWidget(label)
+        button = QPushButton("OK")
+        button.clicked.connect(dialog.accept)
+        dialog_layout.addWidget(button)
+        dialog.exec()
+
+    def show_timing_report(self):
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Timing report")
+        dialog_layout = QVBoxLayout(dialog)
+        label = QLabel(timing.report())
+        label.setStyleSheet("QLabel { color: black }")
+        label.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        dialog_layout.addWidget(label)
+        button = QPushButton("OK")
+        button.clicked.connect(dialog.accept)
+        dialog_layout.addWidget(button)
+        dialog.exec()
+
+    def show_host_detection_stats(self):
+        stats = self.status_checker.discovery.stats()
+        self.statusBar().showMessage(f"Process scans: {stats['snapshots']}, last {stats['last_ms']:.1f} ms, "
+                                     f"mean {stats['mean_ms']:.1f} ms, max {stats['max_ms']:.1f} ms, next in {stats['interval']:.1f} s")
+
+    def show_analysis_job_stats(self):
+        stats = self.analysis_scheduler.stats()
+        self.statusBar().showMessage(f"Analysis jobs: {stats['running']} running, {stats['queued']} queued (max {stats['max_queued']}), "
+                                     f"{stats['background']} in the background "
+                                     f"on {stats['workers']} workers, {stats['completed']} done, {stats['cancelled']} cancelled, "
+                                     f"{stats['dropped']} dropped. {timing.summary(('analysis job wait', 'analysis job'))}")
 
     def closeEvent(self, event):
         if self.status_checker.isRunning():
-            self.status_checker.terminate()
-        if self.analyzer is not None:
-            if self.analyzer.isRunning():
-                self.analyzer.terminate()
+            self.status_checker.stop()
+        self.analysis_scheduler.shutdown()
         if self.add_markers_thread is not None:
             if self.add_markers_thread.isRunning():
                 self.add_markers_thread.terminate()
@@ -1214,14 +2595,15 @@ class MainWindow(QMainWindow):
 
     def every_slider_handler(self):
         self.widget_layout.every_text.setValue(self.widget_layout.every_slider.value())
-        if self.widget_layout.beats is not None:
-            self.widget_layout.waveform_display._beatsamples = self.widget_layout.beats[self.widget_layout.offset_slider.value()::self.widget_layout.every_slider.value()]
-        self.widget_layout.update()
+        self.update_beat_decimation()
 
     def offset_slider_handler(self):
         self.widget_layout.offset_text.setValue(self.widget_layout.offset_slider.value())
-        if self.widget_layout.beats is not None:
-            self.widget_layout.waveform_display._beatsamples = self.widget_layout.beats[self.widget_layout.offset_slider.value()::self.widget_layout.every_slider.value()]
+        self.update_beat_decimation()
+
+    def update_beat_decimation(self):
+        if self.beat_grid is not None:
+            self.beat_grid.set_decimation(self.widget_layout.every_slider.value(), self.widget_layout.offset_slider.value())
         self.widget_layout.update()
 
     def every_text_handler(self):
@@ -1239,32 +2621,68 @@ class MainWindow(QMainWindow):
         self.widget_layout.offset_slider.setValue(value)
 
     def negative_global_offset(self):
-        # reduces all beat values (which are in seconds) by 0.1
-        if self.widget_layout.beats is not None:
-            self.analyzer.beatsamples -= 0.01
-            self.widget_layout.beats = [int(beat * SAMPLE_RATE) for beat in self.analyzer.beatsamples.tolist()]
-            self.widget_layout.waveform_display._beatsamples = self.widget_layout.beats[self.widget_layout.offset_slider.value()::self.widget_layout.every_slider.value()]
+        # moves all beats 0.01 s earlier
+        if self.beat_grid is not None:
+            self.beat_grid.nudge(-0.01)
             self.widget_layout.update()
     
     def positive_global_offset(self):
-        # increases all beat values (which are in seconds) by 0.1
-        if self.widget_layout.beats is not None:
-            self.analyzer.beatsamples += 0.01
-            self.widget_layout.beats = [int(beat * SAMPLE_RATE) for beat in self.analyzer.beatsamples.tolist()]
-            self.widget_layout.waveform_display._beatsamples = self.widget_layout.beats[self.widget_layout.offset_slider.value()::self.widget_layout.every_slider.value()]
+        # moves all beats 0.01 s later
+        if self.beat_grid is not None:
+            self.beat_grid.nudge(0.01)
             self.widget_layout.update()
 
     def add_markers(self):
+        if self.beat_grid is None:
+            self.statusBar().showMessage("No beats to place yet.")
+            return
         self.statusBar().showMessage("Placing markers...")
-        self.add_markers_thread = AddMarkersThread(self.current_app, self.analyzer.beatsamples, self.widget_layout.every_slider.value(), self.widget_layout.offset_slider.value())
+        engine = None
+        if final_beat_engine is not None and final_beat_engine != self.analyzer.engine.name and self.analyzer.onset_envelope is not None:
+            # Rough preview with a fast engine, markers from the accurate one.
+            engine = get_beat_engine(final_beat_engine)
+            self.statusBar().showMessage("Tracking beats and placing markers...")
+        self.add_markers_thread = AddMarkersThread(self.current_app, self.beat_grid, engine, self.analyzer.onset_envelope,
+                                                   self.analyzer.analysis_rate, self.marker_tracker, self.analyzer)
         self.add_markers_thread.start()
-        self.add_markers_thread.finished.connect(lambda: self.statusBar().showMessage("Done!"))
+        self.add_markers_thread.finished.connect(self.markers_added)
+
+    def markers_added(self):
+        thread = self.add_markers_thread
+        if thread is not None and thread.retracked:
+            # Show the beats the markers were placed on, unless another file was opened meanwhile.
+            if self.analyzer is thread.analyzer and self.beat_grid is thread.source_grid:
+                self.analyzer.engine = thread.engine
+                self.analyzer.tempo = thread.tempo
+                self.analyzer.beatsamples = thread.grid.times
+                self.beat_grid.set_times(thread.grid.times)
+                self.widget_layout.update()
+            message = f"Done! ({thread.engine.name} took {thread.engine.last_runtime:.2f} s)"
+        else:
+            message = "Done!"
+        if thread is not None and thread.error is not None:
+            self.statusBar().showMessage(f"Couldn't place the markers: {thread.error}")
+            return
+        if thread is not None and thread.add_stats:
+            stats = thread.add_stats
+            if "removed" in stats:
+                message += f" {stats['markers']} markers added, {stats['removed']} removed in {stats['seconds']:.2f} s"
+            else:
+                message += f" {stats['markers']} markers in {stats['seconds']:.2f} s ({stats['markers_per_second']:.0f} markers/sec)"
+        self.statusBar().showMessage(message)
 
     def remove_markers(self):
         self.statusBar().showMessage("Removing markers...")
-        self.remove_markers_thread = RemoveMarkersThread(self.current_app)
+        self.remove_markers_thread = RemoveMarkersThread(self.current_app, self.marker_tracker)
         self.remove_markers_thread.start()
-        self.remove_markers_thread.finished.connect(lambda: self.statusBar().showMessage("Done!"))
+        self.remove_markers_thread.finished.connect(self.markers_removed)
+
+    def markers_removed(self):
+        thread = self.remove_markers_thread
+        if thread is not None and thread.error is not None:
+            self.statusBar().showMessage(f"Couldn't remove the markers: {thread.error}")
+        else:
+            self.statusBar().showMessage("Done!")
 
     def update_app_status(self, status):
         if (status == "0"):
@@ -1294,14 +2712,31 @@ class MainWindow(QMainWindow):
 
     def retreive_and_preview(self):
         self.statusBar().showMessage("Reading file from source...")
-        self.analyzer = Analyzer(self.path)
-        self.analyzer.data_loaded.connect(self.preview)
-        self.analyzer.finished.connect(self.beats_preview)
-        self.analyzer.start()
+        self.beat_grid = None
+        if self.playback is not None and self.playback.is_active():
+            self.stop_playback()
+        self.playback = None
+        # The previous file keeps being analyzed in the background, so its results are cached when it's opened
+        # again. Jobs are keyed by path, opening the same file again drops or cancels its previous job.
+        # The slots get the job and ignore all but the current one.
+        job = Analyzer(self.path, cache=analysis_cache, analysis_rate=analysis_sample_rate, engine=get_beat_engine(preview_beat_engine),
+                       display_resampler=display_resampler, analysis_resampler=analysis_resampler, peak_store=peak_store)
+        job.data_loaded.connect(lambda: self.preview(job))
+        job.progress.connect(lambda decoded, total: self.preview_progress(job, decoded, total))
+        job.finished.connect(lambda: self.beats_preview(job))
+        job.failed.connect(lambda message: self.analysis_failed(job, message))
+        if self.analysis_job is not None:
+            self.analysis_scheduler.move_to_background(self.analysis_job)
+        self.analysis_job = job
+        self.analysis_scheduler.submit(job, key=os.path.abspath(self.path), priority=PRIORITY_ON_SCREEN)
     
-    def preview(self):
+    def preview(self, job):
+        if job is not self.analysis_job:
+            return
+        self.analyzer = job
         self.statusBar().showMessage("Extracting beat positions...")
-        self.widget_layout.add_preview(self.analyzer.mono_data, self.analyzer.samplerate)
+        self.widget_layout.add_tempo_map(None)
+        self.widget_layout.add_preview(self.analyzer.data, self.analyzer.samplerate, self.analyzer.peaks)
         self.widget_layout.play_pause_button.clicked.connect(self.start_stop_playback)
         self.widget_layout.left_global_offset_button.clicked.connect(self.negative_global_offset)
         self.widget_layout.right_global_offset_button.clicked.connect(self.positive_global_offset)
@@ -1309,10 +2744,34 @@ class MainWindow(QMainWindow):
         self.widget_layout.waveform_display.zoom_signal.connect(self.handle_zoom_signal)
         self.widget_layout.scroll_bar.valueChanged.connect(self.handle_scroll_bar_signal)
 
-    def beats_preview(self):
+    def preview_progress(self, job, decoded, total):
+        if job is not self.analysis_job:
+            return
+        if decoded < total:
+            self.statusBar().showMessage(f"Reading file from source... {100 * decoded // max(total, 1)}%")
+        else:
+            self.statusBar().showMessage("Extracting beat positions...")
+        self.widget_layout.position_slider.refresh()
+        self.widget_layout.waveform_display.update()
+
+    def analysis_failed(self, job, message):
+        if job is not self.analysis_job:
+            return
+        self.statusBar().showMessage(f"Couldn't analyze the file: {message}")
+
+    def beats_preview(self, job):
+        if job is not self.analysis_job:
+            return
         self.statusBar().showMessage("Displaying beats preview...")
-        self.widget_layout.add_beats(self.analyzer.beatsamples)
-        self.statusBar().showMessage("Ready")
+        self.beat_grid = BeatGrid(self.analyzer.beatsamples, self.widget_layout.every_slider.value(), self.widget_layout.offset_slider.value(),
+                                  beats_per_bar=compas)
+        self.widget_layout.add_beats(self.beat_grid)
+        self.widget_layout.add_tempo_map(self.analyzer.tempo_map)
+        throughput = f", {self.analyzer.decode_throughput:.0f} s of audio/s" if self.analyzer.decode_throughput is not None else ""
+        if self.analyzer.cache_hit:
+            self.statusBar().showMessage(f"Ready (from cache: {timing.summary(('decode', 'cache lookup'))}{throughput})")
+        else:
+            self.statusBar().showMessage(f"Ready ({self.analyzer.engine.name}: {timing.summary(('decode', 'onset envelope', 'beat tracking'))}{throughput})")
 
     def handle_scroll_bar_signal(self, value):
         # Get the current start and end frames
@@ -1368,16 +2827,23 @@ class MainWindow(QMainWindow):
         self.widget_layout.waveform_display.update()
 
     def manually_set_play_position(self, value):
-        self.data = self.analyzer.data[:, value:]
+        if self.playback is not None:
+            self.playback.seek(value)
 
     def follow_track_line(self):
         self.widget_layout.scroll_bar.setValue
         self.widget_layout.update()
 
     def update_ui(self):
-        current_position = int(self.analyzer.data.shape[1] - self.data.shape[1])
-        if self.widget_layout.position_slider.value() != current_position: self.widget_layout.position_slider.setValue(current_position)
-        
+        if self.playback.finished:
+            self.stop_playback()
+        current_position = self.playback.position
+        if self.widget_layout.position_slider.value() != current_position:
+            # Following the playback isn't a seek, don't let the slider move the cursor back.
+            self.widget_layout.position_slider.blockSignals(True)
+            self.widget_layout.position_slider.setValue(current_position)
+            self.widget_layout.position_slider.blockSignals(False)
+
         if self.widget_layout.follow_line_button.isChecked():
             startframe = self.widget_layout.waveform_display._startframe
             endframe = self.widget_layout.waveform_display._endframe
@@ -1394,66 +2860,98 @@ class MainWindow(QMainWindow):
     def start_stop_playback(self):
         global is_playing
         if self.widget_layout is not None:
-            if self.data is None or self.data.shape[1] < 1: self.data = self.analyzer.data
+            if self.playback is None or self.playback.buffer is not self.analyzer.interleaved:
+                self.playback = PlaybackEngine(self.analyzer.interleaved, self.analyzer.samplerate)
+                self.playback.seek(self.widget_layout.position_slider.value())
             if self.widget_layout.play_pause_button.text() == "Play":
                 self.widget_layout.play_pause_button.setText("Pause")
-                self.start_audio_playback()
+                self.playback.start()
                 is_playing = True
                 self.timer = QTimer()
                 self.timer.timeout.connect(self.update_ui)
                 self.timer.start(30)
             else:
-                self.widget_layout.play_pause_button.setText("Play")
-                if self.widget_layout.follow_line_button.isChecked():
-                    self.widget_layout.follow_line_button.setChecked(False)
-                self.stop_audio_playback()
-                self.timer.stop()
-                is_playing = False
-
-    def start_audio_playback(self):
-        self.stream = sd.OutputStream(
-                                dtype='float32',
-                                channels=self.analyzer.data.shape[0],
-                                samplerate=self.analyzer.samplerate,
-                                callback=self.callback)
-        self.stream.start()
+                self.stop_playback()
 
-    def stop_audio_playback(self):
-        self.stream.stop()
-        self.stream.close()
-
-    def callback(self, outdata, frames, time, status):
+    def stop_playback(self):
         global is_playing
-        data = self.data[:, :frames]
-        self.data = self.data[:, frames:]
-        if data.shape[1] < frames:
-            self.widget_layout.play_pause_button.setText("Play")
+        self.widget_layout.play_pause_button.setText("Play")
+        if self.widget_layout.follow_line_button.isChecked():
             self.widget_layout.follow_line_button.setChecked(False)
-            is_playing = False
-            outdata[:] = np.zeros((frames, 2), dtype='float32')
-            raise sd.CallbackStop()
-        else:
-            outdata[:] = data.T
+        self.playback.stop()
+        self.timer.stop()
+        is_playing = False
+        if self.playback.xruns:
+            self.statusBar().showMessage(f"Playback had {self.playback.xruns} xruns ({self.playback.underflows} output underflows)")
 
 if WINDOWS_SYSTEM:
     custom_ae_path = None
 
 is_playing = False
-app = QApplication(sys.argv)
-
-font = QFont("Outfit Medium", 9)
-app.setFont(font)
+analysis_cache = AnalysisCache()
+peak_store = PeakStore()
+analysis_sample_rate = DEFAULT_ANALYSIS_SAMPLE_RATE
+# What is played back is resampled in high quality too, the fast preset is opt in from File > Resampler quality.
+display_resampler = DEFAULT_RESAMPLER
+analysis_resampler = DEFAULT_RESAMPLER
+preview_beat_engine = DEFAULT_BEAT_ENGINE
+final_beat_engine = None
 
 first_beat_color = 0
 other_beat_color = 1
 compas = 4
 
-# darkPalette = QPalette()
-# darkPalette.setColor(QPalette.Window, QColor(53, 53, 53))
-# darkPalette.setColor(QPalette.WindowText, Qt.white)
-
-# app.setPalette(darkPalette)
-
-window = MainWindow(app)
-window.show()
-app.exec()
\ No newline at end of file
+startup_timer.mark("environment setup")
+
+def main():
+    # --eager-startup probes the audio device and installs the extension before showing the window,
+    # like AutoMarker used to. --startup-report prints how long each startup phase took.
+    global app, window
+    eager = "--eager-startup" in sys.argv
+    show_report = "--startup-report" in sys.argv or os.environ.get("AUTOMARKER_STARTUP_REPORT") == "1"
+    # --timing-log <file> (or AUTOMARKER_TIMING_LOG) appends every timing span to a JSON lines file.
+    timing_log = os.environ.get("AUTOMARKER_TIMING_LOG")
+    if "--timing-log" in sys.argv[:-1]:
+        timing_log = sys.argv[sys.argv.index("--timing-log") + 1]
+    if timing_log:
+        try:
+            timing.open_log(timing_log)
+        except OSError as e:
+            print(e)
+    if eager:
+        install_extension_if_needed()
+        startup_timer.mark("extension check")
+        get_sample_rate()
+        startup_timer.mark("audio device probe")
+
+    app = QApplication(sys.argv)
+
+    font = QFont("Outfit Medium", 9)
+    app.setFont(font)
+    startup_timer.mark("qt application")
+
+    # darkPalette = QPalette()
+    # darkPalette.setColor(QPalette.Window, QColor(53, 53, 53))
+    # darkPalette.setColor(QPalette.WindowText, Qt.white)
+
+    # app.setPalette(darkPalette)
+
+    window = MainWindow(app)
+    startup_timer.mark("main window")
+    window.show()
+
+    def window_shown():
+        # First event loop iteration, the window has been painted.
+        startup_timer.mark("first paint")
+        window.start_deferred_services()
+        if show_report:
+            # Give the deferred probes a moment so they show up in the report.
+            QTimer.singleShot(2000, lambda: print("AutoMarker startup:\n" + startup_timer.report()))
+    QTimer.singleShot(0, window_shown)
+
+    sys.exit(app.exec())
+
+if __name__ == "__main__":
+    # Long files are beat tracked in spawned processes, which frozen builds have to hand over here.
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,172 @@
+# AutoMarker by acrilique.
+# Headless batch analysis: runs the same decode -> mono mix -> beat tracking pipeline as the GUI
+# over whole folders of audio files, using a pool of worker processes.
+#
+# Usage: python automarker_batch.py <folder> [--out <folder>] [--format json|csv] [--workers N]
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from automarker_core import AnalysisCache, analyze_file, get_beat_engine, AUDIO_EXTENSIONS, BEAT_ENGINES, DEFAULT_BEAT_ENGINE, DEFAULT_ANALYSIS_SAMPLE_RATE
+
+def find_audio_files(root):
+    """
+    Walk a directory tree looking for audio files
+
+    :param root: (str) folder to scan
+    :return: (list of str) sorted paths of the audio files found
+    """
+    found = []
+    for folder, _, names in os.walk(root):
+        for name in names:
+            if name.lower().endswith(AUDIO_EXTENSIONS):
+                found.append(os.path.join(folder, name))
+    found.sort()
+    return found
+
+def output_path_for(path, root, out_dir, fmt):
+    """Result file of an audio file. Mirrors the input tree when an output folder is given."""
+    if out_dir is None:
+        base = path
+    else:
+        base = os.path.join(out_dir, os.path.relpath(path, root))
+    return f"{base}.beats.{fmt}"
+
+def write_result(result, out_path, fmt):
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    if fmt == "json":
+        with open(out_path, 'w') as f:
+            json.dump({
+                "file": result["file"],
+                "tempo": result["tempo"],
+                "engine": result["engine"],
+                "sample_rate": result["sample_rate"],
+                "beats": result["beat_times"],
+            }, f, indent=1)
+    else:
+        with open(out_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["beat", "time", "tempo"])
+            for i, beat in enumerate(result["beat_times"]):
+                writer.writerow([i, f"{beat:.6f}", f"{result['tempo']:.3f}"])
+
+def _analyze_worker(path, root, out_dir, fmt, sr, cache_dir, engine_name, engine_params):
+    # Runs in a worker process, so everything it needs comes in as arguments.
+    start = time.perf_counter()
+    cache = AnalysisCache(cache_dir) if cache_dir is not None else None
+    result = analyze_file(path, sr, cache, get_beat_engine(engine_name, **engine_params))
+    result = {
+        "file": path,
+        "engine": engine_name,
+        "tempo": result["tempo"],
+        "beat_times": [float(b) for b in result["beat_times"]],
+        "sample_rate": sr,
+        "duration": result["duration"],
+        "cached": result["cached"],
+    }
+    out_path = output_path_for(path, root, out_dir, fmt)
+    write_result(result, out_path, fmt)
+    return out_path, result, time.perf_counter() - start
+
+def run_batch(root, out_dir=None, fmt="json", workers=None, sr=DEFAULT_ANALYSIS_SAMPLE_RATE, cache_dir="", skip_existing=False,
+              engine_name=DEFAULT_BEAT_ENGINE, engine_params=None):
+    """
+    Analyze every audio file under root
+
+    :param cache_dir: (str) analysis cache folder, "" for the default one, None to disable the cache
+    :return: (dict) summary with files, failed, seconds and files_per_second
+    """
+    engine_params = engine_params or {}
+    # Fail early on bad engine parameters rather than once per file.
+    get_beat_engine(engine_name, **engine_params)
+    paths = find_audio_files(root)
+    if skip_existing:
+        paths = [p for p in paths if not os.path.exists(output_path_for(p, root, out_dir, fmt))]
+    print(f"Analyzing {len(paths)} files with {workers or os.cpu_count()} workers...")
+
+    start = time.perf_counter()
+    done = 0
+    failed = []
+    audio_seconds = 0.0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_analyze_worker, path, root, out_dir, fmt, sr, cache_dir, engine_name, engine_params): path for path in paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                out_path, result, seconds = future.result()
+            except Exception as e:
+                failed.append(path)
+                print(f"FAILED {path}: {e}", file=sys.stderr)
+                continue
+            done += 1
+            if result["duration"] is not None:
+                audio_seconds += result["duration"]
+            source = "cache" if result["cached"] else f"{seconds:.1f} s"
+            print(f"[{done + len(failed)}/{len(paths)}] {result['tempo']:.1f} bpm, {len(result['beat_times'])} beats ({source}) -> {out_path}")
+    elapsed = time.perf_counter() - start
+
+    files_per_second = done / elapsed if elapsed > 0 else 0.0
+    print(f"Done: {done} files in {elapsed:.1f} s ({files_per_second:.2f} files/sec, {audio_seconds / max(elapsed, 1e-9):.1f} s of decoded audio per second), {len(failed)} failed.")
+    return {"files": done, "failed": failed, "seconds": elapsed, "files_per_second": files_per_second}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze folders of audio files without the AutoMarker GUI.")
+    parser.add_argument("folder", nargs="?", help="folder to scan recursively for audio files")
+    parser.add_argument("--out", default=None, help="folder to write results to (default: next to each audio file)")
+    parser.add_argument("--format", choices=("json", "csv"), default="json")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--sr", type=int, default=DEFAULT_ANALYSIS_SAMPLE_RATE, help="analysis sample rate")
+    parser.add_argument("--engine", choices=list(BEAT_ENGINES), default=DEFAULT_BEAT_ENGINE, help="beat detection engine")
+    parser.add_argument("--engine-param", action="append", default=[], metavar="NAME=VALUE", help="engine parameter, can be repeated")
+    parser.add_argument("--skip-existing", action="store_true", help="skip files that already have a result file")
+    parser.add_argument("--cache-dir", default="", help="analysis cache folder (default: ~/AutoMarker/cache)")
+    parser.add_argument("--no-cache", action="store_true", help="don't read or write the analysis cache")
+    parser.add_argument("--cache-stats", action="store_true", help="print the analysis cache contents and exit")
+    parser.add_argument("--purge-cache", action="store_true", help="empty the analysis cache and exit")
+    args = parser.parse_args(argv)
+
+    if args.cache_stats or args.purge_cache:
+        cache = AnalysisCache(args.cache_dir)
+        if args.purge_cache:
+            print(f"Freed {cache.purge() / 1e6:.1f} MB from {cache.folder}")
+        else:
+            stats = cache.stats()
+            print(f"{stats['dir']}: {stats['entries']} entries, {stats['bytes'] / 1e6:.1f} MB of {stats['max_bytes'] / 1e6:.0f} MB")
+            for entry in cache.entries():
+                last_used = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['last_used']))
+                print(f"  {last_used}  {entry['bytes'] / 1e3:8.0f} kB  {cache.source_of(entry['key'])}")
+        return 0
+
+    if args.folder is None:
+        parser.error("a folder to analyze is required")
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    # Values take the type of the engine's default, so integer parameters stay integers and the cache
+    # keys match the GUI's.
+    default_params = BEAT_ENGINES[args.engine].default_params
+    engine_params = {}
+    for param in args.engine_param:
+        name, _, value = param.partition("=")
+        if name not in default_params:
+            parser.error(f"Unknown parameter '{name}' for the {args.engine} engine, available: {', '.join(default_params)}")
+        kind = type(default_params[name])
+        try:
+            engine_params[name] = kind(value)
+        except ValueError:
+            parser.error(f"--engine-param {name} expects {'an integer' if kind is int else 'a number'}, got '{value}'")
+    try:
+        get_beat_engine(args.engine, **engine_params)
+    except ValueError as e:
+        parser.error(str(e))
+
+    summary = run_batch(args.folder, args.out, args.format, args.workers, args.sr,
+                        None if args.no_cache else args.cache_dir, args.skip_existing, args.engine, engine_params)
+    return 1 if summary["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,947 @@
+# AutoMarker by acrilique.
+# Performance benchmarks for the analysis pipeline.
+#
+# Usage: python automarker_bench.py rates <audio file> [--rates 11025,22050,44100] [--playback-rate 48000]
+#        python automarker_bench.py engines <audio file> [--sr 22050]
+#        python automarker_bench.py premiere [--markers 100,1000,10000]
+#        python automarker_bench.py resolve [--markers 100,1000,10000] [--latency-ms 0.5]
+#        python automarker_bench.py ae [--runs 20] [--delay-ms 50] [--operations 100]
+#        python automarker_bench.py suite [--durations 30,120,600] [--out results.json] [--compare previous.json]
+#        python automarker_bench.py chunked [--durations 1800,3600] [--workers 4]
+#        python automarker_bench.py decode <audio file> [--sr 48000]
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from automarker_core import load_audio, decode_in_worker, stream_info, stream_audio_blocks, resample_mono, compute_onset_envelope, track_beats, get_beat_engine, BeatGrid, ChunkedBeatTracker, BEAT_ENGINES, RESAMPLER_PRESETS, DEFAULT_ANALYSIS_SAMPLE_RATE, ANALYSIS_HOP_LENGTH, CHUNK_WINDOW_SECONDS, CHUNK_OVERLAP_SECONDS
+
+def analyze_at_rate(path, playback_rate, analysis_rate):
+    """
+    The GUI's non streaming analysis: decode at the playback rate, then track beats at analysis_rate
+
+    :return: (dict) per stage seconds, tempo and beat times
+    """
+    timings = {}
+    start = time.perf_counter()
+    data, samplerate, mono_data = load_audio(path, playback_rate)
+    timings["decode"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    analysis_data = resample_mono(mono_data, samplerate, analysis_rate)
+    timings["resample"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    onset_envelope = compute_onset_envelope(analysis_data, analysis_rate)
+    timings["onset envelope"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tempo, beat_times = track_beats(onset_envelope, analysis_rate)
+    timings["beat tracking"] = time.perf_counter() - start
+
+    timings["total"] = sum(timings.values())
+    return {"timings": timings, "tempo": tempo, "beat_times": beat_times, "duration": data.shape[1] / samplerate}
+
+def beat_deviation(beat_times, reference):
+    """Largest distance in seconds from a beat to the closest reference beat."""
+    if len(beat_times) == 0 or len(reference) == 0:
+        return float("nan")
+    idx = np.clip(np.searchsorted(reference, beat_times), 1, len(reference) - 1)
+    distances = np.minimum(np.abs(beat_times - reference[idx - 1]), np.abs(beat_times - reference[idx]))
+    return float(distances.max())
+
+def beat_agreement(beat_times, reference, tolerance):
+    """Fraction of the reference beats that have a beat within tolerance seconds."""
+    if len(reference) == 0:
+        return float("nan")
+    if len(beat_times) == 0:
+        return 0.0
+    after = np.searchsorted(beat_times, reference)
+    before = beat_times[np.clip(after - 1, 0, len(beat_times) - 1)]
+    following = beat_times[np.clip(after, 0, len(beat_times) - 1)]
+    distances = np.minimum(np.abs(reference - before), np.abs(reference - following))
+    return float(np.mean(distances <= tolerance))
+
+def bench_analysis_rates(path, rates, playback_rate, repeat=1):
+    """
+    Time the end to end analysis of a file at several analysis rates
+
+    :param rates: (list of int) analysis rates, the beats of the first one are the reference
+    :param playback_rate: (int) decode rate, the output device rate in the GUI
+    :param repeat: (int) runs per rate, the fastest one is kept
+    :return: (list of dict) one row per rate
+    """
+    # Warm up: the first beat tracking call compiles librosa's numba kernels.
+    analyze_at_rate(path, playback_rate, rates[0])
+    rows = []
+    reference = None
+    for rate in rates:
+        runs = [analyze_at_rate(path, playback_rate, rate) for _ in range(repeat)]
+        best = min(runs, key=lambda r: r["timings"]["total"])
+        if reference is None:
+            reference = best["beat_times"]
+        rows.append({
+            "analysis_rate": rate,
+            "playback_rate": playback_rate,
+            "audio_seconds": best["duration"],
+            "timings": best["timings"],
+            "tempo": best["tempo"],
+            "beats": len(best["beat_times"]),
+            "max_beat_deviation": beat_deviation(best["beat_times"], reference),
+        })
+    return rows
+
+def bench_engines(path, sr, repeat=3):
+    """
+    Time every beat engine on the same onset envelope
+
+    :return: (list of dict) one row per engine, beats compared to the dynamic programming tracker
+    """
+    data, samplerate, mono_data = load_audio(path, sr)
+    onset_envelope = compute_onset_envelope(mono_data, samplerate)
+    rows = []
+    reference = None
+    for name in BEAT_ENGINES:
+        engine = get_beat_engine(name)
+        engine.track(onset_envelope, samplerate)  # warm up numba
+        runtimes = []
+        for _ in range(repeat):
+            tempo, beat_times = engine.track(onset_envelope, samplerate)
+            runtimes.append(engine.last_runtime)
+        if reference is None:
+            reference = beat_times
+        rows.append({"engine": name, "runtime": min(runtimes), "tempo": tempo, "beats": len(beat_times),
+                     "audio_seconds": data.shape[1] / samplerate, "max_beat_deviation": beat_deviation(beat_times, reference)})
+    return rows
+
+def bench_decode(path, sr, repeat=3):
+    """
+    Decode throughput of every decode path and resampler preset
+
+    :param sr: (int) decode rate, the output device rate in the GUI
+    :return: (list of dict) one row per path and preset, throughput in seconds of audio per second
+    """
+    def stream(resampler):
+        channels, length, native_sr = stream_info(path, sr)
+        for block in stream_audio_blocks(path, sr, resampler=resampler):
+            pass
+        return length / sr
+
+    def load(resampler):
+        data, samplerate, mono_data = load_audio(path, sr, resampler)
+        return data.shape[1] / samplerate
+
+    def worker(resampler):
+        interleaved, samplerate = decode_in_worker(path, sr, resampler)
+        return len(interleaved) / samplerate
+
+    # The worker's first call starts its process.
+    worker(next(iter(RESAMPLER_PRESETS)))
+    rows = []
+    for mode, decode in (("stream", stream), ("load", load), ("worker", worker)):
+        for resampler in RESAMPLER_PRESETS:
+            seconds = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                try:
+                    audio_seconds = decode(resampler)
+                except RuntimeError as e:
+                    # soundfile can't stream every format.
+                    print(f"{mode}: {e}", file=sys.stderr)
+                    break
+                seconds.append(time.perf_counter() - start)
+            if seconds:
+                rows.append({"mode": mode, "resampler": resampler, "seconds": min(seconds), "audio_seconds": audio_seconds,
+                             "throughput": audio_seconds / max(min(seconds), 1e-9)})
+    return rows
+
+class PremiereStandInHandler(BaseHTTPRequestHandler):
+    """Answers like the CEP panel server on port 3000, counting the markers of each script instead of evaluating it."""
+    protocol_version = "HTTP/1.1"  # keep-alive, as node's http server does
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        script = json.loads(body)["to_eval"]
+        times = re.search(r"var t = \[([^\]]*)\]", script)
+        if times is None:
+            # Not a marker script, e.g. the sequence id query.
+            count = 0
+            reply = b"stand-in-sequence"
+        else:
+            count = len(times.group(1).split(",")) if times.group(1) else 0
+            reply = str(count).encode()
+        self.server.markers += count
+        self.server.requests += 1
+        self.server.bytes += len(body)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_premiere_stand_in(port=3000):
+    """:return: (ThreadingHTTPServer) stand-in serving in a daemon thread, with markers, requests and bytes counters"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), PremiereStandInHandler)
+    server.markers = server.requests = server.bytes = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def bench_premiere(counts, port=3000):
+    """
+    Send marker sets of several sizes through the Premiere interface to a local stand-in server
+
+    :param counts: (list of int) number of markers per run
+    :return: (list of dict) one row per run
+    """
+    from automarkerQt import PR_JSInterface
+    server = start_premiere_stand_in(port)
+    rows = []
+    try:
+        interface = PR_JSInterface(url=f"http://127.0.0.1:{port}")
+        for count in counts:
+            server.markers = server.requests = server.bytes = 0
+            grid = BeatGrid(np.arange(count) * 0.5)
+            stats = interface.addMarkers(grid.marker_times().tolist(), grid.marker_colors(0, 1).tolist())
+            if server.markers != count:
+                raise RuntimeError(f"Stand-in server got {server.markers} markers, {count} were sent")
+            rows.append(dict(stats, payload_bytes=server.bytes))
+    finally:
+        server.shutdown()
+        server.server_close()
+    return rows
+
+class MockScriptObject(object):
+    """Base of the mock Resolve objects: every public method call counts as one round trip and takes latency seconds."""
+
+    def __init__(self, stats, latency):
+        self._stats = stats
+        self._latency = latency
+
+    def __getattribute__(self, name):
+        attribute = object.__getattribute__(self, name)
+        if name[0].isupper() and callable(attribute):
+            stats = object.__getattribute__(self, "_stats")
+            stats[name] = stats.get(name, 0) + 1
+            time.sleep(object.__getattribute__(self, "_latency"))
+        return attribute
+
+class MockTimeline(MockScriptObject):
+
+    def __init__(self, stats, latency, unique_id="timeline-1", frames=24 * 3600, framerate="24"):
+        super().__init__(stats, latency)
+        self.unique_id = unique_id
+        self.frames = frames
+        self.framerate = framerate
+        self.markers = {}
+
+    def GetUniqueId(self):
+        return self.unique_id
+
+    def GetStartFrame(self):
+        return 86400
+
+    def GetEndFrame(self):
+        return 86400 + self.frames
+
+    def GetSetting(self, name):
+        return self.framerate if name == "timelineFrameRate" else ""
+
+    def GetMarkers(self):
+        return {float(frame): dict(info) for frame, info in self.markers.items()}
+
+    def AddMarker(self, frame, color, name, note, duration):
+        if frame in self.markers:
+            return False
+        self.markers[frame] = {"color": color, "name": name, "note": note, "duration": duration}
+        return True
+
+    def DeleteMarkerAtFrame(self, frame):
+        return self.markers.pop(frame, None) is not None
+
+    def DeleteMarkersByColor(self, color):
+        for frame in [f for f, info in self.markers.items() if color == "All" or info["color"] == color]:
+            del self.markers[frame]
+        return True
+
+class MockProject(MockScriptObject):
+
+    def __init__(self, stats, latency, timeline):
+        super().__init__(stats, latency)
+        self.timeline = timeline
+
+    def GetCurrentTimeline(self):
+        return self.timeline
+
+class MockProjectManager(MockScriptObject):
+
+    def __init__(self, stats, latency, project):
+        super().__init__(stats, latency)
+        self.project = project
+
+    def GetCurrentProject(self):
+        return self.project
+
+class MockResolve(MockScriptObject):
+    """Stands in for bmd.scriptapp("Resolve") with one project holding one timeline."""
+
+    def __init__(self, latency=0.0, **timeline_settings):
+        self.stats = {}
+        super().__init__(self.stats, latency)
+        self.timeline = MockTimeline(self.stats, latency, **timeline_settings)
+        self.project_manager = MockProjectManager(self.stats, latency, MockProject(self.stats, latency, self.timeline))
+
+    def GetProjectManager(self):
+        return self.project_manager
+
+    def OpenPage(self, name):
+        return True
+
+def bench_resolve(counts, latency):
+    """
+    Add marker sets of several sizes through Resolve_Interface to a mock Resolve
+
+    :param counts: (list of int) beats per run, some land on the same frame or past the timeline end
+    :param latency: (float) simulated seconds per round trip
+    :return: (list of dict) one row per run
+    """
+    from automarkerQt import Resolve_Interface
+    rows = []
+    for count in counts:
+        resolve = MockResolve(latency, frames=24 * 600)
+        interface = Resolve_Interface(resolve)
+        # Beats every 0.02 s: several per frame at 24 fps, and past the 10 minute timeline for large counts.
+        beats = np.arange(count) * 0.02
+        start = time.perf_counter()
+        interface.addMarkers(beats)
+        seconds = time.perf_counter() - start
+        round_trips = sum(resolve.stats.values())
+        # A second pass reuses the cached session and replaces the markers already there.
+        resolve.stats.clear()
+        interface.addMarkers(beats)
+        rows.append({"beats": count, "markers": len(resolve.timeline.markers), "round_trips": round_trips,
+                     "round_trips_per_marker": round_trips / max(len(resolve.timeline.markers), 1),
+                     "second_pass_round_trips": sum(resolve.stats.values()), "seconds": seconds})
+    return rows
+
+class AEStandInLauncher(object):
+    """What the runner returns: the launcher hands the script over after delay seconds."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.killed = False
+
+    def wait(self, timeout=None):
+        if timeout is not None and self.delay > timeout:
+            time.sleep(timeout)
+            raise subprocess.TimeoutExpired("AfterFX", timeout)
+        time.sleep(self.delay)
+        return 0
+
+    def kill(self):
+        self.killed = True
+
+class AEStandIn(object):
+    """
+    Stands in for After Effects as the runner of AE_JSWrapper. The host is another process, started with
+    "python -m automarker_bench ae-host", and each script run is handed to it as AE's launcher would.
+    It writes the return file delay seconds later, after a result of an older command that has to be
+    ignored. With answer False nothing is written back. Launchers take launch_delay seconds to hand the
+    script over.
+    """
+    reply = "one"
+
+    def __init__(self, returnFile, delay=0.05, answer=True, launch_delay=0.0):
+        self.returnFile = returnFile
+        self.delay = delay
+        self.answer = answer
+        self.launch_delay = launch_delay
+        self.launches = 0
+        self.launchers = []
+        self.host = subprocess.Popen([sys.executable, "-m", "automarker_bench", "ae-host", returnFile],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+                                     cwd=os.path.dirname(os.path.abspath(__file__)))
+        # Started like After Effects is, before any script is run.
+        if self.host.stdout.readline().strip() != "ready":
+            raise RuntimeError("The After Effects stand-in didn't start")
+
+    def __call__(self, target):
+        script = re.search(r'DoScriptFile "([^"]*)"', target[-1])
+        if script is None and not target[-1].endswith(".jsx"):
+            # Activating the app.
+            return AEStandInLauncher()
+        launcher = AEStandInLauncher(self.launch_delay)
+        self.launchers.append(launcher)
+        self.launches += 1
+        request = {"script": script.group(1) if script is not None else target[-1], "delay": self.delay,
+                   "answer": self.answer, "reply": self.reply}
+        self.host.stdin.write(json.dumps(request) + "\n")
+        self.host.stdin.flush()
+        return launcher
+
+    def close(self):
+        """Stop the host, dropping the answers not written yet."""
+        self.host.terminate()
+        self.host.wait()
+        self.host.stdin.close()
+        self.host.stdout.close()
+
+def ae_host(returnFile, requests=sys.stdin):
+    """
+    The After Effects stand-in process: runs the scripts named on its input, one JSON request per line,
+    by writing their results to the return file
+
+    :param returnFile: (str) return file of the AE_JSWrapper
+    """
+    def write(content):
+        with open(returnFile, 'w') as f:
+            f.write(content)
+
+    print("ready", flush=True)
+    for line in requests:
+        request = json.loads(line)
+        with open(request["script"]) as f:
+            jsx = f.read()
+        command_id = re.search(r'datFile.writeln\("#(\w+)"\)', jsx)
+        if command_id is None:
+            continue
+        write("#stale-command\n0\n")
+        if request["answer"]:
+            time.sleep(request["delay"])
+            # "operations" answers how many operations were batched in the script.
+            reply = jsx.count("(function () {") if request["reply"] == "operations" else 1
+            write(f"#{command_id.group(1)}\n{reply}\n")
+
+def bench_ae_return(runs, delay, timeout=0.5):
+    """
+    Read results back from an After Effects stand-in through AE_JSWrapper
+
+    :param runs: (int) commands to run
+    :param delay: (float) seconds the stand-in takes to write each result
+    :param timeout: (float) seconds to wait for a stand-in that never answers
+    :return: (list of dict) one row per command, plus a last row for the timeout
+    """
+    from automarkerQt import AE_JSWrapper
+    rows = []
+    with tempfile.TemporaryDirectory() as folder:
+        wrapper = AE_JSWrapper(returnFolder=folder)
+        host = AEStandIn(wrapper.returnFile, delay)
+        wrapper.runner = host
+        try:
+            for run in range(runs):
+                wrapper.jsNewCommandGroup()
+                wrapper.jsWriteDataOut("1")
+                wrapper.jsWriteCommands()
+                wrapper.jsExecuteCommand().wait()
+                result = wrapper.readReturn()
+                if result != ["1"]:
+                    raise RuntimeError(f"Read {result} back from the stand-in instead of its result")
+                latency = wrapper.latencies[-1][1]
+                rows.append({"run": run, "latency": latency, "overhead": latency - delay})
+
+            host.answer = False
+            wrapper.jsNewCommandGroup()
+            wrapper.jsWriteDataOut("1")
+            wrapper.jsWriteCommands()
+            wrapper.jsExecuteCommand().wait()
+            start = time.perf_counter()
+            try:
+                result = wrapper.readReturn(timeout)
+            except TimeoutError:
+                waited = time.perf_counter() - start
+                rows.append({"run": "timeout", "latency": waited, "overhead": waited - timeout})
+            else:
+                raise RuntimeError(f"Read {result} back from a stand-in that never answered")
+        finally:
+            host.close()
+            wrapper.returnWaiter.close()
+    return rows
+
+class AEQueueStandIn(AEStandIn):
+    """Answers with the number of operations in the script, so a result tells how many were batched together."""
+    reply = "operations"
+
+def bench_ae_queue(operations, delay, launch_timeout=0.1):
+    """
+    Queue marker operations on AE_JSInterface with a stand-in runner, batched into one script run or flushed one by one
+
+    :param operations: (int) operations per run
+    :param delay: (float) seconds the stand-in takes to write each result
+    :param launch_timeout: (float) seconds to wait for a launcher that never hands the script over
+    :return: (list of dict) one row per mode, plus a last row for the launch timeout
+    """
+    from automarkerQt import AE_JSInterface
+    rows = []
+    with tempfile.TemporaryDirectory() as folder:
+        interface = AE_JSInterface(returnFolder=folder)
+        host = AEQueueStandIn(interface.aeCom.returnFile, delay)
+        interface.aeCom.runner = host
+        try:
+            for mode in ("batched", "unbatched"):
+                host.launches = 0
+                start = time.perf_counter()
+                for i in range(operations):
+                    interface.queueMarkers([i * 0.5])
+                    if mode == "unbatched":
+                        interface.queue.flush()
+                # Runs whatever is still queued along with the query, as the marker threads do.
+                batched = int(interface.queue.flush("0")[0])
+                seconds = time.perf_counter() - start
+                expected_launches = 1 if mode == "batched" else operations + 1
+                if host.launches != expected_launches:
+                    raise RuntimeError(f"{mode}: {operations} operations took {host.launches} launches, expected {expected_launches}")
+                rows.append({"mode": mode, "operations": operations, "launches": host.launches,
+                             "last_batch": batched, "seconds": seconds})
+
+            host.launch_delay = launch_timeout * 10
+            interface.queue.launchTimeout = launch_timeout
+            interface.queueMarkers([0.0])
+            start = time.perf_counter()
+            try:
+                interface.queue.flush()
+            except TimeoutError:
+                if not host.launchers[-1].killed:
+                    raise RuntimeError("The launcher that timed out wasn't killed")
+                rows.append({"mode": "timeout", "operations": 1, "launches": 1, "last_batch": 0, "seconds": time.perf_counter() - start})
+            else:
+                raise RuntimeError("A launcher that never handed the script over didn't time out")
+        finally:
+            host.close()
+            interface.aeCom.returnWaiter.close()
+    return rows
+
+###############################
+# SYNTHETIC AUDIO SUITE
+#  - Click tracks and drum loops of known tempo, written to disk so decoding is measured too.
+#  - Every file is benchmarked in its own process, so the peak RSS is that file's alone.
+###############################
+SUITE_KINDS = ("click", "drums")
+SUITE_TEMPO = {"click": 120.0, "drums": 128.0}
+SUITE_ZOOMS = (None, 60.0, 5.0)  # visible seconds, None for the whole file
+
+def synth_bar(kind, tempo, sr):
+    """
+    One 4/4 bar of audio, stereo
+
+    :return: (np.ndarray) float32 with shape (samples, 2)
+    """
+    beat = 60.0 / tempo
+    length = int(round(4 * beat * sr))
+    bar = np.zeros(length, dtype=np.float32)
+    rng = np.random.default_rng(0)
+
+    def hit(position, sound):
+        start = int(position * sr)
+        end = min(start + len(sound), length)
+        bar[start:end] += sound[:end - start]
+
+    if kind == "click":
+        t = np.arange(int(0.02 * sr)) / sr
+        for i in range(4):
+            hit(i * beat, (np.sin(2 * np.pi * (1500 if i == 0 else 1000) * t) * np.exp(-t * 200)).astype(np.float32))
+    else:
+        t = np.arange(int(0.25 * sr)) / sr
+        kick = np.sin(2 * np.pi * (50 + 100 * np.exp(-t * 30)) * t) * np.exp(-t * 12)
+        snare = rng.standard_normal(len(t)) * np.exp(-t * 25) * 0.5
+        hat = rng.standard_normal(int(0.03 * sr)) * np.exp(-np.arange(int(0.03 * sr)) / sr * 150) * 0.2
+        for i in range(4):
+            hit(i * beat, (kick if i % 2 == 0 else snare).astype(np.float32))
+        for i in range(8):
+            hit(i * beat / 2, hat.astype(np.float32))
+    bar *= 0.8 / max(np.abs(bar).max(), 1e-9)
+    # Slightly different channels, so the mono mixdown has something to do.
+    return np.stack([bar, bar * 0.9], axis=1)
+
+def synth_file(folder, kind, seconds, sr=44100):
+    """
+    Write a synthetic test file, reusing it if it is already there
+
+    :return: (str) path of the 16 bit stereo wav file
+    """
+    import soundfile as sf
+    tempo = SUITE_TEMPO[kind]
+    path = os.path.join(folder, f"{kind}_{tempo:g}bpm_{seconds:g}s_{sr}hz.wav")
+    if os.path.exists(path):
+        return path
+    bar = synth_bar(kind, tempo, sr)
+    # Written in blocks of whole bars, so hours of audio never sit in memory.
+    block = np.tile(bar, (max(1, int(30 * sr // len(bar))), 1))
+    total = int(seconds * sr)
+    with sf.SoundFile(path + ".part", 'w', sr, 2, 'PCM_16', format='WAV') as f:
+        written = 0
+        while written < total:
+            frames = min(len(block), total - written)
+            f.write(block[:frames])
+            written += frames
+    os.replace(path + ".part", path)
+    return path
+
+def peak_rss():
+    """:return: (int) peak resident set size of this process so far, in bytes"""
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def bench_suite_case(path, kind, seconds, sr, analysis_rate, paint_repeat):
+    """
+    Time every stage of the GUI pipeline on one file. Runs in a fresh worker process.
+
+    :return: (dict) stages with wall seconds and peak RSS after each, plus detected tempo
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    import librosa
+    from PySide6.QtWidgets import QApplication
+    from PySide6.QtGui import QPixmap
+    import automarkerQt
+    app = QApplication.instance() or QApplication([])
+    stages = []
+
+    def stage(name, start):
+        stages.append({"stage": name, "seconds": time.perf_counter() - start, "peak_rss": peak_rss()})
+
+    # Lazy imports and numba compilation, paid once per process. Kept apart so the stages scale with the audio.
+    engine = get_beat_engine()
+    start = time.perf_counter()
+    warm_up, _ = librosa.load(path=path, sr=sr, mono=False, duration=5.0)
+    engine.track(compute_onset_envelope(resample_mono(np.mean(warm_up, axis=0), sr, analysis_rate), analysis_rate), analysis_rate)
+    stage("warm-up", start)
+
+    start = time.perf_counter()
+    data, samplerate = librosa.load(path=path, sr=sr, mono=False)
+    stage("librosa.load", start)
+
+    start = time.perf_counter()
+    mono_data = np.mean(data, axis=0)
+    stage("mono mixdown", start)
+
+    start = time.perf_counter()
+    analysis_data = resample_mono(mono_data, samplerate, analysis_rate)
+    del mono_data
+    onset_envelope = compute_onset_envelope(analysis_data, analysis_rate)
+    del analysis_data
+    stage("onset envelope", start)
+
+    start = time.perf_counter()
+    tempo, beat_times = engine.track(onset_envelope, analysis_rate)
+    stage("beat_track", start)
+
+    layout = automarkerQt.Layout()
+    layout.layout()
+    layout.resize(1200, 400)
+    start = time.perf_counter()
+    layout.add_preview(data, samplerate)
+    stage("Layout.add_preview", start)
+
+    grid = BeatGrid(beat_times, every=1, offset=0)
+    layout.add_beats(grid)
+    display = layout.waveform_display
+    display.resize(1200, 200)
+    pixmap = QPixmap(display.size())
+    for zoom in SUITE_ZOOMS:
+        display._startframe = 0
+        display._endframe = data.shape[-1] if zoom is None else int(zoom * samplerate)
+        display.render(pixmap)  # the first paint fills the caches
+        start = time.perf_counter()
+        for _ in range(paint_repeat):
+            display.render(pixmap)
+        stages.append({"stage": f"paintEvent {'full' if zoom is None else f'{zoom:g} s'}",
+                       "seconds": (time.perf_counter() - start) / paint_repeat, "peak_rss": peak_rss()})
+
+    start = time.perf_counter()
+    grid.set_decimation(4, 0)
+    markers = grid.marker_times().tolist()
+    colors = grid.marker_colors(0, 1)
+    automarkerQt.PR_JSInterface().markersScript(markers, "".join(str(c) for c in colors.tolist()))
+    stage("marker list", start)
+
+    return {"kind": kind, "audio_seconds": seconds, "sample_rate": samplerate, "analysis_rate": analysis_rate,
+            "expected_tempo": SUITE_TEMPO[kind], "tempo": tempo, "beats": len(beat_times),
+            "stages": stages, "total_seconds": sum(s["seconds"] for s in stages if s["stage"] != "warm-up" and not s["stage"].startswith("paintEvent")),
+            "peak_rss": peak_rss()}
+
+def bench_suite(durations, kinds=SUITE_KINDS, sr=44100, analysis_rate=DEFAULT_ANALYSIS_SAMPLE_RATE, audio_dir=None, paint_repeat=10):
+    """
+    Generate the synthetic files and benchmark each one in its own process
+
+    :param durations: (list of float) seconds of audio per file
+    :param audio_dir: (str) where the files are kept between runs, a temporary folder if None
+    :return: (dict) run metadata and one result per file
+    """
+    import librosa
+    folder = audio_dir or tempfile.mkdtemp(prefix="automarker_bench_")
+    os.makedirs(folder, exist_ok=True)
+    results = []
+    for seconds in durations:
+        for kind in kinds:
+            path = synth_file(folder, kind, seconds, sr)
+            print(f"{kind} {seconds:g} s...", file=sys.stderr)
+            # One task per process, so the peak RSS measured is this file's.
+            with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as pool:
+                results.append(pool.submit(bench_suite_case, path, kind, seconds, sr, analysis_rate, paint_repeat).result())
+            if audio_dir is None:
+                os.remove(path)
+    if audio_dir is None:
+        os.rmdir(folder)
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "librosa": librosa.__version__,
+        "results": results,
+    }
+
+def bench_chunked(durations, kinds=SUITE_KINDS, sr=DEFAULT_ANALYSIS_SAMPLE_RATE, workers=None, audio_dir=None,
+                  window_seconds=CHUNK_WINDOW_SECONDS, overlap_seconds=CHUNK_OVERLAP_SECONDS):
+    """
+    Compare the long-file mode with a single beat tracking pass over synthetic tracks
+
+    :return: (list of dict) one row per file: runtimes, tempos, beat counts and how many of the
+             single pass beats the chunked run found within one hop. The first chunked runtime
+             includes starting the worker processes.
+    """
+    if audio_dir is None:
+        audio_dir = tempfile.mkdtemp(prefix="automarker_chunked_")
+    os.makedirs(audio_dir, exist_ok=True)
+    engine = get_beat_engine()
+    rows = []
+    for kind in kinds:
+        for seconds in durations:
+            path = synth_file(audio_dir, kind, seconds, sr)
+            data, samplerate, mono_data = load_audio(path, sr)
+            del data
+            onset_envelope = compute_onset_envelope(mono_data, samplerate)
+            del mono_data
+            engine.track(onset_envelope[:2000], samplerate)  # warm up numba
+            tempo, beat_times = engine.track(onset_envelope, samplerate)
+            single_runtime = engine.last_runtime
+            tracker = ChunkedBeatTracker(engine, window_seconds, overlap_seconds, workers)
+            chunked_tempo, chunked_times = tracker.track(onset_envelope, samplerate)
+            tolerance = ANALYSIS_HOP_LENGTH / samplerate
+            rows.append({
+                "kind": kind,
+                "audio_seconds": seconds,
+                "expected_tempo": SUITE_TEMPO[kind],
+                "windows": tracker.windows,
+                "anchored_seams": tracker.anchored_seams,
+                "single_runtime": single_runtime,
+                "chunked_runtime": tracker.last_runtime,
+                "single_tempo": tempo,
+                "chunked_tempo": chunked_tempo,
+                "single_beats": len(beat_times),
+                "chunked_beats": len(chunked_times),
+                "matched": beat_agreement(chunked_times, beat_times, tolerance),
+                "extra": 1.0 - beat_agreement(beat_times, chunked_times, tolerance),
+                "max_beat_deviation": beat_deviation(chunked_times, beat_times),
+            })
+    return rows
+
+def check_chunked(sr=DEFAULT_ANALYSIS_SAMPLE_RATE, workers=None, seconds=180.0, window_seconds=40.0, overlap_seconds=10.0):
+    """
+    Track a click track in short windows, so it has several seams, and compare with a single pass
+
+    :return: (dict) windows, anchored_seams, beats and max_beat_deviation
+    :raises RuntimeError: unless both runs have as many beats and every beat of each has one within one hop in the other
+    """
+    bar = synth_bar("click", SUITE_TEMPO["click"], sr)
+    mono_data = np.tile(np.mean(bar, axis=1), int(np.ceil(seconds * sr / len(bar))))[:int(seconds * sr)]
+    onset_envelope = compute_onset_envelope(mono_data, sr)
+    engine = get_beat_engine()
+    tempo, beat_times = engine.track(onset_envelope, sr)
+    tracker = ChunkedBeatTracker(engine, window_seconds, overlap_seconds, workers)
+    chunked_tempo, chunked_times = tracker.track(onset_envelope, sr)
+    tolerance = ANALYSIS_HOP_LENGTH / sr
+    matched = beat_agreement(chunked_times, beat_times, tolerance)
+    extra = 1.0 - beat_agreement(beat_times, chunked_times, tolerance)
+    deviation = beat_deviation(chunked_times, beat_times)
+    # Beats doubled at a seam are within tolerance of a single pass beat too, hence the count.
+    if len(chunked_times) != len(beat_times) or matched < 1.0 or extra > 0.0 or not deviation <= tolerance:
+        raise RuntimeError(f"Chunked tracking differs from a single pass over {tracker.windows} windows: {len(chunked_times)}/{len(beat_times)} beats, "
+                           f"{matched:.1%} matched, {extra:.1%} extra, max deviation {deviation:.3f} s")
+    return {"windows": tracker.windows, "anchored_seams": tracker.anchored_seams, "beats": len(chunked_times), "max_beat_deviation": deviation}
+
+def compare_suites(current, previous):
+    """
+    Stage by stage ratio of two suite runs, > 1 is slower now
+
+    :return: (list of dict) kind, audio_seconds, stage, previous, current and ratio
+    """
+    before = {(r["kind"], r["audio_seconds"], s["stage"]): s["seconds"] for r in previous["results"] for s in r["stages"]}
+    rows = []
+    for result in current["results"]:
+        for s in result["stages"]:
+            key = (result["kind"], result["audio_seconds"], s["stage"])
+            if key in before:
+                rows.append({"kind": key[0], "audio_seconds": key[1], "stage": key[2], "previous": before[key],
+                             "current": s["seconds"], "ratio": s["seconds"] / before[key] if before[key] > 0 else float("nan")})
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AutoMarker performance benchmarks.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rates_parser = commands.add_parser("rates", help="compare end to end analysis time at several analysis sample rates")
+    rates_parser.add_argument("path", help="audio file to analyze")
+    rates_parser.add_argument("--rates", default="48000,44100,22050,11025", help="comma separated analysis rates, the first is the reference")
+    rates_parser.add_argument("--playback-rate", type=int, default=48000, help="decode rate, as the output device would use")
+    rates_parser.add_argument("--repeat", type=int, default=1)
+    rates_parser.add_argument("--json", action="store_true", help="print machine readable results")
+    engines_parser = commands.add_parser("engines", help="compare the runtime of the beat detection engines")
+    engines_parser.add_argument("path", help="audio file to analyze")
+    engines_parser.add_argument("--sr", type=int, default=22050, help="analysis sample rate")
+    engines_parser.add_argument("--json", action="store_true", help="print machine readable results")
+    premiere_parser = commands.add_parser("premiere", help="time sending markers to a local stand-in for the Premiere panel server")
+    premiere_parser.add_argument("--markers", default="100,1000,10000", help="comma separated marker counts")
+    premiere_parser.add_argument("--port", type=int, default=3000)
+    premiere_parser.add_argument("--json", action="store_true", help="print machine readable results")
+    resolve_parser = commands.add_parser("resolve", help="count the round trips of adding markers to a mock Resolve")
+    resolve_parser.add_argument("--markers", default="100,1000,10000", help="comma separated beat counts")
+    resolve_parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated time per round trip")
+    resolve_parser.add_argument("--json", action="store_true", help="print machine readable results")
+    ae_parser = commands.add_parser("ae", help="time reading results back from a stand-in for After Effects")
+    ae_parser.add_argument("--runs", type=int, default=20, help="commands to run")
+    ae_parser.add_argument("--delay-ms", type=float, default=50.0, help="time the stand-in takes to answer")
+    ae_parser.add_argument("--operations", type=int, default=100, help="operations to queue, batched and one by one")
+    ae_parser.add_argument("--json", action="store_true", help="print machine readable results")
+    ae_host_parser = commands.add_parser("ae-host", help="After Effects stand-in process, started by the ae benchmark")
+    ae_host_parser.add_argument("return_file", help="return file to write the results to")
+    suite_parser = commands.add_parser("suite", help="time every stage of the pipeline on synthetic click tracks and drum loops")
+    suite_parser.add_argument("--durations", default="30,120,600", help="comma separated seconds of audio, up to 7200")
+    suite_parser.add_argument("--kinds", default=",".join(SUITE_KINDS), help="comma separated: click, drums")
+    suite_parser.add_argument("--sr", type=int, default=44100, help="decode rate, as the output device would use")
+    suite_parser.add_argument("--analysis-rate", type=int, default=DEFAULT_ANALYSIS_SAMPLE_RATE)
+    suite_parser.add_argument("--audio-dir", default=None, help="keep the generated files here and reuse them")
+    suite_parser.add_argument("--out", default=None, help="write the results to this JSON file")
+    suite_parser.add_argument("--compare", default=None, help="JSON file of a previous run to compare with")
+    chunked_parser = commands.add_parser("chunked", help="compare long-file mode beat tracking with a single pass on synthetic tracks")
+    chunked_parser.add_argument("--durations", default="1800,3600", help="comma separated seconds of audio")
+    chunked_parser.add_argument("--kinds", default=",".join(SUITE_KINDS), help="comma separated: click, drums")
+    chunked_parser.add_argument("--sr", type=int, default=DEFAULT_ANALYSIS_SAMPLE_RATE, help="analysis sample rate")
+    chunked_parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    chunked_parser.add_argument("--window", type=float, default=CHUNK_WINDOW_SECONDS, help="window length in seconds")
+    chunked_parser.add_argument("--overlap", type=float, default=CHUNK_OVERLAP_SECONDS, help="overlap between windows in seconds")
+    chunked_parser.add_argument("--audio-dir", default=None, help="keep the generated files here and reuse them")
+    chunked_parser.add_argument("--json", action="store_true", help="print machine readable results")
+    decode_parser = commands.add_parser("decode", help="compare decode throughput of the decode paths and resampler presets")
+    decode_parser.add_argument("path", help="audio file to decode")
+    decode_parser.add_argument("--sr", type=int, default=48000, help="decode rate, as the output device would use")
+    decode_parser.add_argument("--repeat", type=int, default=3)
+    decode_parser.add_argument("--json", action="store_true", help="print machine readable results")
+    args = parser.parse_args(argv)
+
+    if args.command == "rates":
+        rows = bench_analysis_rates(args.path, [int(r) for r in args.rates.split(",")], args.playback_rate, args.repeat)
+        if args.json:
+            print(json.dumps(rows, indent=1))
+        else:
+            print(f"{'rate':>8} {'total s':>8} {'decode':>8} {'resample':>9} {'onsets':>8} {'beats':>8} {'bpm':>7} {'max dev s':>10}")
+            for row in rows:
+                t = row["timings"]
+                print(f"{row['analysis_rate']:>8} {t['total']:>8.2f} {t['decode']:>8.2f} {t['resample']:>9.2f} {t['onset envelope']:>8.2f} "
+                      f"{t['beat tracking']:>8.2f} {row['tempo']:>7.1f} {row['max_beat_deviation']:>10.3f}")
+    elif args.command == "engines":
+        rows = bench_engines(args.path, args.sr)
+        if args.json:
+            print(json.dumps(rows, indent=1))
+        else:
+            print(f"{'engine':>12} {'runtime s':>10} {'bpm':>7} {'beats':>6} {'max dev s':>10}")
+            for row in rows:
+                print(f"{row['engine']:>12} {row['runtime']:>10.4f} {row['tempo']:>7.1f} {row['beats']:>6} {row['max_beat_deviation']:>10.3f}")
+    elif args.command == "premiere":
+        rows = bench_premiere([int(c) for c in args.markers.split(",")], args.port)
+        if args.json:
+            print(json.dumps(rows, indent=1))
+        else:
+            print(f"{'markers':>8} {'requests':>9} {'seconds':>8} {'markers/s':>10} {'kB sent':>8}")
+            for row in rows:
+                print(f"{row['markers']:>8} {row['requests']:>9} {row['seconds']:>8.3f} {row['markers_per_second']:>10.0f} {row['payload_bytes'] / 1e3:>8.1f}")
+    elif args.command == "resolve":
+        rows = bench_resolve([int(c) for c in args.markers.split(",")], args.latency_ms / 1000)
+        if args.json:
+            print(json.dumps(rows, indent=1))
+        else:
+            print(f"{'beats':>7} {'markers':>8} {'calls':>7} {'calls/marker':>13} {'2nd pass':>9} {'seconds':>8}")
+            for row in rows:
+                print(f"{row['beats']:>7} {row['markers']:>8} {row['round_trips']:>7} {row['round_trips_per_marker']:>13.2f} "
+                      f"{row['second_pass_round_trips']:>9} {row['seconds']:>8.3f}")
+    elif args.command == "ae-host":
+        ae_host(args.return_file)
+    elif args.command == "ae":
+        return_rows = bench_ae_return(args.runs, args.delay_ms / 1000)
+        queue_rows = bench_ae_queue(args.operations, args.delay_ms / 1000)
+        if args.json:
+            print(json.dumps({"return": return_rows, "queue": queue_rows}, indent=1))
+        else:
+            print(f"{'run':>8} {'latency ms':>11} {'overhead ms':>12}")
+            for row in return_rows:
+                print(f"{row['run']:>8} {row['latency'] * 1000:>11.1f} {row['overhead'] * 1000:>12.1f}")
+            print(f"\n{'mode':>10} {'operations':>11} {'launches':>9} {'last batch':>11} {'seconds':>8}")
+            for row in queue_rows:
+                print(f"{row['mode']:>10} {row['operations']:>11} {row['launches']:>9} {row['last_batch']:>11} {row['seconds']:>8.3f}")
+    elif args.command == "suite":
+        kinds = args.kinds.split(",")
+        for kind in kinds:
+            if kind not in SUITE_KINDS:
+                parser.error(f"unknown kind '{kind}'")
+        suite = bench_suite([float(d) for d in args.durations.split(",")], kinds, args.sr, args.analysis_rate, args.audio_dir)
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump(suite, f, indent=1)
+        print(f"{'file':>14} {'stage':>20} {'seconds':>9} {'peak RSS MB':>12}")
+        for result in suite["results"]:
+            name = f"{result['kind']} {result['audio_seconds']:g}s"
+            for s in result["stages"]:
+                print(f"{name:>14} {s['stage']:>20} {s['seconds']:>9.4f} {s['peak_rss'] / 1e6:>12.0f}")
+            print(f"{name:>14} {'tempo':>20} {result['tempo']:>9.1f} (expected {result['expected_tempo']:g})")
+        if args.compare:
+            with open(args.compare) as f:
+                previous = json.load(f)
+            print(f"\n{'file':>14} {'stage':>20} {'before':>9} {'now':>9} {'ratio':>6}")
+            for row in compare_suites(suite, previous):
+                name = f"{row['kind']} {row['audio_seconds']:g}s"
+                print(f"{name:>14} {row['stage']:>20} {row['previous']:>9.4f} {row['current']:>9.4f} {row['ratio']:>6.2f}")
+    elif args.command == "decode":
+        rows = bench_decode(args.path, args.sr, args.repeat)
+        if args.json:
+            print(json.dumps(rows, indent=1))
+        else:
+            print(f"{'mode':>7} {'resampler':>10} {'seconds':>8} {'audio s/s':>10}")
+            for row in rows:
+                print(f"{row['mode']:>7} {row['resampler']:>10} {row['seconds']:>8.3f} {row['throughput']:>10.0f}")
+    elif args.command == "chunked":
+        kinds = args.kinds.split(",")
+        for kind in kinds:
+            if kind not in SUITE_KINDS:
+                parser.error(f"unknown kind '{kind}'")
+        if args.overlap >= args.window:
+            parser.error("--overlap must be shorter than --window")
+        # Fails before the long runs if a seam drops, adds or moves a beat.
+        check = check_chunked(args.sr, args.workers)
+        rows = bench_chunked([float(d) for d in args.durations.split(",")], kinds, args.sr, args.workers, args.audio_dir, args.window, args.overlap)
+        if args.json:
+            print(json.dumps({"check": check, "results": rows}, indent=1))
+        else:
+            print(f"Seam check: {check['beats']} beats over {check['windows']} windows ({check['anchored_seams']} seams anchored), "
+                  f"max deviation {check['max_beat_deviation']:.3f} s")
+            print(f"{'file':>14} {'windows':>8} {'seams ok':>9} {'single s':>9} {'chunked s':>10} {'bpm':>13} {'beats':>13} {'matched':>8} {'extra':>6} {'max dev s':>10}")
+            for row in rows:
+                name = f"{row['kind']} {row['audio_seconds']:g}s"
+                print(f"{name:>14} {row['windows']:>8} {row['anchored_seams']:>9} {row['single_runtime']:>9.2f} {row['chunked_runtime']:>10.2f} "
+                      f"{row['single_tempo']:>6.1f}/{row['chunked_tempo']:<6.1f} {row['single_beats']:>6}/{row['chunked_beats']:<6} "
+                      f"{row['matched']:>8.1%} {row['extra']:>6.1%} {row['max_beat_deviation']:>10.3f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1326 @@
+# AutoMarker by acrilique.
+# Qt-free analysis helpers shared by the GUI (automarkerQt.py) and any headless tooling.
+# librosa is imported inside the functions that use it, it's slow to import and the GUI
+# shouldn't pay for it before the first file is opened.
+import numpy as np
+import os
+import atexit
+import bisect
+import json
+import time
+import hashlib
+import tempfile
+import threading
+
+###############################
+###############################
+###############################
+# CONSTANTS
+###############################
+# librosa's native analysis rate. Beat times are in seconds, so they don't depend on the playback rate.
+DEFAULT_ANALYSIS_SAMPLE_RATE = 22050
+ANALYSIS_HOP_LENGTH = 512
+ANALYSIS_N_FFT = 2048
+STREAM_BLOCK_SECONDS = 1.0
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".flac", ".ogg", ".aiff", ".aif")
+CACHE_FORMAT_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), "AutoMarker", "cache")
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_PEAKS_DIR = os.path.join(os.path.expanduser("~"), "AutoMarker", "peaks")
+DEFAULT_PEAKS_MAX_BYTES = 512 * 1024 * 1024
+PEAK_FILE_MAGIC = b"AMPK"
+PEAK_FILE_VERSION = 1
+# soxr quality of each resampler preset. "final" is librosa.load's default and is used unless the user
+# picks "preview", which gives up some stop band rejection for a faster decode.
+RESAMPLER_PRESETS = {"preview": "LQ", "final": "HQ"}
+DEFAULT_RESAMPLER = "final"
+# Formats decoded in a separate process when they can't be streamed, the decoders' buffers stay there.
+COMPRESSED_EXTENSIONS = (".mp3", ".ogg", ".flac", ".m4a", ".aac", ".opus", ".wma")
+# Tracks longer than this are beat tracked in overlapping windows on a process pool, see ChunkedBeatTracker.
+LONG_FILE_SECONDS = 20 * 60
+CHUNK_WINDOW_SECONDS = 240.0
+CHUNK_OVERLAP_SECONDS = 30.0
+# Tempo map: onset frames per tempogram window (librosa's default, ~9 s at 22050 Hz), seconds between
+# windows, relative tempo difference that starts a new segment and shortest segment that counts as steady.
+TEMPO_MAP_WINDOW = 384
+TEMPO_MAP_STEP_SECONDS = 1.0
+TEMPO_CHANGE_TOLERANCE = 0.04
+TEMPO_MIN_SEGMENT_SECONDS = 8.0
+
+###############################
+###############################
+###############################
+# ANALYSIS PIPELINE
+###############################
+_process_pools = {}
+_process_pools_lock = threading.Lock()
+
+def _get_process_pool(name, workers):
+    """
+    Named process pool, kept between runs: starting workers and importing librosa in them costs
+    seconds. Spawned rather than forked, the GUI calls this from worker threads.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    with _process_pools_lock:
+        pool, pool_workers = _process_pools.get(name, (None, None))
+        if pool is None or pool_workers != workers:
+            if pool is not None:
+                pool.shutdown(wait=False)
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _process_pools[name] = (pool, workers)
+            atexit.register(pool.shutdown, wait=False, cancel_futures=True)
+        return pool
+
+def resampler_quality(resampler):
+    """
+    :param resampler: (str) one of RESAMPLER_PRESETS
+    :return: (str) soxr quality of the preset
+    """
+    try:
+        return RESAMPLER_PRESETS[resampler]
+    except KeyError:
+        raise ValueError(f"Unknown resampler preset '{resampler}', available: {', '.join(RESAMPLER_PRESETS)}")
+
+def load_audio(path, sr, resampler=DEFAULT_RESAMPLER):
+    """
+    Decode an audio file and mix it down to mono
+
+    :param path: (str) path to the audio file
+    :param sr: (int) target sample rate
+    :param resampler: (str) preset of RESAMPLER_PRESETS, unused when the file is already at sr
+    :return: (np.ndarray) data with shape (channels, samples), (int) sample rate, (np.ndarray) mono mix
+    """
+    import librosa
+    # Decoded at the file's own rate, then resampled only if that isn't sr.
+    data, native_sr = librosa.load(path=path, sr=None, mono=False)
+    # Mono files come back one dimensional.
+    data = np.atleast_2d(data)
+    if native_sr != sr:
+        data = librosa.resample(data, orig_sr=native_sr, target_sr=sr, res_type="soxr_" + resampler_quality(resampler).lower())
+    mono_data = data[0] if data.shape[0] == 1 else np.mean(data, axis=0)
+    return data, sr, mono_data
+
+def _decode_worker(path, sr, resampler):
+    # Runs in the decode process. Only the samples come back, interleaved the way the playback wants them.
+    data, samplerate, _ = load_audio(path, sr, resampler)
+    return np.ascontiguousarray(data.T), samplerate
+
+def decode_in_worker(path, sr, resampler=DEFAULT_RESAMPLER):
+    """
+    load_audio in a separate process, for compressed files: the decoder and resampler buffers are
+    allocated and freed there, only the decoded samples are copied back
+
+    :return: (np.ndarray) interleaved data with shape (samples, channels), (int) sample rate
+    """
+    return _get_process_pool("decode", 1).submit(_decode_worker, path, sr, resampler).result()
+
+def is_compressed(path):
+    return path.lower().endswith(COMPRESSED_EXTENSIONS)
+
+def resample_mono(mono_data, sr, target_sr, resampler=DEFAULT_RESAMPLER):
+    """Resample a mono signal for analysis, "final" is the soxr_hq quality librosa.load uses."""
+    if sr == target_sr:
+        return mono_data
+    import librosa
+    return librosa.resample(mono_data, orig_sr=sr, target_sr=target_sr, res_type="soxr_" + resampler_quality(resampler).lower())
+
+def compute_onset_envelope(mono_data, sr, hop_length=ANALYSIS_HOP_LENGTH):
+    """
+    Onset strength envelope, computed exactly like librosa.beat.beat_track does internally
+
+    :param mono_data: (np.ndarray) mono signal
+    :param sr: (int) sample rate of mono_data
+    :return: (np.ndarray) onset envelope, one value per hop
+    """
+    import librosa
+    return librosa.onset.onset_strength(y=mono_data, sr=sr, hop_length=hop_length, aggregate=np.median)
+
+def track_beats(onset_envelope, sr, hop_length=ANALYSIS_HOP_LENGTH, start_bpm=120.0, tightness=100):
+    """
+    Run the dynamic programming beat tracker over a precomputed onset envelope
+
+    :return: (float) tempo in bpm, (np.ndarray) beat times in seconds
+    """
+    import librosa
+    tempo, beat_times = librosa.beat.beat_track(onset_envelope=onset_envelope, sr=sr, hop_length=hop_length,
+                                                start_bpm=start_bpm, tightness=tightness, units="time")
+    return float(np.atleast_1d(tempo)[0]), beat_times
+
+###############################
+###############################
+###############################
+# STREAMING DECODE
+#  - Decodes in blocks with soundfile and resamples them with a streaming soxr resampler, so the
+#    first seconds of a long file are available long before the end is decoded.
+#  - OnsetAccumulator computes the same onset envelope as compute_onset_envelope, block by block.
+###############################
+def stream_info(path, sr):
+    """
+    Channel count and length after resampling of a file that can be streamed
+
+    :return: (int) channels, (int) number of samples at sr, (int) the file's own sample rate
+    :raise: (RuntimeError) if soundfile can't read the file, stream_audio_blocks won't work either
+    """
+    import soundfile as sf
+    info = sf.info(path)
+    return info.channels, int(round(info.frames * sr / info.samplerate)), info.samplerate
+
+def stream_audio_blocks(path, sr, block_seconds=STREAM_BLOCK_SECONDS, resampler=DEFAULT_RESAMPLER, native=False):
+    """
+    Decode an audio file block by block
+
+    :param path: (str) path to the audio file
+    :param sr: (int) target sample rate, nothing is resampled when the file is already at it
+    :param resampler: (str) preset of RESAMPLER_PRESETS
+    :param native: (bool) also yield every block as decoded, before resampling
+    :return: (generator of np.ndarray) float32 blocks with shape (channels, samples) at sr, or
+             (block, native block) pairs with native
+    """
+    import soundfile as sf
+    with sf.SoundFile(path) as f:
+        native_sr = f.samplerate
+        stream = None
+        if native_sr != sr:
+            import soxr
+            stream = soxr.ResampleStream(native_sr, sr, f.channels, dtype='float32', quality=resampler_quality(resampler))
+        blocksize = max(1, int(native_sr * block_seconds))
+        while True:
+            native_block = f.read(blocksize, dtype='float32', always_2d=True)
+            last = len(native_block) < blocksize
+            block = stream.resample_chunk(native_block, last=last) if stream is not None else native_block
+            if len(block) or (native and len(native_block)):
+                block = np.ascontiguousarray(block.T)
+                yield (block, native_block.T) if native else block
+            if last:
+                break
+
+class OnsetAccumulator(object):
+    """
+    Incremental version of librosa.onset.onset_strength(y, sr, hop_length, aggregate=np.median).
+    Feed it consecutive mono blocks, then call finish() to get the envelope of the whole signal.
+    If input_sr is given, blocks are at that rate and get resampled to sr on the way in.
+    The only difference with the one shot computation is the 80 dB floor of power_to_db, which
+    follows the loudest frame seen so far instead of the loudest frame of the whole file.
+    """
+
+    def __init__(self, sr, hop_length=ANALYSIS_HOP_LENGTH, n_fft=ANALYSIS_N_FFT, top_db=80.0, input_sr=None, resampler=DEFAULT_RESAMPLER):
+        self.sr = sr
+        self._resampler = None
+        if input_sr is not None and input_sr != sr:
+            import soxr
+            self._resampler = soxr.ResampleStream(input_sr, sr, 1, dtype='float32', quality=resampler_quality(resampler))
+        self.hop_length = hop_length
+        self.n_fft = n_fft
+        self.top_db = top_db
+        self.num_samples = 0
+        # Centered frames, like librosa's default center=True with zero padding.
+        self._buffer = np.zeros(n_fft // 2, dtype=np.float32)
+        self._previous = None
+        self._db_max = -np.inf
+        self._flux = []
+
+    def feed(self, mono_block, last=False):
+        mono_block = np.asarray(mono_block, dtype=np.float32)
+        if self._resampler is not None:
+            mono_block = self._resampler.resample_chunk(mono_block, last=last)
+        self.num_samples += len(mono_block)
+        self._buffer = np.concatenate([self._buffer, mono_block])
+        self._process()
+
+    def _process(self):
+        import librosa
+        if len(self._buffer) < self.n_fft:
+            return
+        frames = 1 + (len(self._buffer) - self.n_fft) // self.hop_length
+        chunk = self._buffer[:(frames - 1) * self.hop_length + self.n_fft]
+        mel = librosa.feature.melspectrogram(y=chunk, sr=self.sr, n_fft=self.n_fft, hop_length=self.hop_length, center=False)
+        db = librosa.power_to_db(mel, top_db=None)
+        self._db_max = max(self._db_max, float(db.max()))
+        db = np.maximum(db, self._db_max - self.top_db)
+        if self._previous is not None:
+            db_with_previous = np.concatenate([self._previous, db], axis=1)
+        else:
+            db_with_previous = db
+        flux = np.maximum(0.0, db_with_previous[:, 1:] - db_with_previous[:, :-1])
+        self._flux.append(np.median(flux, axis=0).astype(np.float32))
+        self._previous = db[:, -1:]
+        self._buffer = self._buffer[frames * self.hop_length:]
+
+    def envelope(self):
+        """Envelope of everything fed so far (without the frames that need samples not seen yet)."""
+        pad_width = 1 + self.n_fft // (2 * self.hop_length)
+        return np.concatenate([np.zeros(pad_width, dtype=np.float32)] + self._flux)
+
+    def finish(self):
+        """Flush the end of the signal and return the onset envelope of everything fed."""
+        if self._resampler is not None:
+            self.feed(np.zeros(0, dtype=np.float32), last=True)
+        self._buffer = np.concatenate([self._buffer, np.zeros(self.n_fft // 2, dtype=np.float32)])
+        self._process()
+        return self.envelope()[:1 + self.num_samples // self.hop_length]
+
+###############################
+###############################
+###############################
+# BEAT ENGINES
+#  - Every engine turns an onset envelope into (tempo, beat times in seconds).
+#  - Engines take their own parameters as keyword arguments and time each run (last_runtime).
+#  - "beat_track" is the original dynamic programming tracker, "onset_peaks" is a fast peak picker
+#    for percussive material and "plp" follows tempo changes using predominant local pulse.
+#  - All of them estimate the tempo with the same prior around start_bpm, the peak based engines then
+#    drop the weaker of two peaks closer than BEAT_MIN_SPACING beats, so subdivisions aren't beats.
+###############################
+BEAT_MIN_SPACING = 0.75
+
+class BeatEngine(object):
+    name = ""
+    label = ""
+    default_params = {}
+
+    def __init__(self, **params):
+        unknown = set(params) - set(self.default_params)
+        if unknown:
+            raise ValueError(f"Unknown parameters for the {self.name} engine: {', '.join(sorted(unknown))}")
+        self.params = dict(self.default_params, **params)
+        self.last_runtime = None
+
+    def track(self, onset_envelope, sr, hop_length=ANALYSIS_HOP_LENGTH):
+        """
+        Detect beats
+
+        :param onset_envelope: (np.ndarray) onset strength, one value per hop
+        :param sr: (int) sample rate the envelope was computed at
+        :return: (float) tempo in bpm, (np.ndarray) beat times in seconds
+        """
+        start = time.perf_counter()
+        tempo, beat_times = self._track(np.asarray(onset_envelope), sr, hop_length)
+        self.last_runtime = time.perf_counter() - start
+        return tempo, beat_times
+
+    def _track(self, onset_envelope, sr, hop_length):
+        raise NotImplementedError
+
+    def cache_params(self):
+        """What identifies this engine's results in the analysis cache."""
+        return {"engine": self.name, "engine_params": self.params}
+
+class DynamicProgrammingEngine(BeatEngine):
+    name = "beat_track"
+    label = "Dynamic programming (accurate)"
+    default_params = {"start_bpm": 120.0, "tightness": 100}
+
+    def _track(self, onset_envelope, sr, hop_length):
+        return track_beats(onset_envelope, sr, hop_length, **self.params)
+
+class OnsetPeakEngine(BeatEngine):
+    name = "onset_peaks"
+    label = "Onset peaks (fast, percussive)"
+    # Peak picking windows are in seconds, delta is relative to the envelope's maximum.
+    default_params = {"pre_max": 0.03, "post_max": 0.0, "pre_avg": 0.1, "post_avg": 0.1, "delta": 0.07, "wait": 0.1,
+                      "start_bpm": 120.0}
+
+    def _track(self, onset_envelope, sr, hop_length):
+        if not onset_envelope.any():
+            return 0.0, np.zeros(0)
+        import librosa
+        frames_per_second = sr / float(hop_length)
+        p = self.params
+        envelope = onset_envelope / onset_envelope.max()
+        peaks = librosa.util.peak_pick(envelope,
+                                       pre_max=max(1, int(round(p["pre_max"] * frames_per_second))),
+                                       post_max=max(1, int(round(p["post_max"] * frames_per_second)) + 1),
+                                       pre_avg=max(1, int(round(p["pre_avg"] * frames_per_second))),
+                                       post_avg=max(1, int(round(p["post_avg"] * frames_per_second)) + 1),
+                                       delta=p["delta"],
+                                       wait=max(0, int(round(p["wait"] * frames_per_second))))
+        tempo = _prior_tempo(onset_envelope, sr, hop_length, p["start_bpm"])
+        peaks = _thin_beats(peaks, envelope, BEAT_MIN_SPACING * 60.0 / tempo * frames_per_second)
+        beat_times = librosa.frames_to_time(peaks, sr=sr, hop_length=hop_length)
+        return _tempo_from_beats(beat_times), beat_times
+
+class PLPEngine(BeatEngine):
+    name = "plp"
+    label = "Predominant local pulse (tempo changes)"
+    default_params = {"tempo_min": 30.0, "tempo_max": 300.0, "win_length": 384, "start_bpm": 120.0}
+
+    def _track(self, onset_envelope, sr, hop_length):
+        if not onset_envelope.any():
+            return 0.0, np.zeros(0)
+        import librosa
+        p = self.params
+        tempo = _prior_tempo(onset_envelope, sr, hop_length, p["start_bpm"])
+        # The pulse is looked for within half an octave of the prior tempo, and of the user's range.
+        tempo_min = max(p["tempo_min"], tempo / np.sqrt(2))
+        tempo_max = min(p["tempo_max"], tempo * np.sqrt(2))
+        if tempo_min >= tempo_max:
+            tempo_min, tempo_max = p["tempo_min"], p["tempo_max"]
+        pulse = librosa.beat.plp(onset_envelope=onset_envelope, sr=sr, hop_length=hop_length,
+                                 tempo_min=tempo_min, tempo_max=tempo_max, win_length=p["win_length"])
+        beats = np.flatnonzero(librosa.util.localmax(pulse))
+        beats = _thin_beats(beats, pulse, BEAT_MIN_SPACING * 60.0 / tempo_max * sr / hop_length)
+        beat_times = librosa.frames_to_time(beats, sr=sr, hop_length=hop_length)
+        return _tempo_from_beats(beat_times), beat_times
+
+def _prior_tempo(onset_envelope, sr, hop_length, start_bpm):
+    """Global tempo estimate, with the same prior around start_bpm the dynamic programming tracker uses."""
+    import librosa
+    tempo = float(librosa.feature.tempo(onset_envelope=onset_envelope, sr=sr, hop_length=hop_length, start_bpm=start_bpm)[0])
+    return tempo if tempo > 0 else start_bpm
+
+def _thin_beats(frames, strength, min_frames):
+    """
+    Keep the strongest of the peaks closer than min_frames to each other
+
+    :param frames: (np.ndarray of int) sorted peak frames
+    :param strength: (np.ndarray) value compared at each frame
+    :return: (np.ndarray of int) sorted frames kept
+    """
+    kept = []
+    for frame in frames[np.argsort(-strength[frames], kind="stable")]:
+        i = bisect.bisect_left(kept, frame)
+        if (i == 0 or frame - kept[i - 1] >= min_frames) and (i == len(kept) or kept[i] - frame >= min_frames):
+            kept.insert(i, frame)
+    return np.asarray(kept, dtype=frames.dtype)
+
+def _tempo_from_beats(beat_times):
+    """Global tempo in bpm from the median beat period."""
+    if len(beat_times) < 2:
+        return 0.0
+    return float(60.0 / np.median(np.diff(beat_times)))
+
+BEAT_ENGINES = {engine.name: engine for engine in (DynamicProgrammingEngine, OnsetPeakEngine, PLPEngine)}
+DEFAULT_BEAT_ENGINE = DynamicProgrammingEngine.name
+
+def get_beat_engine(name=DEFAULT_BEAT_ENGINE, **params):
+    """
+    Create a beat engine by name
+
+    :param name: (str) one of BEAT_ENGINES
+    :return: (BeatEngine) a new engine instance
+    """
+    try:
+        return BEAT_ENGINES[name](**params)
+    except KeyError:
+        raise ValueError(f"Unknown beat engine '{name}', available: {', '.join(BEAT_ENGINES)}")
+
+def analyze_file(path, sr, cache=None, engine=None):
+    """
+    Full headless pipeline: decode, mono mix and beat tracking, going through the cache if given
+
+    :param path: (str) path to the audio file
+    :param sr: (int) sample rate used for decoding and analysis
+    :param cache: (AnalysisCache) optional persistent cache
+    :param engine: (BeatEngine) beat detection engine, the dynamic programming tracker by default
+    :return: (dict) tempo, beat_times, duration (seconds of audio, None on a cache hit), cached and
+             runtime (seconds spent in the engine, None on a cache hit)
+    """
+    if engine is None:
+        engine = get_beat_engine()
+    key = None
+    if cache is not None:
+        key = cache.make_key(path, analysis_params(sr, engine))
+        cached = cache.get(key)
+        if cached is not None:
+            return {"tempo": cached["tempo"], "beat_times": cached["beat_times"], "duration": None, "cached": True, "runtime": None}
+    data, samplerate, mono_data = load_audio(path, sr)
+    onset_envelope = compute_onset_envelope(mono_data, samplerate)
+    tempo, beat_times = engine.track(onset_envelope, samplerate)
+    if key is not None:
+        cache.put(key, tempo, beat_times, onset_envelope, source=path)
+    return {"tempo": tempo, "beat_times": beat_times, "duration": data.shape[1] / samplerate, "cached": False, "runtime": engine.last_runtime}
+
+def analysis_params(sr, engine=None, resampler=DEFAULT_RESAMPLER):
+    """Parameters that identify an analysis result in the cache."""
+    if engine is None:
+        engine = get_beat_engine()
+    params = dict({"sr": sr, "hop_length": ANALYSIS_HOP_LENGTH}, **engine.cache_params())
+    # Only set for the other presets, so results cached before the presets existed stay valid.
+    if resampler != DEFAULT_RESAMPLER:
+        params["resampler"] = resampler
+    return params
+
+def times_to_frames(times, framerate, num_frames):
+    """
+    Timeline frames of marker times, the way hosts that place markers by frame need them
+
+    :param times: (array-like of float) seconds from the start of the timeline
+    :param framerate: (float) timeline frames per second
+    :param num_frames: (int) timeline length, frames past the end are dropped
+    :return: (np.ndarray of int64) sorted, unique frames in [0, num_frames)
+    """
+    frames = np.floor(np.asarray(times, dtype=np.float64) * framerate).astype(np.int64)
+    frames = frames[(frames >= 0) & (frames < num_frames)]
+    return np.unique(frames)
+
+class BeatGrid(object):
+    """
+    The beats of a file and the way the user turns them into markers.
+    The times are stored once and never rewritten: the global offset is added when markers are read,
+    and the every / offset decimation is a strided view, so changing either costs nothing until something is drawn.
+    """
+
+    def __init__(self, times=None, every=1, offset=0, global_offset=0.0, beats_per_bar=4):
+        self.set_times(times)
+        self.every = every
+        self.offset = offset
+        self.global_offset = global_offset
+        self.beats_per_bar = beats_per_bar
+
+    def set_times(self, times):
+        """Replace the beat times, in seconds. The decimation and the global offset are kept."""
+        times = np.zeros(0) if times is None else np.asarray(times, dtype=np.float64)
+        self.times = read_only_view(times)
+        self.version = getattr(self, "version", 0) + 1
+
+    def copy(self):
+        """Grid with the same settings, sharing the times array. For handing the grid to another thread."""
+        return BeatGrid(self.times, self.every, self.offset, self.global_offset, self.beats_per_bar)
+
+    def nudge(self, seconds):
+        self.global_offset += seconds
+        self.version += 1
+
+    def set_decimation(self, every, offset):
+        """Keep one beat every 'every' beats, starting at beat 'offset'."""
+        self.every = max(1, int(every))
+        self.offset = max(0, int(offset))
+        self.version += 1
+
+    def selected(self):
+        """:return: (np.ndarray) view of the kept beat times, without the global offset"""
+        return self.times[self.offset::self.every]
+
+    def __len__(self):
+        return len(self.selected())
+
+    def marker_times(self):
+        """:return: (np.ndarray) new array of marker times in seconds, global offset applied"""
+        return self.selected() + self.global_offset
+
+    def marker_samples(self, sr):
+        """:return: (np.ndarray of int64) marker positions in samples at sr"""
+        return (self.marker_times() * sr).astype(np.int64)
+
+    def bar_phase(self):
+        """:return: (np.ndarray of int) position of each marker in its bar, 0 for the first beat"""
+        return np.arange(len(self)) % self.beats_per_bar
+
+    def marker_colors(self, first_beat_color, other_beat_color):
+        return np.where(self.bar_phase() == 0, first_beat_color, other_beat_color)
+
+class MarkerTracker(object):
+    """
+    Markers AutoMarker placed on each host timeline, so placing them again only sends what changed.
+    A marker is its time, to the microsecond, and its color index, packed in one int64 key.
+    """
+
+    COLOR_BITS = 4
+
+    def __init__(self):
+        self.placed = {}
+
+    def keys(self, times, colors=None):
+        micros = np.round(np.asarray(times, dtype=np.float64) * 1e6).astype(np.int64)
+        if colors is None:
+            colors = 0
+        return np.unique((micros << self.COLOR_BITS) | np.asarray(colors, dtype=np.int64))
+
+    def decode(self, keys):
+        """:return: (np.ndarray, np.ndarray) times in seconds and color indices"""
+        return (keys >> self.COLOR_BITS) / 1e6, keys & ((1 << self.COLOR_BITS) - 1)
+
+    def diff(self, timeline, times, colors=None):
+        """
+        Compare the wanted markers of a timeline with the ones placed there
+
+        :param timeline: (hashable) host and timeline identity
+        :return: (np.ndarray, np.ndarray) keys to remove, keys to add
+        """
+        wanted = self.keys(times, colors)
+        placed = self.placed.get(timeline)
+        if placed is None:
+            return np.empty(0, dtype=np.int64), wanted
+        return np.setdiff1d(placed, wanted, assume_unique=True), np.setdiff1d(wanted, placed, assume_unique=True)
+
+    def commit(self, timeline, times, colors=None):
+        """Record the markers now on a timeline."""
+        self.placed[timeline] = self.keys(times, colors)
+
+    def forget(self, timeline):
+        """The timeline was cleared or can't be trusted anymore, next time everything is sent."""
+        self.placed.pop(timeline, None)
+
+###############################
+###############################
+###############################
+# LONG FILES
+#  - The onset envelope is split into overlapping windows that a pool of processes tracks in parallel.
+#  - Where two windows overlap, the sequence switches from one to the other on a beat both agree on,
+#    so the stitched beats keep one phase across the seam.
+###############################
+def chunk_windows(num_frames, window_frames, overlap_frames):
+    """
+    Overlapping windows covering an onset envelope. A short leftover at the end joins the last window.
+
+    :return: (list of (int, int)) start and end frame of every window
+    """
+    step = max(1, window_frames - overlap_frames)
+    windows = []
+    start = 0
+    while True:
+        end = min(start + window_frames, num_frames)
+        windows.append((start, end))
+        if end >= num_frames:
+            break
+        start += step
+    if len(windows) > 1 and windows[-1][1] - windows[-1][0] < window_frames // 2:
+        windows.pop()
+        windows[-1] = (windows[-1][0], num_frames)
+    return windows
+
+def stitch_beats(window_beats, overlaps, tolerance=0.1):
+    """
+    Join the beats of consecutive windows into one sequence
+
+    :param window_beats: (list of np.ndarray) sorted beat times in seconds of every window
+    :param overlaps: (list of (float, float)) start and end in seconds of the overlap between window i and i + 1
+    :param tolerance: (float) fraction of the beat period two beats may differ by and still be the same beat
+    :return: (np.ndarray) beat times, (int) seams joined on a shared beat, the rest were cut in the middle
+    """
+    beats = np.asarray(window_beats[0], dtype=np.float64)
+    anchored = 0
+    for right, (overlap_start, overlap_end) in zip(window_beats[1:], overlaps):
+        right = np.asarray(right, dtype=np.float64)
+        middle = (overlap_start + overlap_end) / 2
+        left_in = beats[(beats >= overlap_start) & (beats < overlap_end)]
+        right_in = right[(right >= overlap_start) & (right < overlap_end)]
+        periods = np.diff(left_in) if len(left_in) > 1 else np.diff(right_in)
+        period = float(np.median(periods)) if len(periods) else 0.0
+        anchor = None
+        if period > 0 and len(right_in):
+            # The right window's nearest beat to every beat of the left one.
+            after = np.searchsorted(right_in, left_in)
+            lower = right_in[np.clip(after - 1, 0, len(right_in) - 1)]
+            upper = right_in[np.clip(after, 0, len(right_in) - 1)]
+            nearest = np.where(np.abs(left_in - lower) <= np.abs(left_in - upper), lower, upper)
+            agree = np.flatnonzero(np.abs(left_in - nearest) <= tolerance * period)
+            if len(agree):
+                best = agree[np.argmin(np.abs(left_in[agree] - middle))]
+                anchor = (left_in[best], nearest[best])
+        if anchor is not None:
+            anchored += 1
+            beats = np.concatenate([beats[beats <= anchor[0]], right[right > anchor[1]]])
+        else:
+            left = beats[beats < middle]
+            right = right[right >= middle]
+            # No common beat, at least don't leave two beats closer than half a period at the cut.
+            if len(left) and period > 0:
+                right = right[right - left[-1] >= period / 2]
+            beats = np.concatenate([left, right])
+    return beats, anchored
+
+def _track_window(engine, onset_envelope, sr, hop_length, offset):
+    # Runs in a worker process.
+    tempo, beat_times = engine.track(onset_envelope, sr, hop_length)
+    return tempo, np.asarray(beat_times, dtype=np.float64) + offset
+
+class ChunkedBeatTracker(object):
+    """
+    Long-file mode of a beat engine: tracks overlapping windows of the onset envelope on a process
+    pool and stitches them into one beat sequence. Engines only see one window at a time, so their
+    cost and memory stay those of a few minutes of audio however long the track is.
+    """
+    def __init__(self, engine, window_seconds=CHUNK_WINDOW_SECONDS, overlap_seconds=CHUNK_OVERLAP_SECONDS, workers=None, should_stop=None):
+        """
+        :param should_stop: (callable) optional, checked as windows complete, True abandons the rest
+        """
+        self.engine = engine
+        self.window_seconds = window_seconds
+        self.overlap_seconds = overlap_seconds
+        self.workers = workers
+        self.should_stop = should_stop
+        self.last_runtime = None
+        self.windows = 0
+        self.anchored_seams = 0
+
+    def track(self, onset_envelope, sr, hop_length=ANALYSIS_HOP_LENGTH):
+        """
+        Detect beats, like the engine's own track
+
+        :return: (float) tempo in bpm (the median of the windows), (np.ndarray) beat times in seconds,
+                 empty if should_stop abandoned the run
+        """
+        from concurrent.futures import as_completed
+        start = time.perf_counter()
+        onset_envelope = np.asarray(onset_envelope)
+        frames_per_second = sr / float(hop_length)
+        windows = chunk_windows(len(onset_envelope), int(round(self.window_seconds * frames_per_second)),
+                                int(round(self.overlap_seconds * frames_per_second)))
+        results = [None] * len(windows)
+        pool = _get_process_pool("chunks", self.workers or os.cpu_count() or 1)
+        futures = {pool.submit(_track_window, self.engine, onset_envelope[window_start:window_end], sr, hop_length,
+                               window_start / frames_per_second): i
+                   for i, (window_start, window_end) in enumerate(windows)}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            if self.should_stop is not None and self.should_stop():
+                for pending in futures:
+                    pending.cancel()
+                break
+        if any(result is None for result in results):
+            return 0.0, np.zeros(0)
+        overlaps = [(windows[i + 1][0] / frames_per_second, windows[i][1] / frames_per_second) for i in range(len(windows) - 1)]
+        beat_times, self.anchored_seams = stitch_beats([beats for _, beats in results], overlaps)
+        self.windows = len(windows)
+        self.last_runtime = time.perf_counter() - start
+        # The engine itself only ran in the workers, it reports the whole run.
+        self.engine.last_runtime = self.last_runtime
+        return float(np.median([tempo for tempo, _ in results])), beat_times
+
+def beat_tracker_for(engine, onset_envelope, sr, hop_length=ANALYSIS_HOP_LENGTH, should_stop=None):
+    """
+    The engine itself, or its long-file mode for envelopes longer than LONG_FILE_SECONDS when
+    there is more than one core to spread the windows on
+
+    :return: (BeatEngine or ChunkedBeatTracker) anything with track(onset_envelope, sr, hop_length)
+    """
+    if len(onset_envelope) * hop_length <= LONG_FILE_SECONDS * sr or (os.cpu_count() or 1) < 2:
+        return engine
+    return ChunkedBeatTracker(engine, should_stop=should_stop)
+
+###############################
+###############################
+###############################
+# TEMPO MAP
+#  - Local tempo every TEMPO_MAP_STEP_SECONDS from an autocorrelation tempogram of the onset envelope
+#    the beats were tracked on. Windows are autocorrelated in blocks with one FFT each, so the cost is
+#    linear in the track length and the memory bounded by the block size.
+#  - Stretches of steady tempo become segments, what's between them is a tempo change.
+###############################
+def local_tempo(onset_envelope, sr, hop_length=ANALYSIS_HOP_LENGTH, win_length=TEMPO_MAP_WINDOW, step_seconds=TEMPO_MAP_STEP_SECONDS,
+                start_bpm=120.0, std_bpm=1.0, max_tempo=320.0, block=1024):
+    """
+    Tempo of sliding windows of an onset envelope
+
+    :param start_bpm: (float) center of the log-normal tempo prior, as in librosa.feature.tempo
+    :param std_bpm: (float) width of the prior in octaves
+    :return: (np.ndarray) window centers in seconds, (np.ndarray) bpm of every window, NaN where silent
+    """
+    envelope = np.asarray(onset_envelope, dtype=np.float64)
+    frames_per_second = sr / float(hop_length)
+    step = max(1, int(round(step_seconds * frames_per_second)))
+    centers = np.arange(0, len(envelope), step)
+    # Window i is centered on frame centers[i]. A view, the windows are only copied a block at a time.
+    windows = np.lib.stride_tricks.sliding_window_view(np.pad(envelope, (win_length // 2, win_length - win_length // 2 - 1)), win_length)
+    lags = np.arange(1, win_length)
+    bpms = 60.0 * frames_per_second / lags
+    prior = np.exp(-0.5 * ((np.log2(bpms) - np.log2(start_bpm)) / std_bpm) ** 2)
+    prior[bpms > max_tempo] = 0.0
+    taper = np.hanning(win_length)
+    n_fft = 2 * win_length
+    tempo = np.empty(len(centers))
+    for first in range(0, len(centers), block):
+        frames = windows[centers[first:first + block]] * taper
+        spectrum = np.fft.rfft(frames, n=n_fft, axis=1)
+        score = np.fft.irfft(spectrum.real ** 2 + spectrum.imag ** 2, n=n_fft, axis=1)[:, 1:win_length] * prior
+        best = np.argmax(score, axis=1)
+        # Parabolic interpolation around the peak, whole lags are a few bpm apart at usual tempos.
+        rows = np.arange(len(best))
+        y0 = score[rows, np.maximum(best - 1, 0)]
+        y1 = score[rows, best]
+        y2 = score[rows, np.minimum(best + 1, len(lags) - 1)]
+        curvature = y0 - 2 * y1 + y2
+        inner = (best > 0) & (best < len(lags) - 1) & (curvature < 0)
+        shift = np.where(inner, 0.5 * (y0 - y2) / np.where(inner, curvature, 1.0), 0.0)
+        block_tempo = 60.0 * frames_per_second / (lags[best] + shift)
+        block_tempo[y1 <= 0] = np.nan
+        tempo[first:first + block] = block_tempo
+    return centers / frames_per_second, tempo
+
+class TempoMap(object):
+    """
+    Local tempo of a track: times and bpm of every tempogram window (median smoothed over five),
+    and segments, (start, end, bpm, steady) in seconds, of steady tempo and of what's in between.
+    """
+    def __init__(self, times, bpm, duration=None, tolerance=TEMPO_CHANGE_TOLERANCE, min_segment_seconds=TEMPO_MIN_SEGMENT_SECONDS):
+        self.times = np.asarray(times, dtype=np.float64)
+        self.bpm = np.asarray(bpm, dtype=np.float64)
+        self.step = float(self.times[1] - self.times[0]) if len(self.times) > 1 else 0.0
+        self.duration = duration if duration is not None else (float(self.times[-1]) + self.step / 2 if len(self.times) else 0.0)
+        self.segments = self._segment(tolerance, min_segment_seconds)
+
+    @classmethod
+    def from_onset_envelope(cls, onset_envelope, sr, hop_length=ANALYSIS_HOP_LENGTH, **params):
+        """Map of the onset envelope the beats were tracked on, no second pass over the audio."""
+        times, bpm = local_tempo(onset_envelope, sr, hop_length, **params)
+        if len(bpm) >= 5:
+            # Smooth out single windows that jumped an octave or caught a fill.
+            padded = np.pad(bpm, 2, mode="edge")
+            windows = np.lib.stride_tricks.sliding_window_view(padded, 5)
+            valid = ~np.isnan(windows)
+            counts = valid.sum(axis=1)
+            ordered = np.sort(np.where(valid, windows, np.inf), axis=1)
+            middle = ordered[np.arange(len(bpm)), np.maximum(counts - 1, 0) // 2]
+            bpm = np.where(counts > 0, middle, np.nan)
+        return cls(times, bpm, duration=len(onset_envelope) * hop_length / float(sr))
+
+    def _segment(self, tolerance, min_segment_seconds):
+        segments = []
+        if not len(self.bpm):
+            return segments
+        bounds = []
+        start = 0
+        total = 0.0
+        count = 0
+        for i, value in enumerate(self.bpm):
+            if np.isnan(value):
+                continue
+            # Compared with the segment's mean so far, so slow ramps are split too.
+            if count and abs(value - total / count) > tolerance * total / count:
+                bounds.append((start, i))
+                start = i
+                total = 0.0
+                count = 0
+            total += value
+            count += 1
+        bounds.append((start, len(self.bpm)))
+        for first, last in bounds:
+            start_time = 0.0 if first == 0 else float(self.times[first]) - self.step / 2
+            end_time = self.duration if last == len(self.bpm) else float(self.times[last]) - self.step / 2
+            values = self.bpm[first:last]
+            values = values[~np.isnan(values)]
+            tempo = float(np.median(values)) if len(values) else float("nan")
+            steady = end_time - start_time >= min_segment_seconds
+            if segments and not steady and not segments[-1][3]:
+                # Consecutive short segments are one change.
+                segments[-1] = (segments[-1][0], end_time, tempo, False)
+            else:
+                segments.append((start_time, end_time, tempo, steady))
+        return segments
+
+    def tempo_at(self, seconds):
+        """:return: (float or np.ndarray) local tempo in bpm at the given times"""
+        return np.interp(seconds, self.times, self.bpm)
+
+    def change_regions(self):
+        """
+        Where the tempo changes
+
+        :return: (list of (float, float)) start and end in seconds. An abrupt change between two
+                 steady segments is one window step wide.
+        """
+        regions = []
+        for previous, segment in zip(self.segments, self.segments[1:]):
+            if not segment[3]:
+                regions.append((segment[0], segment[1]))
+            elif previous[3]:
+                regions.append((segment[0] - self.step / 2, segment[0] + self.step / 2))
+        return regions
+
+    def nbytes(self):
+        return self.times.nbytes + self.bpm.nbytes
+
+###############################
+###############################
+###############################
+# PERSISTENT ANALYSIS CACHE
+#  - Entries are keyed by a hash of the audio file contents plus the analysis parameters.
+#  - Each entry is a standalone .npz file, so several processes can share the same folder.
+#  - The modification time of an entry is its last access time, which drives LRU eviction.
+###############################
+def file_content_hash(path, chunk_size=1 << 20):
+    """
+    Hash the contents of a file, reading it in chunks
+
+    :param path: (str) path to the file
+    :return: (str) hex digest
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class LRUDirectory(object):
+    """
+    A folder of standalone entry files, kept under max_bytes by removing the least recently used ones.
+    Subclasses set the file suffix and read and write the payload, touching an entry when they read it.
+    """
+    suffix = ""
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _entry_path(self, key):
+        return os.path.join(self.folder, key + self.suffix)
+
+    def _write(self, key, write):
+        """
+        Store an entry and evict the least recently used ones if needed
+
+        :param write: (callable) writes the payload to the binary file object it's given
+        """
+        with self._lock:
+            os.makedirs(self.folder, exist_ok=True)
+            # Write to a temp file first so readers never see a half written entry.
+            fd, tmp_path = tempfile.mkstemp(suffix=".part", dir=self.folder)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    write(f)
+                os.replace(tmp_path, self._entry_path(key))
+            except OSError:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            self._evict()
+
+    def entries(self):
+        """
+        List the entries, most recently used first
+
+        :return: (list of dict) key, path, bytes and last_used (epoch seconds) of each entry
+        """
+        if not os.path.isdir(self.folder):
+            return []
+        entries = []
+        for name in os.listdir(self.folder):
+            if not name.endswith(self.suffix):
+                continue
+            entry_path = os.path.join(self.folder, name)
+            try:
+                stat = os.stat(entry_path)
+            except OSError:
+                continue
+            entries.append({"key": name[:-len(self.suffix)], "path": entry_path, "bytes": stat.st_size, "last_used": stat.st_mtime})
+        entries.sort(key=lambda e: e["last_used"], reverse=True)
+        return entries
+
+    def stats(self):
+        entries = self.entries()
+        return {
+            "dir": self.folder,
+            "entries": len(entries),
+            "bytes": sum(e["bytes"] for e in entries),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def remove(self, key):
+        try:
+            os.remove(self._entry_path(key))
+        except FileNotFoundError:
+            pass
+
+    def purge(self):
+        """Remove every entry. Returns the number of bytes freed."""
+        freed = 0
+        for entry in self.entries():
+            try:
+                os.remove(entry["path"])
+                freed += entry["bytes"]
+            except OSError:
+                pass
+        return freed
+
+    def _evict(self):
+        entries = self.entries()
+        total = sum(e["bytes"] for e in entries)
+        # entries are sorted newest first, so pop from the end.
+        while entries and total > self.max_bytes:
+            oldest = entries.pop()
+            try:
+                os.remove(oldest["path"])
+            except OSError:
+                # Still open or mapped elsewhere, on Windows.
+                continue
+            total -= oldest["bytes"]
+
+class AnalysisCache(LRUDirectory):
+    suffix = ".npz"
+
+    def __init__(self, cache_dir="", max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        super().__init__(cache_dir if len(cache_dir) else DEFAULT_CACHE_DIR, max_bytes)
+        # Content hashes of files we already hashed, keyed by (path, size, mtime).
+        self._hashes = {}
+
+    def make_key(self, path, params):
+        """
+        Build the cache key of an audio file for a given set of analysis parameters
+
+        :param path: (str) path to the audio file
+        :param params: (dict) analysis parameters, must be json serializable
+        :return: (str) cache key
+        """
+        stat = os.stat(path)
+        file_id = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        content_hash = self._hashes.get(file_id)
+        if content_hash is None:
+            content_hash = file_content_hash(path)
+            self._hashes[file_id] = content_hash
+        params_json = json.dumps(dict(params, cache_version=CACHE_FORMAT_VERSION), sort_keys=True)
+        params_hash = hashlib.blake2b(params_json.encode("utf-8"), digest_size=8).hexdigest()
+        return f"{content_hash}-{params_hash}"
+
+    def get(self, key):
+        """
+        Look an entry up, marking it as recently used
+
+        :return: (dict) tempo, beat_times and onset_envelope, or None on a miss
+        """
+        entry_path = self._entry_path(key)
+        try:
+            with np.load(entry_path) as entry:
+                result = {
+                    "tempo": float(entry["tempo"]),
+                    "beat_times": entry["beat_times"],
+                    "onset_envelope": entry["onset_envelope"],
+                }
+            os.utime(entry_path)
+        except (OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def put(self, key, tempo, beat_times, onset_envelope, source=""):
+        """Store an analysis result and evict the least recently used entries if needed."""
+        self._write(key, lambda f: np.savez(f, tempo=np.float64(tempo), beat_times=np.asarray(beat_times, dtype=np.float64),
+                                            onset_envelope=np.asarray(onset_envelope, dtype=np.float32), source=np.str_(source)))
+
+    def source_of(self, key):
+        """Path of the audio file an entry was computed from, as recorded when it was stored."""
+        try:
+            with np.load(self._entry_path(key)) as entry:
+                return str(entry["source"])
+        except (OSError, KeyError, ValueError):
+            return ""
+
+###############################
+###############################
+###############################
+# WAVEFORM PEAKS
+#  - Multi-resolution min/max pyramid: level 0 holds the min and max of every PEAK_BASE_BLOCK samples,
+#    each next level halves the resolution of the previous one.
+#  - A query picks the coarsest level that still has a few bins per pixel, so drawing costs
+#    O(width) at any zoom level. Below the base resolution the raw samples are used.
+#  - Multichannel data is mixed down on the fly, chunk by chunk, so no full mono copy is kept.
+#  - PeakStore keeps the pyramid of every opened file in a peak file, memory mapped on reopen, so
+#    the waveform is drawn before the file is decoded again.
+###############################
+PEAK_BASE_BLOCK = 64
+PEAK_BINS_PER_PIXEL = 4
+PEAK_CHUNK_BINS = 1 << 14
+
+class PeakPyramid(object):
+
+    def __init__(self, samples, base_block=PEAK_BASE_BLOCK, levels=None, length=None):
+        # samples is either mono with shape (samples,) or (channels, samples). A pyramid read from a
+        # peak file comes with its levels and length, and samples is None until attach().
+        self.samples = samples
+        self.base_block = base_block
+        self.length = samples.shape[-1] if samples is not None else length
+        if levels is not None:
+            self.levels = levels
+        else:
+            self.levels = []  # list of (block_size, mins, maxs)
+            self._build()
+
+    def __len__(self):
+        return self.length
+
+    def attach(self, samples):
+        """The decoded samples of a pyramid read from a peak file, used when zoomed in past the base level."""
+        self.samples = samples
+
+    def mono(self, start, end):
+        """Mono mix of samples [start, end)."""
+        if self.samples.ndim == 1:
+            return self.samples[start:end]
+        if self.samples.shape[0] == 1:
+            return self.samples[0, start:end]
+        return np.mean(self.samples[:, start:end], axis=0, dtype=np.float32)
+
+    def _build(self):
+        size = -(-len(self) // self.base_block)
+        block = self.base_block
+        self.levels = [(block, np.zeros(size, dtype=np.float32), np.zeros(size, dtype=np.float32))]
+        while size > 1:
+            size = -(-size // 2)
+            block *= 2
+            self.levels.append((block, np.zeros(size, dtype=np.float32), np.zeros(size, dtype=np.float32)))
+        self.update(0, len(self))
+
+    def update(self, start, end):
+        """Recompute the bins covering samples [start, end) after they changed, e.g. while streaming."""
+        start, end = max(0, int(start)), min(len(self), int(end))
+        if end <= start or self.samples is None:
+            return
+        block, mins, maxs = self.levels[0]
+        lo, hi = start // block, -(-end // block)
+        for chunk_lo in range(lo, hi, PEAK_CHUNK_BINS):
+            chunk_hi = min(chunk_lo + PEAK_CHUNK_BINS, hi)
+            mins[chunk_lo:chunk_hi], maxs[chunk_lo:chunk_hi] = _block_min_max(self.mono(chunk_lo * block, chunk_hi * block), block)
+        for (_, source_mins, source_maxs), (_, mins, maxs) in zip(self.levels, self.levels[1:]):
+            lo, hi = lo // 2, -(-hi // 2)
+            mins[lo:hi], maxs[lo:hi] = _block_min_max(source_mins[lo * 2:hi * 2], 2, source_maxs[lo * 2:hi * 2])
+
+    def nbytes(self):
+        return sum(mins.nbytes + maxs.nbytes for _, mins, maxs in self.levels)
+
+    def query(self, start, end, width):
+        """
+        Min and max of the samples covered by each pixel column
+
+        :param start: (int) first sample of the view
+        :param end: (int) sample after the last one of the view
+        :param width: (int) number of pixel columns
+        :return: (np.ndarray) mins, (np.ndarray) maxs, both of length <= width. Columns past the end of
+                 the data are left out, so the result can be shorter than width.
+        """
+        total = len(self)
+        start = max(0, int(start))
+        end = min(total, int(end))
+        if width <= 0 or end <= start:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32)
+        samples_per_pixel = (end - start) / float(width)
+
+        # Keep a few bins per column so column edges stay close to the exact sample positions.
+        block, mins, maxs, size = 1, None, None, total
+        for level in self.levels:
+            if level[0] * PEAK_BINS_PER_PIXEL > samples_per_pixel:
+                break
+            block, mins, maxs = level
+            size = len(mins)
+        if mins is None and self.samples is None:
+            # Not decoded yet, the base level is as close as it gets.
+            block, mins, maxs = self.levels[0]
+            size = len(mins)
+
+        # First bin of each column in the chosen level, a column spans up to the next column's first bin.
+        edges = start + np.arange(width + 1) * samples_per_pixel
+        lo = np.minimum((edges[:-1] // block).astype(np.int64), size - 1)
+        first = lo[0]
+        last = min(max(int(np.ceil(edges[-1] / block)), lo[-1] + 1), size)
+        if mins is None:
+            window_mins = window_maxs = np.asarray(self.mono(first, last), dtype=np.float32)
+        else:
+            window_mins, window_maxs = mins[first:last], maxs[first:last]
+        # Columns share a bin when zoomed in past the raw samples, and reduceat wants increasing
+        # indices, so reduce over the distinct starts and spread the result back.
+        starts, inverse = np.unique(lo - first, return_inverse=True)
+        column_mins = np.minimum.reduceat(window_mins, starts)[inverse]
+        column_maxs = np.maximum.reduceat(window_maxs, starts)[inverse]
+        return column_mins, column_maxs
+
+class PeakStore(LRUDirectory):
+    """
+    Peak files: the min/max pyramid of an audio file as float16, after a small JSON header. A peak file
+    is valid while the audio file keeps the size and mtime, and the decode rate, it was written for.
+    """
+    suffix = ".peaks"
+
+    def __init__(self, folder="", max_bytes=DEFAULT_PEAKS_MAX_BYTES):
+        super().__init__(folder if len(folder) else DEFAULT_PEAKS_DIR, max_bytes)
+
+    def key_for(self, audio_path):
+        return hashlib.blake2b(os.path.abspath(audio_path).encode("utf-8"), digest_size=16).hexdigest()
+
+    def path_for(self, audio_path):
+        return self._entry_path(self.key_for(audio_path))
+
+    def load(self, audio_path, samplerate):
+        """
+        Memory map the peak file of an audio file
+
+        :param samplerate: (int) decode rate, the pyramid is in samples at that rate
+        :return: (PeakPyramid) without samples, (int) channels, or None if there's no valid peak file
+        """
+        peak_path = self.path_for(audio_path)
+        try:
+            stat = os.stat(audio_path)
+            with open(peak_path, 'rb') as f:
+                if f.read(len(PEAK_FILE_MAGIC)) != PEAK_FILE_MAGIC:
+                    raise ValueError(f"{peak_path} is not a peak file")
+                header_size = int.from_bytes(f.read(4), "little")
+                header = json.loads(f.read(header_size))
+            valid = (header["version"] == PEAK_FILE_VERSION and header["size"] == stat.st_size
+                     and header["mtime_ns"] == stat.st_mtime_ns and header["samplerate"] == samplerate)
+            if valid:
+                data = np.memmap(peak_path, dtype=np.float16, mode='r', offset=len(PEAK_FILE_MAGIC) + 4 + header_size)
+                levels = [(block, data[offset:offset + count], data[offset + count:offset + 2 * count])
+                          for block, offset, count in header["levels"]]
+                os.utime(peak_path)
+        except (OSError, KeyError, ValueError):
+            valid = False
+        if not valid:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return PeakPyramid(None, header["base_block"], levels, header["length"]), header["channels"]
+
+    def save(self, audio_path, samplerate, peaks, channels):
+        """Write the peak file of an audio file, replacing any previous one."""
+        stat = os.stat(audio_path)
+        levels = []
+        offset = 0
+        for block, mins, _ in peaks.levels:
+            levels.append([block, offset, len(mins)])
+            offset += 2 * len(mins)
+        header = json.dumps({"version": PEAK_FILE_VERSION, "source": os.path.abspath(audio_path), "size": stat.st_size,
+                             "mtime_ns": stat.st_mtime_ns, "samplerate": samplerate, "channels": channels,
+                             "length": len(peaks), "base_block": peaks.base_block, "levels": levels}).encode("utf-8")
+        # Padded so the float16 data after it stays aligned.
+        header += b" " * (-(len(PEAK_FILE_MAGIC) + 4 + len(header)) % 8)
+
+        def write(f):
+            f.write(PEAK_FILE_MAGIC)
+            f.write(len(header).to_bytes(4, "little"))
+            f.write(header)
+            for _, mins, maxs in peaks.levels:
+                f.write(np.asarray(mins, dtype=np.float16).tobytes())
+                f.write(np.asarray(maxs, dtype=np.float16).tobytes())
+        self._write(self.key_for(audio_path), write)
+
+def read_only_view(array):
+    """View of an array that can't be written through, for sharing buffers with the display."""
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+def _block_min_max(mins, block, maxs=None):
+    """Reduce arrays by blocks of `block` elements, keeping a partial last block."""
+    if maxs is None:
+        maxs = mins
+    full = len(mins) // block * block
+    out_mins = mins[:full].reshape(-1, block).min(axis=1)
+    out_maxs = maxs[:full].reshape(-1, block).max(axis=1)
+    if full < len(mins):
+        out_mins = np.append(out_mins, mins[full:].min())
+        out_maxs = np.append(out_maxs, maxs[full:].max())
+    return out_mins.astype(np.float32, copy=False), out_maxs.astype(np.float32, copy=False)
+
+###############################
+###############################
+###############################
+# TIMING SPANS
+#  - Named spans around the pipeline stages, paints and host calls, aggregated per name for a session report.
+#  - Optionally appended to a JSON lines log, one object per span, to collect from workstations.
+#    Spans only queue their log entry, a thread writes them every TIMING_LOG_FLUSH_SECONDS, so no
+#    file I/O happens inside what is being timed, paint events included.
+###############################
+TIMING_LOG_FLUSH_SECONDS = 1.0
+
+class SpanTimer(object):
+    """Thread safe: spans come from the GUI thread, the analysis thread and the host threads."""
+
+    def __init__(self, log_path=None):
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.log = None
+        # Log entries not written yet, and the lock the writes happen under.
+        self._pending = []
+        self._log_lock = threading.Lock()
+        self._stop_flushing = threading.Event()
+        self._flusher = None
+        if log_path:
+            self.open_log(log_path)
+
+    def open_log(self, path, flush_interval=TIMING_LOG_FLUSH_SECONDS):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.log = open(path, 'a')
+        # A crash loses at most the last flush_interval seconds of spans.
+        self._stop_flushing.clear()
+        self._flusher = threading.Thread(target=self._flush_loop, args=(flush_interval,), name="timing log", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def _flush_loop(self, interval):
+        while not self._stop_flushing.wait(interval):
+            self.flush()
+
+    def flush(self):
+        """Write the queued log entries."""
+        with self._log_lock:
+            with self.lock:
+                pending, self._pending = self._pending, []
+            if self.log is not None and pending:
+                self.log.write("".join(json.dumps(entry, default=str) + "\n" for entry in pending))
+                self.log.flush()
+
+    def close(self):
+        if self._flusher is not None:
+            self._stop_flushing.set()
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+        with self._log_lock:
+            if self.log is not None:
+                self.log.close()
+                self.log = None
+
+    def span(self, name, **info):
+        """
+        Time a block: with timer.span("decode", file=path): ...
+
+        :param info: extra fields for the log line
+        """
+        return _Span(self, name, info)
+
+    def record(self, name, seconds, **info):
+        with self.lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = {"count": 0, "total": 0.0, "max": 0.0, "last": 0.0}
+            stat["count"] += 1
+            stat["total"] += seconds
+            stat["max"] = max(stat["max"], seconds)
+            stat["last"] = seconds
+            if self.log is not None:
+                self._pending.append(dict(info, time=time.time(), name=name, seconds=seconds, thread=threading.current_thread().name))
+
+    def last(self, name):
+        """:return: (float) seconds of the latest span with that name, None if there was none"""
+        with self.lock:
+            stat = self.stats.get(name)
+            return stat["last"] if stat is not None else None
+
+    def summary(self, names):
+        """:return: (str) latest time of each of the names that ran, ex: 'decode 0.81 s, beat tracking 0.52 s'"""
+        parts = []
+        for name in names:
+            seconds = self.last(name)
+            if seconds is not None:
+                parts.append(f"{name} {seconds:.2f} s")
+        return ", ".join(parts)
+
+    def report(self):
+        """:return: (str) one line per span name, slowest total first"""
+        with self.lock:
+            rows = sorted(self.stats.items(), key=lambda item: item[1]["total"], reverse=True)
+        lines = [f"{'span':<32}{'count':>7}{'total s':>10}{'mean ms':>10}{'max ms':>10}"]
+        for name, stat in rows:
+            lines.append(f"{name:<32}{stat['count']:>7}{stat['total']:>10.2f}{stat['total'] / stat['count'] * 1000:>10.1f}{stat['max'] * 1000:>10.1f}")
+        return "\n".join(lines)
+
+class _Span(object):
+
+    def __init__(self, timer, name, info):
+        self.timer = timer
+        self.name = name
+        self.info = info
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.info["error"] = exc_type.__name__
+        self.timer.record(self.name, time.perf_counter() - self.start, **self.info)
+        return False
@@ -0,0 +1,33 @@
+import pytest
+
+from automarker_bench import AEStandIn
+from automarkerQt import AE_JSWrapper
+
+DELAY = 0.2
+
+@pytest.fixture
+def wrapper(tmp_path):
+    wrapper = AE_JSWrapper(returnFolder=str(tmp_path))
+    wrapper.runner = AEStandIn(wrapper.returnFile, DELAY)
+    yield wrapper
+    wrapper.runner.close()
+    wrapper.returnWaiter.close()
+
+def run_command(wrapper):
+    wrapper.jsNewCommandGroup()
+    wrapper.jsWriteDataOut("1")
+    wrapper.jsWriteCommands()
+    wrapper.jsExecuteCommand().wait()
+
+def test_return_latency_follows_the_host(wrapper):
+    for _ in range(3):
+        run_command(wrapper)
+        # The stand-in writes an older command's result first, only this command's one is read back.
+        assert wrapper.readReturn() == ["1"]
+        assert wrapper.latencies[-1][1] == pytest.approx(DELAY, abs=0.1)
+
+def test_missing_reply_times_out(wrapper):
+    wrapper.runner.answer = False
+    run_command(wrapper)
+    with pytest.raises(TimeoutError):
+        wrapper.readReturn(0.5)
@@ -0,0 +1,10 @@
+import pytest
+
+from automarker_bench import check_chunked
+
+def test_chunked_matches_single_pass():
+    # Short windows, so a two minute click track still crosses several seams.
+    result = check_chunked(workers=1, seconds=120.0, window_seconds=30.0, overlap_seconds=8.0)
+    assert result["windows"] > 2
+    assert result["anchored_seams"] == result["windows"] - 1
+    assert result["max_beat_deviation"] == pytest.approx(0.0, abs=1e-9)
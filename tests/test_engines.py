@@ -0,0 +1,16 @@
+import numpy as np
+import pytest
+
+from automarker_bench import synth_bar, SUITE_TEMPO, SUITE_KINDS
+from automarker_core import compute_onset_envelope, get_beat_engine, BEAT_ENGINES
+
+SR = 22050
+
+@pytest.mark.parametrize("kind", SUITE_KINDS)
+def test_engines_agree_on_the_tempo_octave(kind):
+    bar = synth_bar(kind, SUITE_TEMPO[kind], SR)
+    onset_envelope = compute_onset_envelope(np.tile(np.mean(bar, axis=1), 30), SR)
+    tempos = {name: get_beat_engine(name).track(onset_envelope, SR)[0] for name in BEAT_ENGINES}
+    for name, tempo in tempos.items():
+        # Hi-hats on the eighths mustn't double the tempo: closer than half an octave to the synthetic one.
+        assert abs(np.log2(tempo / SUITE_TEMPO[kind])) < 0.5, tempos